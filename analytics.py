@@ -0,0 +1,273 @@
+"""Stock valuation, margins, sell-through and dead stock, computed with NumPy over the whole inventory."""
+import argparse
+import sys
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtWidgets import QComboBox, QDialog, QHBoxLayout, QLabel, QMessageBox, QSpinBox, QTableView, QVBoxLayout
+
+from core import InventoryRepository
+
+
+DEFAULT_DAYS = 365
+DEAD_STOCK_LIMIT = 100
+GROUPINGS = {"shelf": "Hylla", "lang": "Språk", "decade": "Årtionde"}
+UNKNOWN = "okänd"
+GROUP_HEADERS = ["Grupp", "Titlar", "Exemplar", "Inköpsvärde", "Försäljningsvärde", "Marginal", "Marginal %", "Sålda", "Intäkt", "Såld andel %"]
+DEAD_STOCK_HEADERS = ["ISBN", "Författare", "Titel", "Hylla", "Exemplar", "Inköpsvärde"]
+
+GroupValuation = namedtuple(
+    "GroupValuation", ["group", "titles", "copies", "cost", "retail", "margin", "margin_percent", "sold", "revenue", "sell_through"]
+)
+DeadStock = namedtuple("DeadStock", ["isbn", "author", "title", "shelf", "copies", "cost"])
+
+
+def percent(part, whole):
+    """Return part as a percentage of whole, elementwise, with NaN where whole is zero."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(whole > 0, 100 * part / whole, np.nan)
+
+
+def factorize(values):
+    """Return (a code per value, the distinct values in code order), counting None as UNKNOWN."""
+    labels = {}
+    codes = np.fromiter((labels.setdefault(value or UNKNOWN, len(labels)) for value in values), dtype=np.int64, count=len(values))
+    return codes, list(labels)
+
+
+def number(value):
+    """Return a NumPy number as a rounded Python number, or None for NaN."""
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return round(value, 1) if value != round(value) else int(value)
+
+
+class StockData:
+    """The inventory columns and per-title sales needed for analytics, as NumPy arrays in inventory order.
+
+    Shelves and languages are kept as integer codes into their distinct values, so grouping on them is a bincount.
+    """
+
+    def __init__(self, inventory, sales, days):
+        """Build the arrays from (ISBN, amount, buy_price, sell_price, row, lang, year) rows and (ISBN, units, revenue) totals."""
+        self.days = days
+        count = len(inventory)
+        isbns, amounts, buy_prices, sell_prices, shelves, langs, years = ([row[column] for row in inventory] for column in range(7))
+        self.isbns = isbns
+        self.amount = np.nan_to_num(np.array(amounts, dtype=float)).clip(min=0)
+        self.buy_price = np.array(buy_prices, dtype=float)
+        self.sell_price = np.array(sell_prices, dtype=float)
+        self.shelf, self.shelves = factorize(shelves)
+        self.lang, self.langs = factorize(langs)
+        self.year = np.array(years, dtype=float)
+        self.cost = self.amount * np.nan_to_num(self.buy_price)
+        self.retail = self.amount * np.nan_to_num(self.sell_price)
+        self.sold = np.zeros(count)
+        self.revenue = np.zeros(count)
+        if not sales or not count:
+            return
+        # A dict join is several times faster than searchsorted over NumPy string arrays.
+        rows_by_isbn = dict(zip(isbns, range(count)))
+        rows = np.array([rows_by_isbn.get(sale[0], -1) for sale in sales], dtype=np.int64)
+        units = np.array([sale[1] for sale in sales], dtype=float)
+        revenue = np.nan_to_num(np.array([sale[2] for sale in sales], dtype=float))
+        found = rows >= 0
+        self.sold = np.bincount(rows[found], weights=units[found], minlength=count)
+        self.revenue = np.bincount(rows[found], weights=revenue[found], minlength=count)
+
+    def __len__(self):
+        """Return the number of titles."""
+        return len(self.isbns)
+
+    def groups(self, by):
+        """Return (the group code of every title, the group labels) for one of GROUPINGS."""
+        if by == "shelf":
+            return self.shelf, self.shelves
+        if by == "lang":
+            return self.lang, self.langs
+        decades = np.where(np.isnan(self.year), -1, np.nan_to_num(self.year) // 10 * 10).astype(np.int64)
+        values, codes = np.unique(decades, return_inverse=True)
+        return codes, [UNKNOWN if decade < 0 else f"{decade}-tal" for decade in values.tolist()]
+
+
+def load(database, days=DEFAULT_DAYS, today=None):
+    """Read the inventory, and the sales per title over the last days from the daily rollup, in one bulk read each."""
+    since = (today or date.today()) - timedelta(days=days)
+    inventory = database.fetchall("SELECT ISBN, amount, buy_price, sell_price, row, lang, year FROM inventory")
+    sales = database.fetchall("SELECT ISBN, SUM(units), SUM(revenue) FROM sales_daily WHERE day >= ? GROUP BY ISBN", (since,))
+    return StockData(inventory, sales, days)
+
+
+def totals(data):
+    """Return the value, margin and sell-through of the whole stock as a dict."""
+    cost = data.cost.sum()
+    retail = data.retail.sum()
+    copies = data.amount.sum()
+    sold = data.sold.sum()
+    return {
+        "titles": len(data),
+        "copies": number(copies),
+        "cost": number(cost),
+        "retail": number(retail),
+        "margin": number(retail - cost),
+        "margin_percent": number(percent(retail - cost, retail)),
+        "sold": number(sold),
+        "revenue": number(data.revenue.sum()),
+        "sell_through": number(percent(sold, sold + copies)),
+        "without_buy_price": int(np.count_nonzero((data.amount > 0) & np.isnan(data.buy_price))),
+        "without_sell_price": int(np.count_nonzero((data.amount > 0) & np.isnan(data.sell_price))),
+    }
+
+
+def valuation(data, by="shelf"):
+    """Return a GroupValuation per shelf, language or decade, the most valuable stock first."""
+    inverse, labels = data.groups(by)
+
+    def total(values):
+        return np.bincount(inverse, weights=values, minlength=len(labels))
+
+    titles = np.bincount(inverse, minlength=len(labels))
+    copies, cost, retail, sold, revenue = (total(values) for values in (data.amount, data.cost, data.retail, data.sold, data.revenue))
+    margin = retail - cost
+    margin_percent = percent(margin, retail)
+    sell_through = percent(sold, sold + copies)
+    return [
+        GroupValuation(
+            labels[group],
+            int(titles[group]),
+            *(number(values[group]) for values in (copies, cost, retail, margin, margin_percent, sold, revenue, sell_through)),
+        )
+        for group in np.argsort(-cost, kind="stable").tolist()
+    ]
+
+
+def dead_stock(data, database, limit=DEAD_STOCK_LIMIT):
+    """Return the limit titles in stock that haven't sold during the period, tying up the most money first."""
+    dead = np.flatnonzero((data.amount > 0) & (data.sold == 0))
+    dead = dead[np.argsort(-data.cost[dead], kind="stable")[:limit]]
+    books = {book[0]: book for book in InventoryRepository(database).rows([data.isbns[row] for row in dead])}
+    result = []
+    for row in dead.tolist():
+        isbn = data.isbns[row]
+        book = books.get(isbn)
+        author, title = (book[1], book[2]) if book is not None else ("", "")
+        shelf = data.shelves[data.shelf[row]]
+        result.append(DeadStock(isbn, author, title, shelf, number(data.amount[row]), number(data.cost[row])))
+    return result
+
+
+def item(value):
+    """Return a table item that sorts numbers as numbers."""
+    cell = QtGui.QStandardItem()
+    cell.setData("" if value is None else value, QtCore.Qt.DisplayRole)
+    return cell
+
+
+class AnalyticsDialog(QDialog):
+    """Window showing stock valuation per group, totals and the dead stock list."""
+
+    def __init__(self, database, parent=None):
+        """Initialize the analytics window."""
+        super().__init__(parent)
+        self.database = database
+        self.data = None
+        self.setWindowTitle("Lageranalys")
+        self.resize(1000, 700)
+        self.combo_group = QComboBox(self)
+        for key, name in GROUPINGS.items():
+            self.combo_group.addItem(name, key)
+        self.spin_days = QSpinBox(self)
+        self.spin_days.setRange(1, 3650)
+        self.spin_days.setValue(DEFAULT_DAYS)
+        self.spin_days.setSuffix(" dagar")
+        self.label_totals = QLabel(self)
+        self.label_totals.setWordWrap(True)
+        self.table_groups = QTableView(self)
+        self.table_dead = QTableView(self)
+        self.model_groups = QtGui.QStandardItemModel(self)
+        self.model_dead = QtGui.QStandardItemModel(self)
+        for table, model in ((self.table_groups, self.model_groups), (self.table_dead, self.model_dead)):
+            table.setModel(model)
+            table.setSortingEnabled(True)
+        controls = QHBoxLayout()
+        controls.addWidget(self.combo_group)
+        controls.addWidget(self.spin_days)
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.label_totals)
+        layout.addWidget(self.table_groups)
+        layout.addWidget(QLabel("Osålt under perioden, störst inköpsvärde först:", self))
+        layout.addWidget(self.table_dead)
+        self.combo_group.currentIndexChanged.connect(self.update_groups)
+        self.spin_days.editingFinished.connect(self.reload)
+        self.reload()
+
+    def reload(self):
+        """Read the inventory and sales again and recompute everything."""
+        import mariadb  # pylint: disable=import-outside-toplevel
+
+        if self.data is not None and self.data.days == self.spin_days.value():
+            return
+        try:
+            data = load(self.database, self.spin_days.value())
+            dead = dead_stock(data, self.database)
+        except mariadb.Error as e:
+            QMessageBox.warning(self, "Analysen kunde inte hämtas", str(e))
+            return
+        self.data = data
+        summary = totals(self.data)
+        self.label_totals.setText(
+            f"{summary['titles']} titlar, {summary['copies']} exemplar. "
+            f"Inköpsvärde {summary['cost']} kr, försäljningsvärde {summary['retail']} kr, "
+            f"marginal {summary['margin']} kr ({summary['margin_percent']} %). "
+            f"Sålt {summary['sold']} exemplar för {summary['revenue']} kr, såld andel {summary['sell_through']} %. "
+            f"Saknar inköpspris: {summary['without_buy_price']}, saknar säljpris: {summary['without_sell_price']}."
+        )
+        self.update_groups()
+        self.model_dead.clear()
+        self.model_dead.setHorizontalHeaderLabels(DEAD_STOCK_HEADERS)
+        for row in dead:
+            self.model_dead.appendRow([item(value) for value in row])
+
+    def update_groups(self):
+        """Show the valuation for the chosen grouping."""
+        self.model_groups.clear()
+        self.model_groups.setHorizontalHeaderLabels(GROUP_HEADERS)
+        for row in valuation(self.data, self.combo_group.currentData()):
+            self.model_groups.appendRow([item(value) for value in row])
+
+
+def main(argv=None):
+    """Print stock valuation, margins, sell-through and dead stock from the command line."""
+    import mariadb  # pylint: disable=import-outside-toplevel
+    import db  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Lagervärde, marginaler, sell-through och osålda titlar.")
+    parser.add_argument("--by", choices=GROUPINGS, default="shelf", help="gruppera per hylla, språk eller årtionde")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help="försäljningsperiod i dagar")
+    parser.add_argument("--dead", type=int, default=DEAD_STOCK_LIMIT, help="antal osålda titlar att lista")
+    args = parser.parse_args(argv)
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    data = load(database, args.days)
+    for key, value in totals(data).items():
+        print(f"{key}\t{'' if value is None else value}")
+    print()
+    print("\t".join(GROUP_HEADERS))
+    for row in valuation(data, args.by):
+        print("\t".join("" if value is None else str(value) for value in row))
+    print()
+    print("\t".join(DEAD_STOCK_HEADERS))
+    for row in dead_stock(data, database, args.dead):
+        print("\t".join("" if value is None else str(value) for value in row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
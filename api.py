@@ -0,0 +1,281 @@
+"""HTTP/JSON API over the headless core, for web shops and other tills."""
+import asyncio
+import hmac
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from decouple import config
+import mariadb
+
+import db
+import metrics
+from core import InventoryRepository, MetadataService, SalesService, canonical_isbn
+from meta_cache import MetaCache
+
+
+MAX_BODY = 1024 * 1024
+MAX_LIMIT = 500
+REQUEST_TIMEOUT_S = 10
+WRITE_ROUTES = ("checkout", "stock")
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class ApiError(Exception):
+    """Raised by a handler to answer with an HTTP error status."""
+
+    def __init__(self, status, message):
+        """Initialize the error with an HTTP status and a message for the client."""
+        super().__init__(message)
+        self.status = status
+
+
+def isbn_or_error(text):
+    """Return the canonical ISBN-13 of text, or raise a 400 ApiError."""
+    isbn = canonical_isbn(text)
+    if isbn is None:
+        raise ApiError(400, f"Ogiltigt ISBN: {text}")
+    return isbn
+
+
+class Api:
+    """Routes requests to the inventory, sales and metadata services on bounded worker pools.
+
+    Metadata lookups wait on slow external services, so they get a pool of their own and can't hold up sales.
+    Sales and stock changes require the shared secret token as a bearer token, and are refused if none is set.
+    """
+
+    def __init__(self, inventory, sales, metadata, workers, token=None, lookup_workers=None):
+        """Initialize the API with its services, the number of blocking calls allowed at once and the write token."""
+        self.inventory = inventory
+        self.sales = sales
+        self.metadata = metadata
+        self.token = token
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bokhandeln-api")
+        self.lookup_executor = ThreadPoolExecutor(max_workers=lookup_workers or workers, thread_name_prefix="bokhandeln-lookup")
+
+    async def __call__(self, method, path, query, body, headers=None):
+        """Answer one request with (status, JSON-serializable payload)."""
+        parts = [part for part in path.split("/") if part]
+        if parts and parts[0] in WRITE_ROUTES and method == "POST":
+            self.__authorize__(headers or {})
+        if parts == ["books"] and method == "GET":
+            return await self.__books__(query)
+        if len(parts) == 2 and parts[0] == "books" and method == "GET":
+            return await self.__book__(parts[1])
+        if parts == ["checkout"] and method == "POST":
+            return await self.__checkout__(body)
+        if parts == ["stock"] and method == "POST":
+            return await self.__stock__(body)
+        if len(parts) == 2 and parts[0] == "lookup" and method == "GET":
+            return await self.__lookup__(parts[1])
+        if parts and parts[0] in ("books", "checkout", "stock", "lookup"):
+            raise ApiError(405, f"{method} stöds inte för /{parts[0]}")
+        raise ApiError(404, f"Okänd sökväg: {path}")
+
+    def __authorize__(self, headers):
+        """Raise an ApiError unless the request carries the write token."""
+        if not self.token:
+            raise ApiError(403, "Skrivningar är avstängda, BOKHANDELN_API_TOKEN saknas")
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.token.encode()):
+            raise ApiError(401, "Ogiltig eller saknad token")
+
+    async def __run__(self, function, *args, executor=None):
+        """Run a blocking service call on the worker pool, or on executor."""
+        return await asyncio.get_running_loop().run_in_executor(executor or self.executor, function, *args)
+
+    async def __books__(self, query):
+        """Search the inventory."""
+        try:
+            limit = min(int(query.get("limit", ["50"])[0]), MAX_LIMIT)
+        except ValueError as error:
+            raise ApiError(400, "limit måste vara ett heltal") from error
+        if limit < 1:
+            raise ApiError(400, "limit måste vara minst 1")
+        books = await self.__run__(self.inventory.search, query.get("q", [""])[0], limit)
+        return 200, [book.to_dict() for book in books]
+
+    async def __book__(self, text):
+        """Return one book."""
+        book = await self.__run__(self.inventory.get, isbn_or_error(text))
+        if book is None:
+            raise ApiError(404, f"{text} finns inte i lagret")
+        return 200, book.to_dict()
+
+    async def __checkout__(self, body):
+        """Sell a basket."""
+        basket = {}
+        try:
+            for item in body["items"]:
+                isbn = isbn_or_error(item["isbn"])
+                basket[isbn] = basket.get(isbn, 0) + int(item.get("quantity", 1))
+            seller = str(body.get("seller", "api"))
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
+            raise ApiError(400, "Förväntade {\"items\": [{\"isbn\": ..., \"quantity\": ...}], \"seller\": ...}") from error
+        if not basket or min(basket.values()) < 1:
+            raise ApiError(400, "Korgen måste innehålla minst ett exemplar av varje bok")
+        try:
+            stock = await self.__run__(self.sales.checkout, basket, seller)
+        except KeyError as error:
+            raise ApiError(404, str(error.args[0])) from error
+        except mariadb.IntegrityError as error:
+            raise ApiError(409, f"Inte tillräckligt i lager: {error}") from error
+        return 200, {"stock": stock}
+
+    async def __stock__(self, body):
+        """Adjust stock levels by deltas."""
+        try:
+            deltas = {isbn_or_error(isbn): int(delta) for isbn, delta in body["deltas"].items()}
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
+            raise ApiError(400, "Förväntade {\"deltas\": {isbn: förändring}}") from error
+        try:
+            stock = await self.__run__(self.inventory.adjust, deltas)
+        except mariadb.IntegrityError as error:
+            raise ApiError(409, f"Lagret kan inte bli negativt: {error}") from error
+        return 200, {"stock": stock}
+
+    async def __lookup__(self, text):
+        """Look up metadata for a book that may not be in stock."""
+        book_info = await self.__run__(self.metadata.lookup, isbn_or_error(text), executor=self.lookup_executor)
+        if book_info is None:
+            raise ApiError(404, f"Hittade ingen bok med ISBN {text}")
+        return 200, book_info
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request and return (method, path, query, JSON body, headers)."""
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise ApiError(400, "Felaktig förfrågan")
+    method, target, _ = request_line
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError as error:
+        raise ApiError(400, "Ogiltig Content-Length") from error
+    if length < 0:
+        raise ApiError(400, "Ogiltig Content-Length")
+    if length > MAX_BODY:
+        raise ApiError(413, "För stor förfrågan")
+    body = None
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError as error:
+            raise ApiError(400, "Ogiltig JSON") from error
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), body, headers
+
+
+def write_response(writer, status, payload):
+    """Write a JSON response and mark the connection to be closed."""
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+
+def handler(api, timeout=REQUEST_TIMEOUT_S):
+    """Return the asyncio connection callback serving api, giving clients timeout seconds to send their request."""
+
+    async def handle(reader, writer):
+        """Answer one request and close the connection."""
+        try:
+            method, path, query, body, headers = await asyncio.wait_for(read_request(reader), timeout)
+            status, payload = await api(method, path, query, body, headers)
+        except ApiError as error:
+            status, payload = error.status, {"error": str(error)}
+        except asyncio.TimeoutError:
+            status, payload = 408, {"error": "Förfrågan tog för lång tid"}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except mariadb.Error as error:
+            status, payload = 503, {"error": f"Databasfel: {error}"}
+        except Exception as error:  # pylint: disable=broad-except
+            status, payload = 500, {"error": str(error)}
+        write_response(writer, status, payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    return handle
+
+
+async def serve(api, host, port, timeout=REQUEST_TIMEOUT_S):
+    """Serve api on host:port until cancelled."""
+    server = await asyncio.start_server(handler(api, timeout), host, port)
+    print(f"Bokhandeln API lyssnar på http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Start the API server configured by the BOKHANDELN_API_* variables."""
+    pool_size = config("BOKHANDELN_DB_POOL_SIZE", default=4, cast=int)
+    metrics.configure()
+    try:
+        database = db.Database(pool_size=pool_size)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    inventory = InventoryRepository(database)
+    meta_cache = MetaCache(
+        database,
+        timedelta(days=config("BOKHANDELN_META_TTL_DAYS", default=90, cast=int)),
+        timedelta(days=config("BOKHANDELN_META_NEGATIVE_TTL_DAYS", default=7, cast=int)),
+    )
+    token = config("BOKHANDELN_API_TOKEN", default="")
+    if not token:
+        print("BOKHANDELN_API_TOKEN saknas, försäljning och lagerändringar via API:t är avstängda")
+    api = Api(
+        inventory,
+        SalesService(database, inventory),
+        MetadataService(meta_cache),
+        pool_size,
+        token,
+        config("BOKHANDELN_API_LOOKUP_WORKERS", default=4, cast=int),
+    )
+    try:
+        asyncio.run(
+            serve(
+                api,
+                config("BOKHANDELN_API_HOST", default="127.0.0.1"),
+                config("BOKHANDELN_API_PORT", default=8080, cast=int),
+                config("BOKHANDELN_API_REQUEST_TIMEOUT_S", default=REQUEST_TIMEOUT_S, cast=float),
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
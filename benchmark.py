@@ -0,0 +1,383 @@
+"""Reproducible benchmarks of Bokhandeln on synthetic inventories, run headless against a scratch database."""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from decouple import config
+import mariadb
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QApplication
+
+import bokhandeln
+import db
+import migrations
+from core import NO_COVER
+from inventory_model import HEADERS
+from cover_cache import CoverCache
+from export import chunks
+from journal import SalesJournal, flush
+from reports import rebuild_rollups
+from snapshot import load_snapshot, write_snapshot
+
+
+SIZES = (10_000, 100_000, 1_000_000)
+SEED = 1
+CHUNK = 5000
+ANCHOR = datetime(2025, 1, 1)
+INSERT_BOOK = """
+    INSERT INTO inventory (ISBN, author, title, lang, year, buy_price, sell_price, row, cover, amount)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+INSERT_SALE = "INSERT INTO sales (ISBN, date, price, seller) VALUES (?, ?, ?, ?)"
+FIRST_NAMES = ("Astrid", "Selma", "Hjalmar", "Karin", "Vilhelm", "Tove", "Per", "Kerstin", "Åsa", "Jonas", "Märta", "Olof")
+LAST_NAMES = ("Lindgren", "Lagerlöf", "Söderberg", "Boye", "Moberg", "Jansson", "Wahlöö", "Ekman", "Larsson", "Öberg", "Gustafsson")
+WORDS = (
+    "röd", "sommar", "natt", "skog", "hav", "barn", "bröder", "mord", "kärlek", "vinter", "staden", "ön",
+    "hemlighet", "resan", "ljus", "mörker", "huset", "flickan", "kungen", "älven", "fjäll", "brev", "tid", "dröm",
+)
+LANGUAGES = ("sv", "sv", "sv", "en", "en", "de", "fr", "da", "no")
+SELLERS = ("Anna", "Bertil", "Cecilia")
+SEARCHES = ("lindgren", "röd natt", "978000001", "kärlek vinter", "åsa öberg", "zz")
+SORTS = ((4, False), (2, False), (1, True), (6, False))
+
+APP = None
+
+
+def isbn13(number):
+    """Return the valid ISBN-13 numbered number in the 978 range."""
+    digits = f"978{number:09d}"
+    check = -sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits)) % 10
+    return f"{digits}{check}"
+
+
+def synthetic_books(count, rng, start=0):
+    """Yield count deterministic inventory rows in INSERT_BOOK order."""
+    for number in range(start, start + count):
+        buy_price = rng.randint(10, 300)
+        yield (
+            isbn13(number),
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))).capitalize(),
+            rng.choice(LANGUAGES),
+            rng.randint(1900, 2024),
+            buy_price,
+            buy_price + rng.randint(10, 200),
+            f"{rng.choice('ABCDEFGH')}{rng.randint(1, 40)}",
+            NO_COVER,
+            rng.randint(0, 5),
+        )
+
+
+def synthetic_sales(count, books, rng, days=730, anchor=ANCHOR):
+    """Yield count deterministic sales of the first books titles, spread over the days before anchor."""
+    for _ in range(count):
+        yield (
+            isbn13(rng.randrange(books)),
+            anchor - timedelta(seconds=rng.randrange(days * 86400)),
+            rng.randint(20, 500),
+            rng.choice(SELLERS),
+        )
+
+
+def prepare(name, size, sales, seed):
+    """Recreate the scratch database name with size titles and a history of sales, and return it."""
+    server = {key: value for key, value in db.settings().items() if key != "database"}
+    conn = mariadb.connect(**server)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+        cursor.execute(f"CREATE DATABASE `{name}`")
+    finally:
+        conn.close()
+    database = db.Database(database=name)
+    migrations.migrate(database, progress=lambda _: None)
+    rng = random.Random(seed)
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        for chunk in chunks(synthetic_books(size, rng), CHUNK):
+            cursor.executemany(INSERT_BOOK, chunk)
+            conn.commit()
+        for chunk in chunks(synthetic_sales(sales, size, rng), CHUNK):
+            cursor.executemany(INSERT_SALE, chunk)
+            conn.commit()
+    rebuild_rollups(database)
+    return database
+
+
+def timings(samples):
+    """Summarize wall-clock samples in seconds as milliseconds."""
+    samples = sorted(sample * 1000 for sample in samples)
+    return {
+        "n": len(samples),
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def measure(function, repeat):
+    """Return the timings of repeat calls to function."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return timings(samples)
+
+
+def install(database, scratch_directory):
+    """Point the application's globals at database, with files in scratch_directory and background sync and flushing turned off."""
+    bokhandeln.JOURNAL = SalesJournal(os.path.join(scratch_directory, "journal.sqlite3"))
+    bokhandeln.COVERS = CoverCache(scratch_directory)
+    bokhandeln.start_services(database)
+    bokhandeln.SYNC_INTERVAL_MS = 0
+    bokhandeln.JOURNAL_FLUSH_MS = 0
+
+
+def bench_table_load(window, repeat):
+    """Time initialize_table and measure the memory the loaded model holds on to."""
+    def load():
+        previous = window.model
+        window.initialize_table()
+        if window.proxy is not None:
+            window.proxy.setSourceModel(window.model)
+        return previous
+
+    result = measure(lambda: load().setParent(None), repeat)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    previous = load()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    previous.setParent(None)
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    result["retained_bytes"] = retained
+    result["peak_bytes"] = peak
+    result["bytes_per_title"] = round(retained / max(window.model.rowCount(), 1), 1)
+    return result
+
+
+def bench_fast_start(window, scratch_directory, repeat):
+    """Time opening a main window from an inventory snapshot, before the database is connected."""
+    path = os.path.join(scratch_directory, "inventory.snapshot")
+    start = time.perf_counter()
+    write_snapshot(path, window.model.rows(), 0)
+    written = time.perf_counter() - start
+    database = bokhandeln.DB
+    bokhandeln.DB = None
+
+    def open_window():
+        fast = bokhandeln.Window(load_snapshot(path))
+        fast.show()
+        QApplication.processEvents()
+        fast.close()
+        fast.deleteLater()
+
+    try:
+        result = measure(open_window, repeat)
+    finally:
+        bokhandeln.DB = database
+    result["snapshot_write_ms"] = round(written * 1000, 3)
+    result["snapshot_bytes"] = os.path.getsize(path)
+    return result
+
+
+def bench_search(window, repeat):
+    """Time on_apply_search for each of SEARCHES."""
+    results = {}
+    for query in SEARCHES:
+        window.line_search.setText(query)
+        window.search_timer.stop()
+        results[query] = measure(window.on_apply_search, repeat)
+    window.line_search.setText("")
+    window.search_timer.stop()
+    window.on_apply_search()
+    return results
+
+
+def bench_sort(window, repeat):
+    """Time sorting the table by clicking the headers of SORTS in turn, each sort keeping the earlier ones as tie-breakers."""
+    results = {}
+    for column, descending in SORTS:
+        order = QtCore.Qt.DescendingOrder if descending else QtCore.Qt.AscendingOrder
+        results[HEADERS[column]] = measure(lambda column=column, order=order: window.table_inventory.sortByColumn(column, order), repeat)
+    if bokhandeln.SERVER_MODE:
+        window.model.sort(0)
+    else:
+        window.model.sort_by([])
+    return results
+
+
+def loaded_isbn(model, row):
+    """Return the ISBN on a row of the table, waiting for its page to be read in server mode."""
+    isbn = model.isbn(row)
+    while isbn is None:
+        QtCore.QThreadPool.globalInstance().waitForDone()
+        QApplication.processEvents()
+        isbn = model.isbn(row)
+    return isbn
+
+
+def bench_sale(window, database, size, repeat, rng):
+    """Time sell_book on randomly chosen, restocked rows, and flushing the journaled sales to the database."""
+    rows = [rng.randrange(min(size, window.model.rowCount())) for _ in range(repeat)]
+    isbns = [loaded_isbn(window.model, row) for row in rows]
+    bokhandeln.INVENTORY.adjust({isbn: isbns.count(isbn) for isbn in set(isbns)})
+    window.update_books(isbns)
+    window.line_seller.setText("benchmark")
+    samples = []
+    for row in rows:
+        index = window.model.index(row, 0)
+        if window.proxy is not None:
+            index = window.proxy.mapFromSource(index)
+        loaded_isbn(window.model, row)
+        window.table_inventory.clearSelection()
+        window.table_inventory.selectRow(index.row())
+        start = time.perf_counter()
+        window.sell_book()
+        samples.append(time.perf_counter() - start)
+    result = timings(samples)
+    start = time.perf_counter()
+    while bokhandeln.JOURNAL.count_pending():
+        flush(bokhandeln.JOURNAL, database)
+    result["flush_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    result["sales_recorded"] = database.fetchone("SELECT COUNT(*) FROM sales WHERE seller = 'benchmark'")[0]
+    return result
+
+
+def bench_upsert(window, size, repeat, rng):
+    """Time add_book saving new titles through the book dialog."""
+    dialog = bokhandeln.BookDialog(None)
+    dialog.book_changed.connect(window.update_book)
+    samples = []
+    for isbn, author, title, lang, year, buy_price, sell_price, row, _, _ in synthetic_books(repeat, rng, start=size):
+        dialog.line_isbn.setText(isbn)
+        dialog.line_author.setText(author)
+        dialog.line_title.setText(title)
+        dialog.line_language.setText(lang)
+        dialog.line_year.setText(str(year))
+        dialog.line_buy_price.setText(str(buy_price))
+        dialog.line_sell_price.setText(str(sell_price))
+        dialog.line_row.setText(row)
+        start = time.perf_counter()
+        dialog.add_book()
+        samples.append(time.perf_counter() - start)
+    result = timings(samples)
+    result["books_per_second"] = round(len(samples) / sum(samples), 1)
+    return result
+
+
+def run(database, size, sales, args):
+    """Run every benchmark on one prepared database and return the results."""
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as scratch_directory:
+        install(database, scratch_directory)
+        window = bokhandeln.Window()
+        results = {
+            "titles": size,
+            "sales": sales,
+            "table_load": bench_table_load(window, args.repeat_load),
+            "fast_start": None if bokhandeln.SERVER_MODE else bench_fast_start(window, scratch_directory, args.repeat_load),
+            "search": bench_search(window, args.repeat),
+            "sort": bench_sort(window, args.repeat),
+            "sale": bench_sale(window, database, size, args.repeat, rng),
+            "upsert": bench_upsert(window, size, args.repeat, rng),
+        }
+        window.close()
+    results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return results
+
+
+def environment():
+    """Describe what was measured, so results from different versions can be compared."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server_mode": bokhandeln.SERVER_MODE,
+    }
+
+
+def compare(baseline, results):
+    """Print the change in median latency of every benchmark against a baseline result file."""
+    old = {run["titles"]: run for run in baseline["runs"]}
+    for new in results["runs"]:
+        before = old.get(new["titles"])
+        if before is None:
+            continue
+        pairs = [("table_load", before["table_load"], new["table_load"])]
+        pairs += [("fast_start", before.get("fast_start"), new.get("fast_start"))]
+        pairs += [("sale", before["sale"], new["sale"]), ("upsert", before["upsert"], new["upsert"])]
+        pairs += [(f"search {query!r}", before["search"].get(query), timing) for query, timing in new["search"].items()]
+        for name, then, now in pairs:
+            if then and now:
+                ratio = now["median_ms"] / then["median_ms"] if then["median_ms"] else float("inf")
+                print(f"{new['titles']:>9} {name:<24} {then['median_ms']:>10.2f} -> {now['median_ms']:>10.2f} ms  ({ratio:.2f}x)")
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line and write the results as JSON."""
+    global APP  # pylint: disable=global-statement
+    parser = argparse.ArgumentParser(description="Mät Bokhandelns prestanda på syntetiska lager.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="antal titlar per körning")
+    parser.add_argument("--sales-per-title", type=float, default=2.0, help="försäljningshistorik per titel")
+    parser.add_argument("--repeat", type=int, default=50, help="upprepningar av sök, försäljning och sparande")
+    parser.add_argument("--repeat-load", type=int, default=5, help="upprepningar av tabelladdningen")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--server-mode", action="store_true", help="mät den serversidiga sidvisningen")
+    parser.add_argument("--database", default=config("BOKHANDELN_BENCH_DATABASE", default="bokhandeln_benchmark"))
+    parser.add_argument("--output", help="skriv resultatet till denna JSON-fil i stället för stdout")
+    parser.add_argument("--compare", help="jämför med ett tidigare resultat")
+    args = parser.parse_args(argv)
+    if args.database == config("BOKHANDELN_DB_DATABASE"):
+        print(f"Vägrar att skriva över {args.database}; välj en separat databas för mätningarna.")
+        return 1
+    bokhandeln.SERVER_MODE = args.server_mode
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    APP = QApplication.instance() or QApplication(sys.argv[:1])
+    results = {"environment": environment(), "runs": []}
+    for size in args.sizes:
+        sales = int(size * args.sales_per_title)
+        try:
+            database = prepare(args.database, size, sales, args.seed)
+            results["runs"].append(run(database, size, sales, args))
+        except mariadb.Error as e:
+            print(f"Error connecting to MariaDB Platform: {e}")
+            return 1
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as result_file:
+            result_file.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            compare(json.load(baseline_file), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,115 +1,268 @@
 """A simple book store application."""
 import sys
-from datetime import datetime
+from collections import Counter
+from datetime import timedelta
 
 from decouple import config
-import requests
-import mariadb
-import isbnlib
 from PyQt5.QtWidgets import (
+    QAction,
     QApplication,
     QDialog,
+    QFileDialog,
     QMainWindow,
+    QMessageBox,
+    QProgressDialog,
 )
-from PyQt5 import QtCore, QtGui
-from PyQt5.QtGui import QImage, QPixmap
+from PyQt5 import QtCore
+from PyQt5.QtGui import QPixmap
 from main_window import Ui_MainWindow
+from core import NO_COVER, Book, InventoryRepository, canonical_isbn, parse_int
+from inventory_model import AMOUNT_COLUMN, COVER_COLUMN, SELL_PRICE_COLUMN, InventoryFilter, InventoryModel, cell_text
 from dialog import Ui_Dialog
-
-
-HEADERS = [
-    "ISBN",
-    "Författare",
-    "Titel",
-    "Språk",
-    "År",
-    "Inköpspris",
-    "Säljpris",
-    "Hylla",
-    "Antal i lager",
-]
-
-REMOVE_ONE = "UPDATE inventory SET amount = amount - 1 WHERE ISBN = ?"
-ADD_ONE = "UPDATE inventory SET amount = amount + 1 WHERE ISBN = ?"
-NO_COVER = "no_cover.png"
-
-CONN = None
+from change_feed import ChangeFeed, latest_version
+from cover_cache import DEFAULT_DIRECTORY, CoverCache
+from journal import DEFAULT_PATH as DEFAULT_JOURNAL, JournalFlusher, SalesJournal
+from lookups import LookupPool
+from paged_model import PagedInventoryModel
+from meta_cache import MetaCache
+import metrics
+from scan_checkout import BURST_GAP_MS, CheckoutPanel, HotTitles, ScanDetector
+from snapshot import DEFAULT_PATH as DEFAULT_SNAPSHOT, Snapshot, load_snapshot, write_snapshot
+from startup import Startup
+from thumbnails import TABLE_SIZE, ThumbnailLoader
+
+
+SEARCH_DELAY_MS = 150
+RECONNECT_DELAY_MS = 5000
+
+DB = None
+INVENTORY = None
+JOURNAL = None
+COVERS = None
+LOOKUPS = None
+META_CACHE = None
+SERVER_MODE = False
+SYNC_INTERVAL_MS = 1000
+JOURNAL_FLUSH_MS = 500
+SNAPSHOT_PATH = None
+SCAN_GAP_MS = BURST_GAP_MS
+TABLE_COVERS = False
+
+
+def start_services(database):
+    """Set up the services that need the database."""
+    global DB, INVENTORY, META_CACHE, LOOKUPS  # pylint: disable=global-statement
+    DB = database
+    INVENTORY = InventoryRepository(database)
+    META_CACHE = MetaCache(
+        database,
+        timedelta(days=config("BOKHANDELN_META_TTL_DAYS", default=90, cast=int)),
+        timedelta(days=config("BOKHANDELN_META_NEGATIVE_TTL_DAYS", default=7, cast=int)),
+    )
+    LOOKUPS = LookupPool(COVERS, META_CACHE)
 
 
 class Window(QMainWindow, Ui_MainWindow):
     """Main window of the Bokhandeln application."""
 
-    def __init__(self, parent=None):
-        """Initialize the main window of the Bokhandeln application."""
+    def __init__(self, snapshot=None, parent=None):
+        """Initialize the main window, from an inventory snapshot if the database isn't connected yet."""
         super().__init__(parent)
         self.setupUi(self)
+        self.action_import_shipment = QAction("Importera leverans...", self)
+        self.menu_file.addAction(self.action_import_shipment)
+        self.action_open_report = QAction("Försäljningsrapport...", self)
+        self.menu_file.addAction(self.action_open_report)
+        self.action_open_analytics = QAction("Lageranalys...", self)
+        self.menu_file.addAction(self.action_open_analytics)
+        self.action_export = QAction("Exportera...", self)
+        self.menu_file.addAction(self.action_export)
+        self.action_scan_mode = QAction("Kassaläge (streckkodsläsare)", self)
+        self.action_scan_mode.setCheckable(True)
+        self.menu_file.addAction(self.action_scan_mode)
+        self.action_show_covers = QAction("Visa omslag i tabellen", self)
+        self.action_show_covers.setCheckable(True)
+        self.action_show_covers.setVisible(not SERVER_MODE)
+        self.menu_file.addAction(self.action_show_covers)
         self.connect_signals_slots()
-        model = self.initialize_table()
-        self.proxy = QtCore.QSortFilterProxyModel(self)
-        self.proxy.setSourceModel(model)
-        self.proxy.setFilterKeyColumn(1)
-        self.proxy.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
-        self.table_inventory.setModel(self.proxy)
-        self.line_search.textChanged.connect(self.on_apply_search)
+        self.checkout = None
+        self.scanner = None
+        self.hot_titles = None
+        self.row_height = None
+        self.thumbnails = None
+        self.feed = None
+        self.flusher = None
+        self.startup = None
+        self.snapshot = snapshot
+        version = latest_version(DB) if DB is not None else None
+        model = self.initialize_table(snapshot)
+        if SERVER_MODE:
+            self.proxy = None
+            self.table_inventory.setModel(model)
+        else:
+            self.proxy = InventoryFilter(self)
+            self.proxy.setSourceModel(model)
+            self.table_inventory.setModel(self.proxy)
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.on_apply_search)
+        self.line_search.textChanged.connect(self.search_timer.start)
+        if DB is not None:
+            self.__start_sync__(version)
+            self.action_show_covers.setChecked(TABLE_COVERS and not SERVER_MODE)
+        else:
+            self.__set_online__(False)
         self.table_inventory.show()
 
-    def on_apply_search(self):
-        """Filter the table based on the text entered in the search line edit."""
-        self.proxy.setFilterRegExp(self.line_search.text())
-
-    def __populate_table__(self, model, inventory):
-        """Populate the table with data from the inventory."""
-        for i, (isbn, author, title, lang, year, buy_price, sell_price, row, amount) in enumerate(
-            inventory
+    def __start_sync__(self, version):
+        """Start following the change feed after version and flushing the sales journal."""
+        self.feed = ChangeFeed(DB, version, SYNC_INTERVAL_MS, self)
+        self.feed.books_changed.connect(self.model.update_books)
+        self.feed.reload_needed.connect(self.update_table)
+        if SYNC_INTERVAL_MS:
+            self.feed.start()
+        self.flusher = JournalFlusher(JOURNAL, DB, JOURNAL_FLUSH_MS, self)
+        self.flusher.stock_changed.connect(self.on_stock_changed)
+        self.flusher.rejected.connect(self.on_journal_rejected)
+        if JOURNAL_FLUSH_MS:
+            self.flusher.start()
+            self.flusher.poll()
+
+    def __set_online__(self, online):
+        """Enable or disable the actions that can't work without the database; selling and stock changes are journaled."""
+        for action in (
+            self.action_open_dialog,
+            self.action_edit_book,
+            self.action_delete_book,
+            self.action_import_shipment,
+            self.action_open_report,
+            self.action_open_analytics,
+            self.action_export,
+            self.action_show_covers,
         ):
-            item_isbn = QtGui.QStandardItem(isbn)
-            item_author = QtGui.QStandardItem(author)
-            item_title = QtGui.QStandardItem(title)
-            item_lang = QtGui.QStandardItem(lang)
-            item_year = QtGui.QStandardItem(str(year))
-            item_buy_price = QtGui.QStandardItem(str(buy_price))
-            item_sell_price = QtGui.QStandardItem(str(sell_price))
-            item_row = QtGui.QStandardItem(row)
-            item_amount = QtGui.QStandardItem(str(amount))
-            model.setItem(i, 0, item_isbn)
-            model.setItem(i, 1, item_author)
-            model.setItem(i, 2, item_title)
-            model.setItem(i, 3, item_lang)
-            model.setItem(i, 4, item_year)
-            model.setItem(i, 5, item_buy_price)
-            model.setItem(i, 6, item_sell_price)
-            model.setItem(i, 7, item_row)
-            model.setItem(i, 8, item_amount)
-
-    def initialize_table(self):
-        """Initialize the table with data from the inventory."""
-        cursor = CONN.cursor()
-        cursor.execute(
-            "SELECT ISBN, author, title, lang, year, buy_price, sell_price, row, amount FROM inventory"
-        )
-        inventory = cursor.fetchall()
-        model = QtGui.QStandardItemModel()
-        model.setHorizontalHeaderLabels(HEADERS)
-        self.__populate_table__(model, inventory)
-        return model
+            action.setEnabled(online)
+
+    def connect_in_background(self, migrate=True):
+        """Connect to the database on a worker thread and catch the snapshot up with it."""
+        self.startup = Startup(migrate, self)
+        self.startup.connected.connect(self.on_connected)
+        self.startup.failed.connect(self.on_connect_failed)
+        self.status_bar.showMessage("Ansluter till databasen...")
+        self.startup.start(self.snapshot)
+
+    def on_connected(self, database, version, inventory):
+        """Start using the database once the background connection is up."""
+        start_services(database)
+        if inventory is not None:
+            self.model.set_inventory(inventory)
+        self.snapshot = None
+        self.__start_sync__(version)
+        self.__set_online__(True)
+        self.action_show_covers.setChecked(TABLE_COVERS)
+        self.status_bar.clearMessage()
+
+    def on_connect_failed(self, error):
+        """Keep working from the snapshot and the journal, and try to connect again in a while."""
+        print(f"Error connecting to MariaDB Platform: {error}")
+        self.status_bar.showMessage(f"Ingen databasanslutning, försäljning sparas lokalt: {error}")
+        QtCore.QTimer.singleShot(RECONNECT_DELAY_MS, lambda: self.startup.start(self.snapshot))
+
+    def closeEvent(self, event):  # pylint: disable=invalid-name
+        """Save a snapshot of the inventory for the next fast start."""
+        rows = self.model.rows() if isinstance(self.model, InventoryModel) else None
+        up_to_date = isinstance(rows, Snapshot) and self.feed is not None and rows.version == self.feed.version
+        if SNAPSHOT_PATH and rows is not None and self.feed is not None and not up_to_date:
+            try:
+                write_snapshot(SNAPSHOT_PATH, rows, self.feed.version)
+            except OSError as e:
+                print(f"Could not save the inventory snapshot: {e}")
+        super().closeEvent(event)
+
+    def on_apply_search(self):
+        """Filter the table on ISBN, author and title based on the text entered in the search line edit."""
+        with metrics.timed("ui", "on_apply_search"):
+            if self.proxy is None:
+                self.model.set_search(self.line_search.text())
+            else:
+                self.proxy.set_search(self.line_search.text())
+
+    def __fetch_inventory__(self):
+        """Fetch all books from the inventory table."""
+        return INVENTORY.rows()
+
+    def __selected_isbns__(self):
+        """Return the ISBNs of the selected book(s) in table order."""
+        indexes = self.table_inventory.selectedIndexes()
+        if self.proxy is not None:
+            indexes = [self.proxy.mapToSource(index) for index in indexes]
+        rows = sorted(set(index.row() for index in indexes))
+        return [isbn for isbn in (self.model.isbn(row) for row in rows) if isbn is not None]
+
+    def initialize_table(self, snapshot=None):
+        """Initialize the table with data from the inventory or a snapshot of it, or with a paged view of it in server mode."""
+        with metrics.timed("ui", "initialize_table"):
+            if SERVER_MODE:
+                self.model = PagedInventoryModel(DB, self)
+            elif snapshot is not None or DB is None:
+                self.model = InventoryModel(snapshot if snapshot is not None else (), self)
+            else:
+                self.model = InventoryModel(self.__fetch_inventory__(), self)
+            return self.model
 
     def update_table(self):
         """Update the table with the latest data from the inventory."""
-        cursor = CONN.cursor()
-        cursor.execute(
-            "SELECT ISBN, author, title, lang, year, buy_price, sell_price, row, amount FROM inventory"
-        )
-        inventory = cursor.fetchall()
-        if len(inventory) == 0:
-            model = QtGui.QStandardItemModel()
-            model.setHorizontalHeaderLabels(HEADERS)
-            return model
-        model = QtGui.QStandardItemModel()
-        model.setHorizontalHeaderLabels(HEADERS)
-        self.__populate_table__(model, inventory)
-        self.proxy.setSourceModel(model)
-        self.table_inventory.show()
-        return model
+        with metrics.timed("ui", "update_table"):
+            if SERVER_MODE:
+                self.model.reload()
+            else:
+                self.model.set_inventory(self.__fetch_inventory__())
+            self.table_inventory.show()
+            return self.model
+
+    def update_books(self, isbns):
+        """Re-read only the given books from the inventory and patch them into the table."""
+        with metrics.timed("ui", "update_books"):
+            isbns = list(dict.fromkeys(isbns))
+            if not isbns:
+                return
+            self.model.update_books(isbns, INVENTORY.rows(isbns))
+
+    def update_book(self, isbn):
+        """Re-read a single book from the inventory and patch it into the table."""
+        self.update_books([isbn])
+
+    def on_stock_changed(self, stock):
+        """Show the amounts in stock of {isbn: amount}."""
+        self.model.set_amounts(stock)
+        if self.hot_titles is not None:
+            self.hot_titles.set_amounts(stock)
+
+    def on_journaled(self, stock):
+        """Show the expected stock after a journaled change and flush the journal right away."""
+        self.on_stock_changed(stock)
+        if self.flusher is not None:
+            self.flusher.poll()
+
+    def on_journal_rejected(self, rejected):
+        """Tell the user about journaled sales or stock changes the database refused."""
+        isbns = sorted({isbn for entry, _ in rejected for isbn in entry.payload.get("basket", entry.payload.get("deltas", {}))})
+        self.update_books(isbns)
+        details = "\n".join(f"{entry.created:%Y-%m-%d %H:%M} {entry.kind}: {error}" for entry, error in rejected)
+        QMessageBox.warning(self, "Ändringar nekades av databasen", f"Följande registreringar kunde inte sparas:\n{details}")
+
+    def __journal__(self, deltas):
+        """Return the expected stock after applying {isbn: delta}, or None after warning if any would go negative."""
+        stock = {}
+        for isbn, delta in deltas.items():
+            book = self.model.book(isbn)
+            amount = book[AMOUNT_COLUMN] if book is not None else 0
+            stock[isbn] = (amount or 0) + delta
+        short = [isbn for isbn, amount in stock.items() if amount < 0]
+        if short:
+            QMessageBox.warning(self, "Inte tillräckligt i lager", "Slut i lager: " + ", ".join(short))
+            return None
+        return stock
 
     def connect_signals_slots(self):
         """Connect signals and slots."""
@@ -120,6 +273,12 @@ class Window(QMainWindow, Ui_MainWindow):
         self.action_delete_one.triggered.connect(self.delete_one)
         self.action_edit_book.triggered.connect(self.edit_book)
         self.action_toggle.triggered.connect(self.toggle)
+        self.action_import_shipment.triggered.connect(self.import_shipment)
+        self.action_open_report.triggered.connect(self.open_report)
+        self.action_open_analytics.triggered.connect(self.open_analytics)
+        self.action_export.triggered.connect(self.open_export)
+        self.action_scan_mode.toggled.connect(self.toggle_scan_mode)
+        self.action_show_covers.toggled.connect(self.toggle_covers)
 
     def toggle(self):
         """Set button_sell_book enabled or disabled depending on if a seller is specified."""
@@ -128,128 +287,193 @@ class Window(QMainWindow, Ui_MainWindow):
         else:
             self.button_sell_book.setEnabled(True)
 
+    def __sell__(self, basket):
+        """Journal the sale of a basket of {isbn: quantity} as one transaction and return whether it was in stock."""
+        stock = self.__journal__({isbn: -quantity for isbn, quantity in basket.items()})
+        if stock is None:
+            return False
+        prices = {isbn: self.model.book(isbn)[SELL_PRICE_COLUMN] for isbn in basket}
+        JOURNAL.record_sale(basket, prices, self.line_seller.text())
+        self.on_journaled(stock)
+        return True
+
     def sell_book(self):
         """Sell the selected book(s) and update the inventory and sales tables."""
-        rows = sorted(set(index.row() for index in self.table_inventory.selectedIndexes()))
-        cursor = CONN.cursor()
-        for row in rows:
-            model = self.table_inventory.model()
-            isbn = (
-                model.sourceModel()
-                .item(
-                    row,
-                )
-                .text()
-            )
-            cursor.execute(
-                REMOVE_ONE,
-                (isbn,),
-            )
-            cursor.execute(
-                "INSERT INTO sales (ISBN, date, price, seller) VALUES (?,?,?,?)",
-                (
-                    isbn,
-                    datetime.now(),
-                    self.line_sell_price.text(),
-                    self.line_seller.text(),
-                ),
-            )
-        CONN.commit()
-        self.update_table()
+        with metrics.timed("ui", "sell_book"):
+            isbns = self.__selected_isbns__()
+            if not isbns:
+                return
+            self.__sell__(Counter(isbns))
+
+    def toggle_scan_mode(self, enabled):
+        """Start or stop selling books read by a barcode scanner into the checkout basket."""
+        app = QApplication.instance()
+        if not enabled:
+            app.removeEventFilter(self.scanner)
+            self.checkout.hide()
+            return
+        if self.checkout is None:
+            resolve = self.model.book
+            if SERVER_MODE:
+                self.hot_titles = HotTitles(self.model.book)
+                resolve = self.hot_titles.get
+                if self.feed is not None:
+                    self.feed.books_changed.connect(self.hot_titles.update_books)
+            self.checkout = CheckoutPanel(resolve, self)
+            self.checkout.sell_requested.connect(self.sell_basket)
+            self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.checkout)
+            self.scanner = ScanDetector(SCAN_GAP_MS, scan_input=self.checkout.line_scan, window=self, parent=self)
+            self.scanner.scanned.connect(self.checkout.scan)
+        self.checkout.show()
+        self.checkout.line_scan.setFocus()
+        app.installEventFilter(self.scanner)
+
+    def toggle_covers(self, enabled):
+        """Show or hide cover thumbnails in the first column of the table."""
+        rows = self.table_inventory.verticalHeader()
+        columns = self.table_inventory.horizontalHeader()
+        if not enabled:
+            self.model.set_thumbnails(None)
+            if self.row_height is not None:
+                rows.setDefaultSectionSize(self.row_height)
+            return
+        self.row_height = rows.defaultSectionSize()
+        if self.thumbnails is None:
+            self.thumbnails = ThumbnailLoader(DB, COVERS, parent=self)
+        self.model.set_thumbnails(self.thumbnails)
+        rows.setDefaultSectionSize(TABLE_SIZE.height() + 4)
+        columns.moveSection(columns.visualIndex(COVER_COLUMN), 0)
+        columns.resizeSection(COVER_COLUMN, TABLE_SIZE.width() + 8)
+
+    def sell_basket(self, basket):
+        """Sell the scanned basket and empty it."""
+        with metrics.timed("ui", "sell_basket"):
+            if self.__sell__(basket):
+                self.checkout.clear()
+                self.status_bar.showMessage(f"Sålde {sum(basket.values())} böcker", 5000)
 
     def delete_book(self):
         """Remove the selected book(s) and update the inventory without adding a sales item."""
-        rows = sorted(set(index.row() for index in self.table_inventory.selectedIndexes()))
-        cursor = CONN.cursor()
-        for row in rows:
-            model = self.table_inventory.model()
-            isbn = (
-                model.sourceModel()
-                .item(
-                    row,
-                )
-                .text()
-            )
-            cursor.execute(
-                "DELETE FROM inventory WHERE ISBN = ?",
-                (isbn,),
-            )
-        CONN.commit()
-        self.update_table()
+        import mariadb  # pylint: disable=import-outside-toplevel
+
+        with metrics.timed("ui", "delete_book"):
+            isbns = self.__selected_isbns__()
+            try:
+                INVENTORY.delete(isbns)
+            except mariadb.Error as e:
+                QMessageBox.warning(self, "Böckerna kunde inte tas bort", str(e))
+                return
+            self.update_books(isbns)
 
     def add_one(self):
         """Bump the amount of the selected book(s) by one."""
-        rows = sorted(set(index.row() for index in self.table_inventory.selectedIndexes()))
-        cursor = CONN.cursor()
-        for row in rows:
-            model = self.table_inventory.model()
-            isbn = (
-                model.sourceModel()
-                .item(
-                    row,
-                )
-                .text()
-            )
-            cursor.execute(
-                ADD_ONE,
-                (isbn,),
-            )
-        CONN.commit()
-        self.update_table()
+        with metrics.timed("ui", "add_one"):
+            deltas = dict.fromkeys(self.__selected_isbns__(), 1)
+            if not deltas:
+                return
+            stock = self.__journal__(deltas)
+            if stock is None:
+                return
+            JOURNAL.record_adjustment(deltas)
+            self.on_journaled(stock)
 
     def delete_one(self):
         """Decrease the amount of the selected book(s) by one."""
-        rows = sorted(set(index.row() for index in self.table_inventory.selectedIndexes()))
-        cursor = CONN.cursor()
-        for row in rows:
-            model = self.table_inventory.model()
-            isbn = (
-                model.sourceModel()
-                .item(
-                    row,
-                )
-                .text()
-            )
-            cursor.execute(
-                REMOVE_ONE,
-                (isbn,),
-            )
-        CONN.commit()
-        self.update_table()
+        with metrics.timed("ui", "delete_one"):
+            deltas = dict.fromkeys(self.__selected_isbns__(), -1)
+            if not deltas:
+                return
+            stock = self.__journal__(deltas)
+            if stock is None:
+                return
+            JOURNAL.record_adjustment(deltas)
+            self.on_journaled(stock)
 
     def edit_book(self):
         """Open the dialog to edit the selected book."""
-        rows = sorted(set(index.row() for index in self.table_inventory.selectedIndexes()))
-        model = self.table_inventory.model()
-        isbn = (
-            model.sourceModel()
-            .item(
-                rows[0],
-            )
-            .text()
-        )
-        self.dialog = BookDialog(isbn)
-        self.dialog.update_table.connect(self.update_table)
+        isbns = self.__selected_isbns__()
+        if not isbns:
+            return
+        self.dialog = BookDialog(isbns[0])
+        self.dialog.book_changed.connect(self.update_book)
+        self.dialog.stock_changed.connect(self.on_journaled)
         self.dialog.exec()
 
+    def import_shipment(self):
+        """Import a shipment from a CSV or text file of ISBNs chosen by the user."""
+        import bulk_import  # pylint: disable=import-outside-toplevel
+
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Importera leverans", "", "CSV- och textfiler (*.csv *.txt);;Alla filer (*)"
+        )
+        if not path:
+            return
+        with open(path, encoding="utf-8-sig") as shipment:
+            lines = shipment.readlines()
+        progress = QProgressDialog("Importerar leverans", None, 0, 0, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.show()
+
+        def report(stage, done, total):
+            progress.setLabelText(stage)
+            progress.setMaximum(total)
+            progress.setValue(done)
+            QApplication.processEvents()
+
+        result = bulk_import.import_shipment(DB, lines, META_CACHE, progress=report)
+        progress.close()
+        self.update_books(result.imported)
+        summary = f"Importerade {len(result.imported)} titlar."
+        if result.unresolved:
+            summary += "\n\nHittades inte:\n" + "\n".join(result.unresolved)
+        if result.failed:
+            summary += "\n\nUppslaget misslyckades, försök igen:\n" + "\n".join(result.failed)
+        if result.invalid:
+            summary += "\n\nOgiltiga rader:\n" + "\n".join(result.invalid)
+        QMessageBox.information(self, "Import klar", summary)
+
+    def open_report(self):
+        """Open the sales report window."""
+        from reports import ReportDialog  # pylint: disable=import-outside-toplevel
+
+        self.report = ReportDialog(DB, self)
+        self.report.show()
+
+    def open_analytics(self):
+        """Open the stock valuation and dead stock window."""
+        from analytics import AnalyticsDialog  # pylint: disable=import-outside-toplevel
+
+        self.analytics = AnalyticsDialog(DB, self)
+        self.analytics.show()
+
+    def open_export(self):
+        """Open the window for exporting the inventory or the sales to a file."""
+        from export import ExportDialog  # pylint: disable=import-outside-toplevel
+
+        self.export = ExportDialog(DB, self)
+        self.export.show()
+
     def open_dialog(self):
         """Sell the selected book(s) and update the inventory and sales tables."""
         self.dialog = BookDialog(None)
-        self.dialog.update_table.connect(self.update_table)
+        self.dialog.book_changed.connect(self.update_book)
+        self.dialog.stock_changed.connect(self.on_journaled)
         self.dialog.exec()
 
 
 class BookDialog(QDialog, Ui_Dialog):
     """Book dialog of the Bokhandeln application."""
 
-    update_table = QtCore.pyqtSignal(bool)
+    book_changed = QtCore.pyqtSignal(str)
+    stock_changed = QtCore.pyqtSignal(object)
 
     def __init__(self, isbn, parent=None):
         """Initialize the book dialog of the Bokhandeln application."""
         super().__init__(parent)
         self.setupUi(self)
+        self.isbn = None
+        self.cover_url = None
         self.connect_signals_slots()
-        print(isbn)
         if isbn is not None:
             self.line_isbn.setText(isbn)
             self.lookup_book()
@@ -260,6 +484,9 @@ class BookDialog(QDialog, Ui_Dialog):
         self.action_add_book.triggered.connect(self.add_book)
         self.action_close_dialog.triggered.connect(self.close_dialog)
         self.action_toggle_sale.triggered.connect(self.toggle_sale)
+        LOOKUPS.meta_ready.connect(self.on_meta_ready)
+        LOOKUPS.cover_ready.connect(self.on_cover_ready)
+        LOOKUPS.lookup_failed.connect(self.on_lookup_failed)
 
     def close_dialog(self):
         """Close the book dialog."""
@@ -273,48 +500,66 @@ class BookDialog(QDialog, Ui_Dialog):
             self.button_save.setText("Spara")
 
     def lookup_book(self):
-        """Fetch book information from the database or internet and populate the form."""
-        cur = CONN.cursor()
-        isbn = isbnlib.canonical(self.line_isbn.text())
-        cur.execute(
-            "SELECT title, author, lang, year, buy_price, sell_price, row, amount, cover FROM inventory WHERE ISBN=?",
-            (isbn,),
-        )
-        result = cur.fetchone()
-        if result is not None:
-            self.line_title.setText(result[0])
-            self.line_author.setText(result[1])
-            self.line_language.setText(result[2])
-            self.line_year.setText(str(result[3]))
-            self.line_buy_price.setText(str(result[4]))
-            self.line_sell_price.setText(str(result[5]))
-            self.line_row.setText(str(result[6]))
-            self.line_amount.setText(str(result[7]))
-            if result[8] == NO_COVER:
-                self.label_cover.setPixmap(QPixmap(NO_COVER))
-                self.label_cover.show()
-            else:
-                image = QImage()
-                image.loadFromData(requests.get(result[8], timeout=5).content)
-                self.label_cover.setPixmap(QPixmap(image))
-                self.label_cover.show()
-        else:
-            book_info = isbnlib.meta(isbn)
-            self.line_title.setText(book_info["Title"])
-            self.line_author.setText(book_info["Authors"][0])
-            self.line_year.setText(book_info["Year"])
-            self.line_language.setText(book_info["Language"])
-            self.line_amount.setText("0")
-            if "thumbnail" in isbnlib.cover(isbn):
-                image = QImage()
-                image.loadFromData(
-                    requests.get(isbnlib.cover(isbn)["thumbnail"], timeout=5).content
-                )
-                self.label_cover.setPixmap(QPixmap(image))
-                self.label_cover.show()
+        """Fill the form from the database and start fetching anything else from the internet in the background."""
+        with metrics.timed("ui", "lookup_book"):
+            if self.isbn is not None:
+                LOOKUPS.cancel(self.isbn)
+            isbn = canonical_isbn(self.line_isbn.text())
+            if isbn is None:
+                QMessageBox.warning(self, "Ogiltigt ISBN", f"{self.line_isbn.text()} är inte ett giltigt ISBN.")
+                return
+            self.isbn = isbn
+            book = INVENTORY.get(isbn)
+            if book is not None:
+                self.line_title.setText(book.title)
+                self.line_author.setText(book.author)
+                self.line_language.setText(cell_text(book.lang))
+                self.line_year.setText(cell_text(book.year))
+                self.line_buy_price.setText(cell_text(book.buy_price))
+                self.line_sell_price.setText(cell_text(book.sell_price))
+                self.line_row.setText(cell_text(book.row))
+                self.line_amount.setText(cell_text(book.amount))
+                self.__show_cover__(book.cover)
             else:
-                self.label_cover.setPixmap(QPixmap(NO_COVER))
-                self.label_cover.show()
+                self.line_amount.setText("0")
+                self.__show_cover__(None)
+                LOOKUPS.lookup_meta(isbn)
+
+    def on_meta_ready(self, isbn, book_info):
+        """Fill the form with metadata fetched from the internet for the current ISBN."""
+        if isbn != self.isbn:
+            return
+        self.line_title.setText(book_info["Title"])
+        self.line_author.setText(book_info["Authors"][0] if book_info["Authors"] else "")
+        self.line_year.setText(book_info["Year"])
+        self.line_language.setText(book_info["Language"])
+        self.__show_cover__(book_info["Cover"])
+
+    def on_cover_ready(self, url, image):
+        """Show a cover fetched in the background if it belongs to the current book."""
+        if url != self.cover_url:
+            return
+        self.label_cover.setPixmap(COVERS.insert(url, image))
+        self.label_cover.show()
+
+    def on_lookup_failed(self, subject, error):
+        """Report a failed background lookup for the current book."""
+        if subject not in (self.isbn, self.cover_url):
+            return
+        print(f"Lookup of {subject} failed: {error}")
+
+    def __show_cover__(self, url):
+        """Show the cover at the given URL from the cover cache, fetching it in the background on a miss."""
+        self.cover_url = url if url and url != NO_COVER else None
+        pixmap = None
+        if self.cover_url is not None:
+            pixmap = COVERS.find(self.cover_url)
+            if pixmap is None:
+                LOOKUPS.fetch_cover(self.isbn, self.cover_url)
+        if pixmap is None:
+            pixmap = QPixmap(NO_COVER)
+        self.label_cover.setPixmap(pixmap)
+        self.label_cover.show()
 
     def __clear_form__(self):
         """Clear all fields in the book dialog form and sets focus to the ISBN field."""
@@ -330,87 +575,97 @@ class BookDialog(QDialog, Ui_Dialog):
         self.line_isbn.setFocus()
         self.label_cover.setPixmap(QPixmap(NO_COVER))
         self.label_cover.show()
+        self.isbn = None
+        self.cover_url = None
 
     def add_book(self):
         """Add a book to the inventory."""
-        if self.button_save.text() == "Spara":
-            cursor = CONN.cursor()
-            if "thumbnail" in isbnlib.cover(self.line_isbn.text()):
-                cover = isbnlib.cover(self.line_isbn.text())["thumbnail"]
-            else:
-                cover = NO_COVER
-            book = {
-                "ISBN": self.line_isbn.text(),
-                "author": self.line_author.text(),
-                "title": self.line_title.text(),
-                "lang": self.line_language.text(),
-                "year": self.line_year.text(),
-                "buy_price": self.line_buy_price.text(),
-                "sell_price": self.line_sell_price.text(),
-                "row": self.line_row.text(),
-                "cover": cover,
-                "amount": 1,
-            }
-            placeholders = ", ".join(["%s"] * len(book))
-            columns = ", ".join(book.keys())
-            sql = f"""
-                INSERT INTO inventory ({columns}) VALUES ( {placeholders} ) ON DUPLICATE KEY UPDATE
-                    author = VALUES(author),
-                    title = VALUES(title),
-                    lang = VALUES(lang),
-                    year = VALUES(year),
-                    buy_price = VALUES(buy_price),
-                    sell_price = VALUES(sell_price),
-                    row = VALUES(row),
-                    amount = amount + 1
-                """
-            cursor.execute(sql, tuple(book.values()))
-            CONN.commit()
-            if self.line_amount.text() is not None:
-                self.line_amount.setText(str(int(self.line_amount.text()) + 1))
-            else:
-                self.line_amount.setText("1")
-            self.update_table.emit(True)
-            self.__clear_form__()
-        elif self.button_save.text() == "Sälj":
-            cursor = CONN.cursor()
-            cursor.execute(
-                REMOVE_ONE,
-                (self.line_isbn.text(),),
-            )
-            cursor.execute(
-                "INSERT INTO sales (ISBN, date, price, seller) VALUES (?,?,?,?)",
-                (
-                    self.line_isbn.text(),
-                    datetime.now(),
-                    self.line_sell_price.text(),
-                    self.line_seller.text(),
-                ),
-            )
-            CONN.commit()
-            self.line_amount.setText(str(int(self.line_amount.text()) - 1))
-            self.update_table.emit(True)
-            self.__clear_form__()
+        import mariadb  # pylint: disable=import-outside-toplevel
+
+        with metrics.timed("ui", "add_book"):
+            isbn = canonical_isbn(self.line_isbn.text())
+            if isbn is None:
+                QMessageBox.warning(self, "Ogiltigt ISBN", f"{self.line_isbn.text()} är inte ett giltigt ISBN.")
+                return
+            try:
+                year = parse_int(self.line_year.text())
+                buy_price = parse_int(self.line_buy_price.text())
+                sell_price = parse_int(self.line_sell_price.text())
+            except ValueError:
+                QMessageBox.warning(self, "Ogiltigt värde", "År och priser måste vara heltal.")
+                return
+            if any(value is not None and value < 0 for value in (year, buy_price, sell_price)):
+                QMessageBox.warning(self, "Ogiltigt värde", "År och priser får inte vara negativa.")
+                return
+            if self.button_save.text() == "Spara":
+                book = Book(
+                    isbn=isbn,
+                    author=self.line_author.text(),
+                    title=self.line_title.text(),
+                    lang=self.line_language.text() or None,
+                    year=year,
+                    buy_price=buy_price,
+                    sell_price=sell_price,
+                    row=self.line_row.text() or None,
+                    amount=1,
+                    cover=self.cover_url or NO_COVER,
+                )
+                try:
+                    INVENTORY.upsert(book)
+                except mariadb.Error as e:
+                    QMessageBox.warning(self, "Boken kunde inte sparas", str(e))
+                    return
+                self.line_amount.setText(str((parse_int(self.line_amount.text()) or 0) + 1))
+                self.book_changed.emit(isbn)
+                self.__clear_form__()
+            elif self.button_save.text() == "Sälj":
+                amount = (parse_int(self.line_amount.text()) or 0) - 1
+                if amount < 0:
+                    QMessageBox.warning(self, "Inte tillräckligt i lager", f"{isbn} är slut i lager.")
+                    return
+                JOURNAL.record_sale({isbn: 1}, {isbn: sell_price}, self.line_seller.text())
+                self.line_amount.setText(str(amount))
+                self.stock_changed.emit({isbn: amount})
+                self.__clear_form__()
 
 
 if __name__ == "__main__":
-    BOKHANDELN_DB_USER = config("BOKHANDELN_DB_USER")
-    BOKHANDELN_DB_PASSWORD = config("BOKHANDELN_DB_PASSWORD")
-    BOKHANDELN_DB_HOST = config("BOKHANDELN_DB_HOST")
-    BOKHANDELN_DB_PORT = config("BOKHANDELN_DB_PORT")
-    BOKHANDELN_DB_DATABASE = config("BOKHANDELN_DB_DATABASE")
-    try:
-        CONN = mariadb.connect(
-            user=BOKHANDELN_DB_USER,
-            password=BOKHANDELN_DB_PASSWORD,
-            host=BOKHANDELN_DB_HOST,
-            port=int(BOKHANDELN_DB_PORT),
-            database=BOKHANDELN_DB_DATABASE,
-        )
-    except mariadb.Error as e:
-        print(f"Error connecting to MariaDB Platform: {e}")
-        sys.exit(1)
+    SERVER_MODE = config("BOKHANDELN_SERVER_MODE", default=False, cast=bool)
+    SYNC_INTERVAL_MS = config("BOKHANDELN_SYNC_INTERVAL_MS", default=1000, cast=int)
+    JOURNAL_FLUSH_MS = config("BOKHANDELN_JOURNAL_FLUSH_MS", default=500, cast=int)
+    SCAN_GAP_MS = config("BOKHANDELN_SCAN_GAP_MS", default=BURST_GAP_MS, cast=int)
+    TABLE_COVERS = config("BOKHANDELN_TABLE_COVERS", default=False, cast=bool)
+    FAST_START = config("BOKHANDELN_FAST_START", default=False, cast=bool) and not SERVER_MODE
+    MIGRATE = config("BOKHANDELN_MIGRATE_ON_STARTUP", default=True, cast=bool)
+    if FAST_START:
+        SNAPSHOT_PATH = config("BOKHANDELN_SNAPSHOT", default=DEFAULT_SNAPSHOT)
+    metrics.configure()
+    JOURNAL = SalesJournal(config("BOKHANDELN_JOURNAL", default=DEFAULT_JOURNAL))
+    COVERS = CoverCache(
+        config("BOKHANDELN_COVER_CACHE_DIR", default=DEFAULT_DIRECTORY),
+        config("BOKHANDELN_COVER_CACHE_MB", default=100, cast=int) * 1024 * 1024,
+    )
     app = QApplication(sys.argv)
-    win = Window()
-    win.show()
+    if FAST_START:
+        win = Window(load_snapshot(SNAPSHOT_PATH))
+        win.show()
+        win.connect_in_background(MIGRATE)
+    else:
+        import mariadb
+        import db
+        import migrations
+
+        try:
+            database = db.Database()
+            if MIGRATE:
+                migrations.migrate(database)
+        except mariadb.Error as e:
+            print(f"Error connecting to MariaDB Platform: {e}")
+            sys.exit(1)
+        except migrations.MigrationError as e:
+            print(f"Error migrating the database: {e}")
+            sys.exit(1)
+        start_services(database)
+        win = Window()
+        win.show()
     sys.exit(app.exec())
@@ -0,0 +1,247 @@
+"""Bulk import of incoming shipments from a list of ISBNs."""
+import argparse
+import csv
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from core import NO_COVER, canonical_isbn
+from meta_cache import BookNotFound, MetaCache, fetch_meta
+from stock import placeholders, record_changes
+
+
+CHUNK_SIZE = 500
+INSERT_COLUMNS = ("ISBN", "author", "title", "lang", "year", "buy_price", "sell_price", "row", "cover", "amount")
+
+
+@dataclass
+class ShipmentLine:
+    """One deduplicated book of a shipment."""
+
+    isbn: str
+    amount: int = 0
+    buy_price: int = None
+    sell_price: int = None
+    row: str = None
+
+
+@dataclass
+class ImportResult:
+    """Outcome of a bulk import."""
+
+    imported: list = field(default_factory=list)
+    unresolved: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+    invalid: list = field(default_factory=list)
+
+
+class RateLimiter:
+    """Spaces out calls from several threads to at most ``rate`` per second."""
+
+    def __init__(self, rate):
+        """Initialize the limiter."""
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        """Block until the caller may make its next call."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_price(text):
+    """Parse a price such as "129" or "129,50" into whole kronor, or None if it is empty."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    return round(float(text.replace(",", ".")))
+
+
+def parse_shipment(lines):
+    """Parse "ISBN[, amount[, buy price[, sell price[, shelf]]]]" lines into ({isbn13: ShipmentLine}, invalid lines).
+
+    A first line without any digits is taken to be a header and skipped; every other line that can't be parsed is invalid.
+    """
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return {}, []
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    books = {}
+    invalid = []
+    for number, cells in enumerate(csv.reader(lines, dialect), start=1):
+        cells = [cell.strip() for cell in cells] + [""] * 5
+        isbn = canonical_isbn(cells[0])
+        if isbn is None:
+            if number > 1 or any(char.isdigit() for char in lines[0]):
+                invalid.append(lines[number - 1].rstrip("\n"))
+            continue
+        try:
+            amount = int(cells[1]) if cells[1] else 1
+            buy_price = parse_price(cells[2])
+            sell_price = parse_price(cells[3])
+        except ValueError:
+            invalid.append(lines[number - 1].rstrip("\n"))
+            continue
+        if amount <= 0 or any(price is not None and price < 0 for price in (buy_price, sell_price)):
+            invalid.append(lines[number - 1].rstrip("\n"))
+            continue
+        book = books.setdefault(isbn, ShipmentLine(isbn))
+        book.amount += amount
+        book.buy_price = buy_price if buy_price is not None else book.buy_price
+        book.sell_price = sell_price if sell_price is not None else book.sell_price
+        book.row = cells[4] or book.row
+    return books, invalid
+
+
+def existing_isbns(database, isbns):
+    """Return the subset of the given ISBNs that are already in the inventory."""
+    isbns = list(isbns)
+    existing = set()
+    for start in range(0, len(isbns), CHUNK_SIZE):
+        chunk = isbns[start:start + CHUNK_SIZE]
+        rows = database.fetchall(f"SELECT ISBN FROM inventory WHERE ISBN IN ({placeholders(len(chunk))})", chunk)
+        existing.update(isbn for (isbn,) in rows)
+    return existing
+
+
+def resolve_metadata(isbns, workers=8, rate=10, progress=None):
+    """Fetch metadata concurrently, returning ({isbn: book_info, or None if unknown}, ISBNs whose lookup failed)."""
+    limiter = RateLimiter(rate)
+    resolved = {}
+    failed = []
+
+    def lookup(isbn):
+        limiter.wait()
+        return fetch_meta(isbn)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(lookup, isbn): isbn for isbn in isbns}
+        for done, future in enumerate(as_completed(futures), start=1):
+            isbn = futures[future]
+            try:
+                resolved[isbn] = future.result()
+            except BookNotFound:
+                resolved[isbn] = None
+            except Exception:  # pylint: disable=broad-except
+                failed.append(isbn)
+            if progress is not None:
+                progress("Hämtar bokinformation", done, len(futures))
+    return resolved, failed
+
+
+def inventory_row(book, book_info):
+    """Return the inventory values of a shipment line, with metadata for books that aren't in stock yet."""
+    book_info = book_info or {}
+    year = str(book_info.get("Year") or "")
+    return (
+        book.isbn,
+        (book_info.get("Authors") or [""])[0],
+        book_info.get("Title") or "",
+        book_info.get("Language") or None,
+        int(year) if year.isdigit() else None,
+        book.buy_price,
+        book.sell_price,
+        book.row,
+        book_info.get("Cover") or NO_COVER,
+        book.amount,
+    )
+
+
+def upsert_books(database, rows, progress=None):
+    """Insert or restock inventory rows with multi-row statements, committing once per chunk."""
+    row_placeholders = f"({placeholders(len(INSERT_COLUMNS))})"
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start:start + CHUNK_SIZE]
+        sql = f"""
+            INSERT INTO inventory ({", ".join(INSERT_COLUMNS)}) VALUES {", ".join([row_placeholders] * len(chunk))}
+            ON DUPLICATE KEY UPDATE
+                buy_price = COALESCE(VALUES(buy_price), buy_price),
+                sell_price = COALESCE(VALUES(sell_price), sell_price),
+                row = COALESCE(VALUES(row), row),
+                amount = amount + VALUES(amount)
+            """
+        with database.connection() as conn:
+            database.cursor(conn, sql).execute(sql, tuple(value for row in chunk for value in row))
+            record_changes(database, conn, [row[0] for row in chunk])
+            conn.commit()
+        if progress is not None:
+            progress("Sparar", start + len(chunk), len(rows))
+
+
+def import_shipment(database, lines, meta_cache=None, workers=8, rate=10, progress=None):
+    """Import a shipment into the inventory and return an ImportResult.
+
+    Books whose metadata lookup failed, rather than found nothing, are listed as failed so the import can be retried.
+    """
+    books, invalid = parse_shipment(lines)
+    result = ImportResult(invalid=invalid)
+    existing = existing_isbns(database, books)
+    missing = [isbn for isbn in books if isbn not in existing]
+    metadata = {}
+    if meta_cache is not None:
+        for isbn, (hit, book_info) in meta_cache.get_many(missing).items():
+            if hit:
+                metadata[isbn] = book_info
+    fetched, failed = resolve_metadata([isbn for isbn in missing if isbn not in metadata], workers, rate, progress)
+    if meta_cache is not None:
+        meta_cache.put_many(fetched)
+    metadata.update(fetched)
+    failed = set(failed)
+    rows = []
+    for isbn, book in books.items():
+        if isbn in existing or metadata.get(isbn) is not None:
+            rows.append(inventory_row(book, metadata.get(isbn)))
+            result.imported.append(isbn)
+        elif isbn in failed:
+            result.failed.append(isbn)
+        else:
+            result.unresolved.append(isbn)
+    upsert_books(database, rows, progress)
+    return result
+
+
+def print_progress(stage, done, total):
+    """Report import progress on stderr."""
+    print(f"\r{stage}: {done}/{total}", end="\n" if done == total else "", file=sys.stderr)
+
+
+def main(argv=None):
+    """Import shipments from the command line."""
+    import mariadb  # pylint: disable=import-outside-toplevel
+    import db  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Importera en leverans från en lista med ISBN.")
+    parser.add_argument("file", help='CSV- eller textfil med "ISBN, antal, inköpspris, säljpris, hylla" per rad')
+    parser.add_argument("--workers", type=int, default=8, help="antal samtidiga uppslag")
+    parser.add_argument("--rate", type=float, default=10, help="högsta antal uppslag per sekund")
+    args = parser.parse_args(argv)
+    with open(args.file, encoding="utf-8-sig") as shipment:
+        lines = shipment.readlines()
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    result = import_shipment(database, lines, MetaCache(database), args.workers, args.rate, print_progress)
+    print(f"Importerade {len(result.imported)} titlar.")
+    for isbn in result.unresolved:
+        print(f"Hittades inte: {isbn}")
+    for isbn in result.failed:
+        print(f"Uppslaget misslyckades, försök igen: {isbn}")
+    for line in result.invalid:
+        print(f"Ogiltig rad: {line}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
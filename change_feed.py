@@ -0,0 +1,123 @@
+"""Polling of the inventory change feed written by every till."""
+from datetime import datetime, timedelta
+
+from PyQt5 import QtCore
+from core import INVENTORY_COLUMNS
+from stock import LAST_VERSION, placeholders
+
+
+BATCH_SIZE = 1000
+RETENTION = timedelta(days=2)
+PRUNE_EVERY = 3600
+
+
+def latest_version(database):
+    """Return the newest committed version in the change feed, or 0 if none has been handed out.
+
+    The version is read from the sequence counter rather than the feed, which is pruned and could be empty.
+    """
+    row = database.fetchone(LAST_VERSION)
+    return row[0] if row else 0
+
+
+def read_changes(database, since):
+    """Return (last version, changed ISBNs, their current inventory rows, whether a full reload is needed).
+
+    Versions are dense and committed in order (see stock.record_changes), so an oldest entry beyond since + 1
+    means the entries a till hadn't read yet were pruned.
+    """
+    oldest = database.fetchone("SELECT MIN(version) FROM inventory_changes")[0]
+    if since and oldest is not None and oldest > since + 1:
+        return latest_version(database), [], [], True
+    changes = database.fetchall(
+        "SELECT version, ISBN FROM inventory_changes WHERE version > ? ORDER BY version LIMIT ?",
+        (since, BATCH_SIZE),
+    )
+    if not changes:
+        return since, [], [], False
+    isbns = list(dict.fromkeys(isbn for _, isbn in changes))
+    inventory = database.fetchall(
+        f"SELECT {INVENTORY_COLUMNS} FROM inventory WHERE ISBN IN ({placeholders(len(isbns))})",
+        isbns,
+    )
+    return changes[-1][0], isbns, inventory, False
+
+
+def prune_changes(database):
+    """Delete change feed entries older than RETENTION."""
+    with database.connection() as conn:
+        conn.cursor().execute("DELETE FROM inventory_changes WHERE changed < ?", (datetime.now() - RETENTION,))
+        conn.commit()
+
+
+class SyncTask(QtCore.QRunnable):
+    """Runnable that reads new changes on a worker thread and hands them to its ChangeFeed."""
+
+    def __init__(self, feed, since, prune=False):
+        """Initialize the task, optionally pruning old changes first."""
+        super().__init__()
+        self.feed = feed
+        self.since = since
+        self.prune = prune
+
+    def run(self):
+        """Read the changes since the last seen version."""
+        try:
+            if self.prune:
+                prune_changes(self.feed.database)
+            result = read_changes(self.feed.database, self.since)
+        except Exception as error:  # pylint: disable=broad-except
+            self.feed.task_done.emit(None, str(error))
+            return
+        self.feed.task_done.emit(result, "")
+
+
+class ChangeFeed(QtCore.QObject):
+    """Polls the change feed in the background and reports the changed books to the GUI thread."""
+
+    books_changed = QtCore.pyqtSignal(object, object)
+    reload_needed = QtCore.pyqtSignal()
+    task_done = QtCore.pyqtSignal(object, str)
+
+    def __init__(self, database, version, interval_ms=1000, parent=None):
+        """Initialize the feed to report changes after the given version every interval_ms."""
+        super().__init__(parent)
+        self.database = database
+        self.version = version
+        self.running = False
+        self.polls = 0
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.poll)
+        self.task_done.connect(self.__finish__)
+
+    def start(self):
+        """Start polling."""
+        self.timer.start()
+
+    def stop(self):
+        """Stop polling."""
+        self.timer.stop()
+
+    def poll(self):
+        """Look for new changes unless the previous poll is still running."""
+        if self.running:
+            return
+        self.running = True
+        self.polls += 1
+        self.pool.start(SyncTask(self, self.version, prune=self.polls % PRUNE_EVERY == 0))
+
+    def __finish__(self, result, error):
+        """Forward the changes read by a SyncTask."""
+        self.running = False
+        if result is None:
+            print(f"Synchronization failed: {error}")
+            return
+        version, isbns, inventory, reload = result
+        self.version = version
+        if reload:
+            self.reload_needed.emit()
+        elif isbns:
+            self.books_changed.emit(isbns, inventory)
+            self.poll()
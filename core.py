@@ -0,0 +1,213 @@
+"""Headless core of Bokhandeln: inventory, sales and metadata services shared by the GUI and the HTTP API."""
+import re
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from meta_cache import BookNotFound, fetch_meta
+from stock import adjust_stock, placeholders, record_changes, sell
+
+
+INVENTORY_COLUMNS = "ISBN, author, title, lang, year, buy_price, sell_price, row, amount"
+NO_COVER = "no_cover.png"
+ISBN_QUERY = re.compile(r"^[\d\s-]*[\dXx]$")
+NOT_ISBN_CHARACTERS = re.compile(r"[^0-9X]")
+UPSERT_BOOK = """
+    INSERT INTO inventory (ISBN, author, title, lang, year, buy_price, sell_price, row, cover, amount)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE
+        author = VALUES(author),
+        title = VALUES(title),
+        lang = VALUES(lang),
+        year = VALUES(year),
+        buy_price = VALUES(buy_price),
+        sell_price = VALUES(sell_price),
+        row = VALUES(row),
+        amount = amount + VALUES(amount)
+    """
+DELETE_BOOK = "DELETE FROM inventory WHERE ISBN = ?"
+
+
+def parse_int(text):
+    """Parse an optional whole number typed into a form, returning None for an empty field."""
+    if text is None:
+        return None
+    text = str(text).strip()
+    if not text:
+        return None
+    return int(text)
+
+
+def canonical_isbn(text):
+    """Return the ISBN-13 of a scanned or typed ISBN, or None if it isn't a valid ISBN."""
+    isbn = NOT_ISBN_CHARACTERS.sub("", (text or "").upper())
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        if sum((10 - position) * (10 if char == "X" else int(char)) for position, char in enumerate(isbn)) % 11:
+            return None
+        isbn = "978" + isbn[:9]
+        return isbn + str(-sum(int(char) * (3 if position % 2 else 1) for position, char in enumerate(isbn)) % 10)
+    if len(isbn) == 13 and isbn.isdigit() and isbn[:3] in ("978", "979"):
+        if sum(int(char) * (3 if position % 2 else 1) for position, char in enumerate(isbn)) % 10:
+            return None
+        return isbn
+    return None
+
+
+def search_conditions(query):
+    """Return the WHERE conditions and parameters that find books by ISBN prefix, or by title and author."""
+    query = (query or "").strip()
+    if not query:
+        return [], []
+    if ISBN_QUERY.match(query):
+        return ["ISBN LIKE ?"], [re.sub(r"[\s-]", "", query) + "%"]
+    words = re.findall(r"\w+", query)
+    if not words:
+        return [], []
+    return ["MATCH (title, author) AGAINST (? IN BOOLEAN MODE)"], [" ".join(f"+{word}*" for word in words)]
+
+
+@dataclass(frozen=True)
+class Book:
+    """A title in the inventory."""
+
+    isbn: str
+    author: str
+    title: str
+    lang: Optional[str] = None
+    year: Optional[int] = None
+    buy_price: Optional[int] = None
+    sell_price: Optional[int] = None
+    row: Optional[str] = None
+    amount: int = 0
+    cover: str = NO_COVER
+
+    @classmethod
+    def from_row(cls, row, cover=NO_COVER):
+        """Build a Book from a row selected with INVENTORY_COLUMNS."""
+        return cls(*row, cover=cover)
+
+    def to_dict(self):
+        """Return the book as a JSON-serializable dict."""
+        return asdict(self)
+
+
+class InventoryRepository:
+    """Reads and writes books in the inventory table."""
+
+    def __init__(self, database):
+        """Initialize the repository on the given database."""
+        self.database = database
+
+    def rows(self, isbns=None):
+        """Return the raw inventory rows of all books, or of the given ISBNs."""
+        if isbns is None:
+            return self.database.fetchall(f"SELECT {INVENTORY_COLUMNS} FROM inventory")
+        isbns = list(isbns)
+        if not isbns:
+            return []
+        return self.database.fetchall(
+            f"SELECT {INVENTORY_COLUMNS} FROM inventory WHERE ISBN IN ({placeholders(len(isbns))})",
+            isbns,
+        )
+
+    def covers(self, isbns):
+        """Return {isbn: cover URL or None} of the given ISBNs that are in the inventory."""
+        isbns = list(isbns)
+        if not isbns:
+            return {}
+        rows = self.database.fetchall(
+            f"SELECT ISBN, cover FROM inventory WHERE ISBN IN ({placeholders(len(isbns))})",
+            isbns,
+        )
+        return {isbn: cover if cover and cover != NO_COVER else None for isbn, cover in rows}
+
+    def get(self, isbn):
+        """Return the book with the given ISBN, or None."""
+        row = self.database.fetchone(f"SELECT {INVENTORY_COLUMNS}, cover FROM inventory WHERE ISBN = ?", (isbn,))
+        if row is None:
+            return None
+        return Book.from_row(row[:-1], cover=row[-1] or NO_COVER)
+
+    def search(self, query, limit=50):
+        """Return up to limit books matching a search on ISBN prefix, title or author."""
+        conditions, params = search_conditions(query)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.database.fetchall(
+            f"SELECT {INVENTORY_COLUMNS}, cover FROM inventory{where} ORDER BY title, ISBN LIMIT {int(limit)}",
+            params,
+        )
+        return [Book.from_row(row[:-1], cover=row[-1] or NO_COVER) for row in rows]
+
+    def upsert(self, book):
+        """Add a book, or update its details and add book.amount copies if it is already in stock."""
+        values = (
+            book.isbn,
+            book.author,
+            book.title,
+            book.lang,
+            book.year,
+            book.buy_price,
+            book.sell_price,
+            book.row,
+            book.cover,
+            book.amount,
+        )
+        with self.database.connection() as conn:
+            self.database.cursor(conn, UPSERT_BOOK).execute(UPSERT_BOOK, values)
+            record_changes(self.database, conn, [book.isbn])
+            conn.commit()
+
+    def delete(self, isbns):
+        """Remove the given books from the inventory."""
+        isbns = list(isbns)
+        if not isbns:
+            return
+        with self.database.connection() as conn:
+            self.database.cursor(conn, DELETE_BOOK).executemany(DELETE_BOOK, [(isbn,) for isbn in isbns])
+            record_changes(self.database, conn, isbns)
+            conn.commit()
+
+    def adjust(self, deltas):
+        """Change the stock of {isbn: delta} in one transaction and return the new stock."""
+        return adjust_stock(self.database, deltas)
+
+
+class SalesService:
+    """Records sales against the inventory."""
+
+    def __init__(self, database, repository):
+        """Initialize the service on the given database and inventory repository."""
+        self.database = database
+        self.repository = repository
+
+    def checkout(self, basket, seller, prices=None):
+        """Sell a basket of {isbn: quantity}, priced from prices or the books' sell prices, and return the new stock."""
+        prices = dict(prices or {})
+        missing = [isbn for isbn in basket if isbn not in prices]
+        if missing:
+            for row in self.repository.rows(missing):
+                prices[row[0]] = row[6]
+        unknown = [isbn for isbn in basket if isbn not in prices]
+        if unknown:
+            raise KeyError(f"Okända ISBN: {', '.join(unknown)}")
+        return sell(self.database, basket, prices, seller)
+
+
+class MetadataService:
+    """Looks up book metadata, through the metadata cache when there is one."""
+
+    def __init__(self, meta_cache=None):
+        """Initialize the service with an optional MetaCache."""
+        self.meta_cache = meta_cache
+
+    def lookup(self, isbn):
+        """Return the metadata of a book, or None if the providers don't know it."""
+        if self.meta_cache is not None:
+            hit, book_info = self.meta_cache.get(isbn)
+            if hit:
+                return book_info
+        try:
+            book_info = fetch_meta(isbn)
+        except BookNotFound:
+            book_info = None
+        if self.meta_cache is not None:
+            self.meta_cache.put(isbn, book_info)
+        return book_info
@@ -0,0 +1,153 @@
+"""On-disk and in-memory cache of book cover thumbnails."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage, QPixmap, QPixmapCache
+
+import metrics
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "bokhandeln", "covers")
+THUMBNAIL_SIZE = QtCore.QSize(256, 384)
+
+
+def cover_key(url):
+    """Return the cache key of a cover URL."""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def scale_thumbnail(image):
+    """Scale a decoded cover down to thumbnail size, keeping its aspect ratio."""
+    if image.width() <= THUMBNAIL_SIZE.width() and image.height() <= THUMBNAIL_SIZE.height():
+        return image
+    return image.scaled(THUMBNAIL_SIZE, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+
+class CoverCache:
+    """Size-bounded LRU cache of pre-scaled cover thumbnails, keyed by cover URL.
+
+    The directory is scanned once, when the cache is created; after that the size and the order of use of the
+    thumbnails are kept in memory, so storing a cover doesn't read the whole directory.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=100 * 1024 * 1024, timeout=5):
+        """Initialize the cache in the given directory, creating it if needed."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total = 0
+        self.__scan__()
+
+    def path(self, url):
+        """Return the file the thumbnail of the given cover URL is stored in."""
+        return os.path.join(self.directory, cover_key(url) + ".png")
+
+    def image(self, url):
+        """Return the thumbnail of a cover from disk, downloading it on a miss, or None if it can't be fetched."""
+        path = self.path(url)
+        image = QImage()
+        if image.load(path):
+            os.utime(path)
+            self.__used__(path)
+            return image
+        import requests  # pylint: disable=import-outside-toplevel
+        try:
+            with metrics.timed("lookup", "cover"):
+                response = requests.get(url, timeout=self.timeout)
+                response.raise_for_status()
+        except requests.RequestException:
+            return None
+        if not image.loadFromData(response.content):
+            return None
+        image = scale_thumbnail(image)
+        self.store(path, image)
+        return image
+
+    def __scan__(self):
+        """Read the size and last use of the thumbnails already on disk, and evict any beyond max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".png"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        with self.lock:
+            self.entries = OrderedDict((path, size) for _, size, path in entries)
+            self.total = sum(self.entries.values())
+        self.evict()
+
+    def __used__(self, path):
+        """Mark a thumbnail as the most recently used one."""
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+                return
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        self.__add__(path, size)
+
+    def __add__(self, path, size):
+        """Count a thumbnail of size bytes written to path as the most recently used one."""
+        with self.lock:
+            self.total += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+
+    def store(self, path, image):
+        """Write a thumbnail to disk and evict the least recently used ones if the cache is full."""
+        partial = path + ".part"
+        if not image.save(partial, "PNG"):
+            if os.path.exists(partial):
+                os.remove(partial)
+            return
+        size = os.path.getsize(partial)
+        os.replace(partial, path)
+        self.__add__(path, size)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used thumbnails until the cache fits in max_bytes."""
+        while True:
+            with self.lock:
+                if self.total <= self.max_bytes or not self.entries:
+                    return
+                path, size = self.entries.popitem(last=False)
+                self.total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def find(self, url):
+        """Return the cover as a QPixmap if it has already been decoded this session, otherwise None."""
+        pixmap = QPixmapCache.find(cover_key(url))
+        if pixmap is None or pixmap.isNull():
+            return None
+        return pixmap
+
+    def insert(self, url, image):
+        """Convert a thumbnail to a QPixmap and keep it in memory for the rest of the session."""
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(cover_key(url), pixmap)
+        return pixmap
+
+    def pixmap(self, url):
+        """Return the cover as a QPixmap, reusing pixmaps decoded earlier in the session, or None."""
+        pixmap = self.find(url)
+        if pixmap is not None:
+            return pixmap
+        image = self.image(url)
+        if image is None:
+            return None
+        return self.insert(url, image)
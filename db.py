@@ -0,0 +1,165 @@
+"""Database access for Bokhandeln, configured through .env."""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from decouple import config
+import mariadb
+
+import metrics
+
+
+RETRYABLE_ERRORS = (mariadb.InterfaceError, mariadb.OperationalError)
+STREAM_CHUNK = 10000
+MAX_PREPARED = 64
+
+
+def settings(database=None):
+    """Return the connection settings given by the BOKHANDELN_DB_* variables, optionally for another database."""
+    return {
+        "user": config("BOKHANDELN_DB_USER"),
+        "password": config("BOKHANDELN_DB_PASSWORD"),
+        "host": config("BOKHANDELN_DB_HOST"),
+        "port": config("BOKHANDELN_DB_PORT", cast=int),
+        "database": database or config("BOKHANDELN_DB_DATABASE"),
+    }
+
+
+def connect():
+    """Open a single connection to the configured MariaDB database."""
+    return mariadb.connect(**settings())
+
+
+class Database:
+    """Pool of MariaDB connections with health checks, retried reads and cached prepared statements."""
+
+    def __init__(self, pool_size=None, retries=2, database=None, pool_timeout=None):
+        """Open the pool, sized by BOKHANDELN_DB_POOL_SIZE unless pool_size is given, on the configured or given database.
+
+        Borrowing waits up to pool_timeout seconds, BOKHANDELN_DB_POOL_TIMEOUT_S by default, for a free connection.
+        """
+        if pool_size is None:
+            pool_size = config("BOKHANDELN_DB_POOL_SIZE", default=4, cast=int)
+        if pool_timeout is None:
+            pool_timeout = config("BOKHANDELN_DB_POOL_TIMEOUT_S", default=10, cast=float)
+        self.pool = mariadb.ConnectionPool(
+            pool_name=f"bokhandeln-{id(self)}",
+            pool_size=pool_size,
+            pool_reset_connection=False,
+            **settings(database),
+        )
+        self.retries = retries
+        self.pool_timeout = pool_timeout
+        self.statements = {}
+        self.lock = threading.Lock()
+        self.returned = threading.Condition()
+
+    def __check__(self, conn):
+        """Make sure a pooled connection is alive, reconnecting it if the link dropped."""
+        try:
+            conn.ping()
+        except mariadb.Error:
+            with self.lock:
+                self.statements.pop(id(conn), None)
+            conn.reconnect()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a healthy connection, waiting for one to be returned if all are in use.
+
+        Anything not committed is rolled back when it is returned.
+        """
+        deadline = time.monotonic() + self.pool_timeout
+        with self.returned:
+            while True:
+                try:
+                    conn = self.pool.get_connection()
+                except mariadb.PoolError:
+                    conn = None
+                remaining = deadline - time.monotonic()
+                if conn is not None or remaining <= 0:
+                    break
+                self.returned.wait(remaining)
+        if conn is None:
+            raise mariadb.PoolError("Alla databasanslutningar används")
+        try:
+            self.__check__(conn)
+            yield conn
+        finally:
+            try:
+                conn.rollback()
+            except mariadb.Error:
+                pass
+            conn.close()
+            with self.returned:
+                self.returned.notify()
+
+    def __prepared__(self, conn, sql):
+        """Return the raw prepared cursor for sql on conn, preparing it the first time it runs there.
+
+        Each connection keeps its MAX_PREPARED most recently used statements; older ones are closed on the server,
+        since every length of an IN (?, ...) list is a statement of its own.
+        """
+        with self.lock:
+            cursors = self.statements.setdefault(id(conn), OrderedDict())
+            cursor = cursors.get(sql)
+            if cursor is not None:
+                cursors.move_to_end(sql)
+                return cursor
+            cursor = cursors[sql] = conn.cursor(prepared=True)
+            evicted = cursors.popitem(last=False)[1] if len(cursors) > MAX_PREPARED else None
+        if evicted is not None:
+            try:
+                evicted.close()
+            except mariadb.Error:
+                pass
+        return cursor
+
+    def cursor(self, conn, sql):
+        """Return a prepared cursor for sql on conn, reusing the one prepared the last time it ran there."""
+        return metrics.cursor(self.__prepared__(conn, sql))
+
+    def __read__(self, sql, params, fetch):
+        """Run an idempotent read, retrying on a fresh connection if the link drops."""
+        for attempt in range(self.retries + 1):
+            try:
+                with self.connection() as conn, metrics.statement(sql) as timer:
+                    cursor = self.__prepared__(conn, sql)
+                    cursor.execute(sql, tuple(params))
+                    result = fetch(cursor)
+                    timer.rows = cursor.rowcount
+                    return result
+            except RETRYABLE_ERRORS:
+                if attempt == self.retries:
+                    raise
+        return None
+
+    def fetchall(self, sql, params=()):
+        """Return all rows of an idempotent read."""
+        return self.__read__(sql, params, lambda cursor: cursor.fetchall())
+
+    def fetchone(self, sql, params=()):
+        """Return the first row of an idempotent read, or None."""
+        return self.__read__(sql, params, lambda cursor: cursor.fetchone())
+
+    def stream(self, sql, params=(), size=STREAM_CHUNK):
+        """Yield the rows of a read in lists of at most size, from an unbuffered cursor, so only one list is in memory.
+
+        The server sends rows as they are fetched, which ties up the borrowed connection until the generator is
+        exhausted or closed; unlike fetchall, a dropped link is not retried since rows were already handed out.
+        """
+        with self.connection() as conn, metrics.statement(sql) as timer:
+            cursor = conn.cursor(buffered=False)
+            count = 0
+            try:
+                cursor.execute(sql, tuple(params))
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield rows
+            finally:
+                timer.rows = count
+                cursor.close()
@@ -0,0 +1,307 @@
+"""Streaming export of the inventory and the sales to CSV, JSON Lines or Parquet, in constant memory."""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import (
+    QApplication,
+    QCheckBox,
+    QComboBox,
+    QDateEdit,
+    QDialog,
+    QDialogButtonBox,
+    QFileDialog,
+    QFormLayout,
+    QLineEdit,
+    QMessageBox,
+    QProgressDialog,
+)
+
+from core import INVENTORY_COLUMNS
+import metrics
+from sales_archive import ArchiveError, archive_directory, read_sales
+
+
+CHUNK_SIZE = 10000
+BUFFER_SIZE = 1 << 20
+GZIP_LEVEL = 6
+TABLES = {"inventory": "Lager", "sales": "Försäljning"}
+COLUMN_TYPES = {
+    "inventory": {
+        "ISBN": "text",
+        "author": "text",
+        "title": "text",
+        "lang": "text",
+        "year": "int",
+        "buy_price": "int",
+        "sell_price": "int",
+        "row": "text",
+        "amount": "int",
+    },
+    "sales": {"id": "int", "date": "datetime", "ISBN": "text", "price": "int", "seller": "text"},
+}
+
+
+class ExportError(RuntimeError):
+    """Raised when an export can't be written or is cancelled."""
+
+
+def open_text(path, compress):
+    """Open path for writing text, through gzip if compress is set."""
+    if compress:
+        return gzip.open(path, "wt", compresslevel=GZIP_LEVEL, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="", buffering=BUFFER_SIZE)  # pylint: disable=consider-using-with
+
+
+class CsvWriter:
+    """Writes rows as CSV after a header line."""
+
+    extension = "csv"
+
+    def __init__(self, path, columns, compress):
+        """Open path and write the header of columns {name: type}."""
+        self.file = open_text(path, compress)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        """Write a chunk of rows."""
+        self.writer.writerows(rows)
+
+    def close(self):
+        """Flush and close the file."""
+        self.file.close()
+
+
+class JsonLinesWriter:
+    """Writes rows as one JSON object per line, with dates in ISO format."""
+
+    extension = "jsonl"
+
+    def __init__(self, path, columns, compress):
+        """Open path for rows of columns {name: type}."""
+        self.file = open_text(path, compress)
+        self.names = list(columns)
+        self.encoder = json.JSONEncoder(ensure_ascii=False, default=lambda value: value.isoformat())
+
+    def write(self, rows):
+        """Write a chunk of rows."""
+        encode = self.encoder.encode
+        names = self.names
+        self.file.write("".join(encode(dict(zip(names, row))) + "\n" for row in rows))
+
+    def close(self):
+        """Flush and close the file."""
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes rows to a Parquet file, one row group per chunk, compressed with gzip or snappy inside the file."""
+
+    extension = "parquet"
+
+    def __init__(self, path, columns, compress):
+        """Open path for rows of columns {name: type}, raising ExportError if pyarrow isn't installed."""
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ExportError("Export till Parquet kräver paketet pyarrow") from error
+        self.pyarrow = pyarrow
+        types = {"text": pyarrow.string(), "int": pyarrow.int64(), "datetime": pyarrow.timestamp("s")}
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in columns.items()])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="gzip" if compress else "snappy")
+
+    def write(self, rows):
+        """Write a chunk of rows as a row group."""
+        arrays = [
+            self.pyarrow.array([row[column] for row in rows], type=field.type) for column, field in enumerate(self.schema)
+        ]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        """Write the footer and close the file."""
+        self.writer.close()
+
+
+FORMATS = {"csv": CsvWriter, "jsonl": JsonLinesWriter, "parquet": ParquetWriter}
+FORMAT_NAMES = {"csv": "CSV", "jsonl": "JSON Lines", "parquet": "Parquet"}
+
+
+def default_path(table, file_format, compress):
+    """Return the file name an export is written to unless another one is given."""
+    extension = FORMATS[file_format].extension
+    return f"{table}.{extension}.gz" if compress and file_format != "parquet" else f"{table}.{extension}"
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    """Yield lists of at most size rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_chunks(database, table, start=None, end=None, seller=None, directory=None, size=CHUNK_SIZE):
+    """Yield the rows of a table in lists of at most size; sales between start and end, inclusive, and of one seller.
+
+    Sales are read from the archive of closed months as well as the live table.
+    """
+    if table == "inventory":
+        yield from database.stream(f"SELECT {INVENTORY_COLUMNS} FROM inventory ORDER BY ISBN", (), size)
+        return
+    end = end and end + timedelta(days=1)
+    yield from chunks(read_sales(database, directory or archive_directory(), start, end, seller=seller), size)
+
+
+def export(database, table, path, file_format="csv", compress=False, start=None, end=None, seller=None, progress=None):
+    """Stream a table to path in file_format, optionally compressed, and return the number of rows written.
+
+    The file is written next to path and moved into place when complete. progress(rows written so far) is called
+    after every chunk; the export is cancelled with ExportError if it returns False.
+    """
+    columns = COLUMN_TYPES[table]
+    partial = path + ".part"
+    writer = FORMATS[file_format](partial, columns, compress)
+    count = 0
+    try:
+        with metrics.timed("export", f"{table}.{file_format}") as timer:
+            for rows in export_chunks(database, table, start, end, seller):
+                writer.write(rows)
+                count += len(rows)
+                if progress is not None and progress(count) is False:
+                    raise ExportError("Exporten avbröts")
+            timer.rows = count
+    except BaseException:
+        writer.close()
+        os.remove(partial)
+        raise
+    writer.close()
+    os.replace(partial, path)
+    return count
+
+
+class ExportDialog(QDialog):
+    """Window for choosing what to export, in which format and, for sales, from which period and seller."""
+
+    def __init__(self, database, parent=None):
+        """Initialize the export window."""
+        super().__init__(parent)
+        self.database = database
+        self.setWindowTitle("Exportera")
+        self.combo_table = QComboBox(self)
+        for key, name in TABLES.items():
+            self.combo_table.addItem(name, key)
+        self.combo_format = QComboBox(self)
+        for key, name in FORMAT_NAMES.items():
+            self.combo_format.addItem(name, key)
+        self.check_gzip = QCheckBox("Komprimera med gzip", self)
+        self.check_period = QCheckBox("Bara försäljning mellan", self)
+        self.date_start = QDateEdit(QtCore.QDate.currentDate().addMonths(-1), self)
+        self.date_end = QDateEdit(QtCore.QDate.currentDate(), self)
+        for date_edit in (self.date_start, self.date_end):
+            date_edit.setCalendarPopup(True)
+        self.line_seller = QLineEdit(self)
+        self.line_seller.setPlaceholderText("Alla säljare")
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        layout = QFormLayout(self)
+        layout.addRow("Tabell", self.combo_table)
+        layout.addRow("Format", self.combo_format)
+        layout.addRow(self.check_gzip)
+        layout.addRow(self.check_period)
+        layout.addRow("Från", self.date_start)
+        layout.addRow("Till", self.date_end)
+        layout.addRow("Säljare", self.line_seller)
+        layout.addRow(buttons)
+        buttons.accepted.connect(self.run)
+        buttons.rejected.connect(self.reject)
+        self.combo_table.currentIndexChanged.connect(self.update_filters)
+        self.check_period.toggled.connect(self.update_filters)
+        self.update_filters()
+
+    def update_filters(self):
+        """Enable the period and seller filters only when exporting sales."""
+        sales = self.combo_table.currentData() == "sales"
+        self.check_period.setEnabled(sales)
+        self.date_start.setEnabled(sales and self.check_period.isChecked())
+        self.date_end.setEnabled(sales and self.check_period.isChecked())
+        self.line_seller.setEnabled(sales)
+
+    def run(self):
+        """Ask where to save the export and write it, showing how many rows have been written."""
+        import mariadb  # pylint: disable=import-outside-toplevel
+
+        table = self.combo_table.currentData()
+        file_format = self.combo_format.currentData()
+        compress = self.check_gzip.isChecked()
+        path, _ = QFileDialog.getSaveFileName(self, "Exportera", default_path(table, file_format, compress))
+        if not path:
+            return
+        start = end = seller = None
+        if table == "sales":
+            if self.check_period.isChecked():
+                start = self.date_start.date().toPyDate()
+                end = self.date_end.date().toPyDate()
+            seller = self.line_seller.text().strip() or None
+        progress = QProgressDialog("Exporterar", "Avbryt", 0, 0, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.show()
+
+        def report(count):
+            progress.setLabelText(f"{count} rader exporterade")
+            QApplication.processEvents()
+            return not progress.wasCanceled()
+
+        try:
+            count = export(self.database, table, path, file_format, compress, start, end, seller, report)
+        except (ExportError, ArchiveError, OSError, mariadb.Error) as e:
+            progress.close()
+            QMessageBox.warning(self, "Exporten misslyckades", str(e))
+            return
+        progress.close()
+        QMessageBox.information(self, "Export klar", f"{count} rader exporterade till {path}.")
+        self.accept()
+
+
+def main(argv=None):
+    """Export the inventory or the sales from the command line."""
+    import mariadb  # pylint: disable=import-outside-toplevel
+    import db  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Exportera lagret eller försäljningen.")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("--format", choices=FORMATS, default="csv", dest="file_format")
+    parser.add_argument("--gzip", action="store_true", help="komprimera med gzip")
+    parser.add_argument("--output", help="fil att skriva till, annars tabellens namn")
+    parser.add_argument("--start", type=date.fromisoformat, help="första dag med försäljning")
+    parser.add_argument("--end", type=date.fromisoformat, help="sista dag med försäljning")
+    parser.add_argument("--seller", help="bara försäljning av denna säljare")
+    args = parser.parse_args(argv)
+    if args.table != "sales" and (args.start or args.end or args.seller):
+        parser.error("--start, --end och --seller gäller bara sales")
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    path = args.output or default_path(args.table, args.file_format, args.gzip)
+    try:
+        count = export(database, args.table, path, args.file_format, args.gzip, args.start, args.end, args.seller)
+    except (ExportError, ArchiveError, OSError, mariadb.Error) as e:
+        print(f"Exporten misslyckades: {e}")
+        return 1
+    print(f"{count} rader exporterade till {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
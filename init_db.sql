@@ -18,3 +18,31 @@ CREATE TABLE IF NOT EXISTS `sales` (
     `price` int(11),
     `seller` varchar(255)
 );
+CREATE TABLE IF NOT EXISTS `isbn_meta` (
+  `ISBN` varchar(255) NOT NULL,
+  `found` tinyint(1) NOT NULL,
+  `title` varchar(255) DEFAULT NULL,
+  `authors` varchar(255) DEFAULT NULL,
+  `year` varchar(10) DEFAULT NULL,
+  `lang` varchar(255) DEFAULT NULL,
+  `cover` varchar(255) DEFAULT NULL,
+  `fetched` datetime NOT NULL,
+  PRIMARY KEY (`ISBN`)
+);
+CREATE FULLTEXT INDEX IF NOT EXISTS `ft_title_author` ON `inventory` (`title`, `author`);
+CREATE INDEX IF NOT EXISTS `idx_author` ON `inventory` (`author`, `ISBN`);
+CREATE INDEX IF NOT EXISTS `idx_title` ON `inventory` (`title`, `ISBN`);
+CREATE INDEX IF NOT EXISTS `idx_amount` ON `inventory` (`amount`, `ISBN`);
+CREATE INDEX IF NOT EXISTS `idx_sales_date` ON `sales` (`date`);
+CREATE INDEX IF NOT EXISTS `idx_sales_isbn` ON `sales` (`ISBN`, `date`);
+CREATE INDEX IF NOT EXISTS `idx_sales_seller` ON `sales` (`seller`, `date`);
+CREATE TABLE IF NOT EXISTS `sales_daily` (
+  `day` date NOT NULL,
+  `seller` varchar(255) NOT NULL DEFAULT '',
+  `ISBN` varchar(255) NOT NULL,
+  `units` int(11) NOT NULL DEFAULT 0,
+  `revenue` int(11) NOT NULL DEFAULT 0,
+  `cost` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`day`, `seller`, `ISBN`),
+  KEY `idx_sales_daily_isbn` (`ISBN`, `day`)
+);
@@ -0,0 +1,307 @@
+"""Table model for the Bokhandeln inventory."""
+from PyQt5 import QtCore
+from inventory_store import InventoryStore
+import metrics
+from search_index import SearchIndex
+from snapshot import Snapshot
+
+
+HEADERS = [
+    "ISBN",
+    "Författare",
+    "Titel",
+    "Språk",
+    "År",
+    "Inköpspris",
+    "Säljpris",
+    "Hylla",
+    "Antal i lager",
+]
+
+SELL_PRICE_COLUMN = 6
+AMOUNT_COLUMN = 8
+COVER_COLUMN = len(HEADERS)
+COVER_HEADER = "Omslag"
+SEARCH_COLUMNS = (0, 1, 2)
+MAX_SORT_COLUMNS = 3
+
+
+def cell_text(value):
+    """Return the text shown in the table for a column value."""
+    if value is None:
+        return ""
+    return str(value)
+
+
+def as_store(inventory):
+    """Return inventory as an InventoryStore, leaving stores and read-only snapshots as they are."""
+    if isinstance(inventory, (InventoryStore, Snapshot)):
+        return inventory
+    return InventoryStore(inventory)
+
+
+class InventoryModel(QtCore.QAbstractTableModel):
+    """Read-only table model that renders inventory rows on demand and sorts them through a row permutation."""
+
+    books_updated = QtCore.pyqtSignal(object)
+
+    def __init__(self, inventory=(), parent=None):
+        """Initialize the model with the row tuples fetched from the inventory table, a store or a snapshot."""
+        super().__init__(parent)
+        self.store = as_store(inventory)
+        self.search_index = SearchIndex()
+        self.searchable = False
+        self.sort_order = []
+        self.order = None
+        self.positions = None
+        self.thumbnails = None
+
+    def rowCount(self, parent=QtCore.QModelIndex()):  # pylint: disable=invalid-name
+        """Return the number of books in the model."""
+        if parent.isValid():
+            return 0
+        return len(self.store)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):  # pylint: disable=invalid-name
+        """Return the number of inventory columns, plus the cover column while it is shown."""
+        if parent.isValid():
+            return 0
+        return len(HEADERS) + (self.thumbnails is not None)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """Return the text of a single cell, or the thumbnail of a cover, only when it is asked for."""
+        if not index.isValid():
+            return None
+        if index.column() == COVER_COLUMN:
+            if role != QtCore.Qt.DecorationRole:
+                return None
+            return self.thumbnails.pixmap(self.isbn(index.row()))
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        return cell_text(self.store.value(self.__store_row__(index.row()), index.column()))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):  # pylint: disable=invalid-name
+        """Return the column headers."""
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return HEADERS[section] if section < len(HEADERS) else COVER_HEADER
+        return section + 1
+
+    def set_thumbnails(self, thumbnails):
+        """Show covers from a ThumbnailLoader in an extra column, or hide the column if thumbnails is None."""
+        if self.thumbnails is not None:
+            self.beginRemoveColumns(QtCore.QModelIndex(), COVER_COLUMN, COVER_COLUMN)
+            self.thumbnails.thumbnail_ready.disconnect(self.__thumbnail_ready__)
+            self.thumbnails = None
+            self.endRemoveColumns()
+        if thumbnails is not None:
+            self.beginInsertColumns(QtCore.QModelIndex(), COVER_COLUMN, COVER_COLUMN)
+            self.thumbnails = thumbnails
+            self.thumbnails.thumbnail_ready.connect(self.__thumbnail_ready__)
+            self.endInsertColumns()
+
+    def __thumbnail_ready__(self, isbn):
+        """Repaint the cover of a book whose thumbnail has loaded."""
+        row = self.__writable__().find(isbn)
+        if row is None or self.thumbnails is None:
+            return
+        index = self.index(self.__table_row__(row), COVER_COLUMN)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def __store_row__(self, row):
+        """Return the store row shown on the given table row."""
+        return row if self.order is None else self.order[row]
+
+    def __table_row__(self, row):
+        """Return the table row showing the given store row, building the reverse permutation on first use."""
+        if self.order is None:
+            return row
+        if self.positions is None:
+            self.positions = [0] * len(self.order)
+            for position, store_row in enumerate(self.order):
+                self.positions[store_row] = position
+        return self.positions[row]
+
+    def __resort__(self):
+        """Sort the rows again on the current sort order, keeping selections and other persistent indexes on their books."""
+        store = self.__writable__()
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        rows = [self.__store_row__(index.row()) for index in persistent]
+        self.order = store.ordering(self.sort_order) if self.sort_order else None
+        self.positions = None
+        self.changePersistentIndexList(persistent, [self.index(self.__table_row__(row), index.column()) for row, index in zip(rows, persistent)])
+        self.layoutChanged.emit()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort on column, keeping the columns sorted on before as tie-breakers."""
+        if column >= len(HEADERS):
+            return
+        descending = order == QtCore.Qt.DescendingOrder
+        self.sort_by([(column, descending)] + [key for key in self.sort_order if key[0] != column])
+
+    def sort_by(self, sort_order):
+        """Sort on [(column, descending), ...], the most significant column first: numbers by value, texts the Swedish way."""
+        with metrics.timed("model", "sort") as timer:
+            self.sort_order = list(sort_order)[:MAX_SORT_COLUMNS]
+            self.__resort__()
+            timer.rows = len(self.store)
+
+    def __writable__(self):
+        """Return the store, first copying the books out of a snapshot if the model is still backed by one."""
+        if isinstance(self.store, Snapshot):
+            self.store = InventoryStore.from_snapshot(self.store)
+        return self.store
+
+    def __search_fields__(self, row):
+        """Return the indexed fields of the book on the given row."""
+        return (self.store.value(row, column) for column in SEARCH_COLUMNS)
+
+    def search(self, query):
+        """Return the ISBNs matching a search query, or None if the query is empty, building the index on first use."""
+        if not self.searchable:
+            self.searchable = True
+            for row in range(len(self.store)):
+                self.search_index.add(self.store.isbn(row), *self.__search_fields__(row))
+        return self.search_index.search(query)
+
+    def rows(self):
+        """Return the row tuples of all books in the model, as a store or snapshot."""
+        return self.store
+
+    def isbn(self, row):
+        """Return the ISBN of the book on the given source row."""
+        return self.store.isbn(self.__store_row__(row))
+
+    def book(self, isbn):
+        """Return the row tuple of the book with the given ISBN, or None if it is not in the model."""
+        row = self.__writable__().find(isbn)
+        if row is None:
+            return None
+        return self.store[row]
+
+    def set_amounts(self, stock):
+        """Update the amount in stock of the given {isbn: amount} without touching the other columns."""
+        store = self.__writable__()
+        for isbn, amount in stock.items():
+            row = store.find(isbn)
+            if row is None:
+                continue
+            store.set_amount(row, amount)
+            index = self.index(self.__table_row__(row), AMOUNT_COLUMN)
+            self.dataChanged.emit(index, index)
+        if stock and any(column == AMOUNT_COLUMN for column, _ in self.sort_order):
+            self.__resort__()
+
+    def set_inventory(self, inventory):
+        """Replace all rows in the model with a freshly fetched inventory."""
+        with metrics.timed("model", "set_inventory") as timer:
+            self.beginResetModel()
+            self.store = as_store(inventory)
+            self.search_index.clear()
+            self.searchable = False
+            self.order = self.__writable__().ordering(self.sort_order) if self.sort_order else None
+            self.positions = None
+            self.endResetModel()
+            timer.rows = len(self.store)
+
+    def update_books(self, isbns, inventory):
+        """Patch the given ISBNs in place, appending new books and removing ones missing from inventory."""
+        store = self.__writable__()
+        fetched = {book[0]: book for book in inventory}
+        last_column = self.columnCount() - 1
+        if self.thumbnails is not None:
+            self.thumbnails.forget(isbns)
+        for isbn, book in fetched.items():
+            row = store.find(isbn)
+            if row is None:
+                row = len(store)
+                self.beginInsertRows(QtCore.QModelIndex(), row, row)
+                store.append(book)
+                if self.order is not None:
+                    self.order.append(row)
+                    self.positions = None
+                self.endInsertRows()
+            else:
+                if self.searchable:
+                    self.search_index.remove(isbn, *self.__search_fields__(row))
+                store.replace(row, book)
+                position = self.__table_row__(row)
+                self.dataChanged.emit(self.index(position, 0), self.index(position, last_column))
+            if self.searchable:
+                self.search_index.add(isbn, *self.__search_fields__(row))
+        removed = sorted((store.find(isbn) for isbn in isbns if isbn not in fetched and store.find(isbn) is not None), reverse=True)
+        for row in removed:
+            if self.searchable:
+                self.search_index.remove(store.isbn(row), *self.__search_fields__(row))
+            position = self.__table_row__(row)
+            self.beginRemoveRows(QtCore.QModelIndex(), position, position)
+            store.remove(row)
+            if self.order is not None:
+                del self.order[position]
+                self.order = [store_row - (store_row > row) for store_row in self.order]
+                self.positions = None
+            self.endRemoveRows()
+        if fetched and self.sort_order:
+            self.__resort__()
+        self.books_updated.emit(isbns)
+
+    def refresh(self, isbns):
+        """Tell views and proxies that the given books changed, so they are shown and filtered again."""
+        last_column = self.columnCount() - 1
+        for isbn in isbns:
+            row = self.store.find(isbn)
+            if row is not None:
+                position = self.__table_row__(row)
+                self.dataChanged.emit(self.index(position, 0), self.index(position, last_column))
+
+
+class InventoryFilter(QtCore.QSortFilterProxyModel):
+    """Proxy that shows only the books found by the inventory model's search index."""
+
+    def __init__(self, parent=None):
+        """Initialize the filter without any search."""
+        super().__init__(parent)
+        self.query = ""
+        self.matches = None
+
+    def setSourceModel(self, model):  # pylint: disable=invalid-name
+        """Filter model, searching again whenever its books are updated or reloaded."""
+        super().setSourceModel(model)
+        model.books_updated.connect(self.__books_updated__)
+        model.modelReset.connect(self.__reloaded__)
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Let the inventory model sort on its precomputed keys instead of comparing cell texts here."""
+        self.sourceModel().sort(column, order)
+
+    def set_matches(self, matches):
+        """Show only the books whose ISBN is in matches, or all books if matches is None."""
+        self.matches = matches
+        self.invalidateFilter()
+
+    def set_search(self, query):
+        """Show only the books matching a search query, or all books if it is empty."""
+        self.query = query
+        self.set_matches(self.sourceModel().search(query))
+
+    def __books_updated__(self, isbns):
+        """Search again after books were patched and filter the books that started or stopped matching."""
+        if self.matches is None:
+            return
+        matches = self.sourceModel().search(self.query)
+        changed = [isbn for isbn in isbns if (isbn in matches) != (isbn in self.matches)]
+        self.matches = matches
+        self.sourceModel().refresh(changed)
+
+    def __reloaded__(self):
+        """Search the reloaded books again."""
+        if self.matches is not None:
+            self.set_search(self.query)
+
+    def filterAcceptsRow(self, source_row, source_parent):  # pylint: disable=invalid-name
+        """Accept the rows of matching books."""
+        if self.matches is None:
+            return True
+        return self.sourceModel().isbn(source_row) in self.matches
@@ -0,0 +1,165 @@
+"""Compact column store of the inventory, shared by the table model, search and stock updates."""
+from array import array
+from collections.abc import Sequence
+
+from search_index import collation_key
+
+
+NULL = -(2**31)
+COLUMN_COUNT = 9
+ISBN_COLUMN = 0
+TITLE_COLUMN = 2
+NUMBER_COLUMNS = (4, 5, 6, 8)
+SHARED_TEXT_COLUMNS = (1, 3, 7)
+AMOUNT_COLUMN = 8
+
+
+class InventoryStore(Sequence):
+    """Inventory rows kept column by column: numbers in int32 arrays, repeated texts stored once, plus an ISBN index.
+
+    Authors, languages and shelves are stored as codes into a table of their distinct values. Indexing the store
+    gives the same row tuples as a SELECT of INVENTORY_COLUMNS, but they are only built when asked for.
+    """
+
+    def __init__(self, rows=()):
+        """Initialize the store with row tuples in INVENTORY_COLUMNS order."""
+        self.isbns = []
+        self.titles = []
+        self.numbers = {column: array("i") for column in NUMBER_COLUMNS}
+        self.codes = {column: array("I") for column in SHARED_TEXT_COLUMNS}
+        self.values = {column: [None] for column in SHARED_TEXT_COLUMNS}
+        self.lookup = {column: {None: 0} for column in SHARED_TEXT_COLUMNS}
+        self.index = {}
+        self.title_keys = None
+        self.value_keys = {column: [] for column in SHARED_TEXT_COLUMNS}
+        for book in rows:
+            self.append(book)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Build a store from an inventory snapshot, copying its number columns without decoding them."""
+        store = cls()
+        store.isbns = snapshot.column(ISBN_COLUMN)
+        store.titles = snapshot.column(TITLE_COLUMN)
+        for column in NUMBER_COLUMNS:
+            store.numbers[column] = array("i", snapshot.numbers[column])
+        for column in SHARED_TEXT_COLUMNS:
+            store.codes[column] = array("I", map(store.__code__, [column] * len(snapshot), snapshot.column(column)))
+        store.index = {isbn: row for row, isbn in enumerate(store.isbns)}
+        return store
+
+    def __code__(self, column, value):
+        """Return the code of a shared text, adding it to the column's values if it is new."""
+        lookup = self.lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    def __len__(self):
+        """Return the number of books in the store."""
+        return len(self.isbns)
+
+    def __getitem__(self, row):
+        """Return the row tuple at the given position, or a list of them for a slice."""
+        if isinstance(row, slice):
+            return [self[position] for position in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        return tuple(self.value(row, column) for column in range(COLUMN_COUNT))
+
+    def value(self, row, column):
+        """Return one cell with its real type."""
+        if column == ISBN_COLUMN:
+            return self.isbns[row]
+        if column == TITLE_COLUMN:
+            return self.titles[row]
+        numbers = self.numbers.get(column)
+        if numbers is not None:
+            value = numbers[row]
+            return None if value == NULL else value
+        return self.values[column][self.codes[column][row]]
+
+    def isbn(self, row):
+        """Return the ISBN on the given row."""
+        return self.isbns[row]
+
+    def find(self, isbn):
+        """Return the row of the book with the given ISBN, or None."""
+        return self.index.get(isbn)
+
+    def append(self, book):
+        """Add a book at the end and return its row."""
+        row = len(self.isbns)
+        self.isbns.append(book[ISBN_COLUMN])
+        self.titles.append(book[TITLE_COLUMN])
+        if self.title_keys is not None:
+            self.title_keys.append(collation_key(book[TITLE_COLUMN]))
+        for column in NUMBER_COLUMNS:
+            self.numbers[column].append(NULL if book[column] is None else book[column])
+        for column in SHARED_TEXT_COLUMNS:
+            self.codes[column].append(self.__code__(column, book[column]))
+        self.index[book[ISBN_COLUMN]] = row
+        return row
+
+    def replace(self, row, book):
+        """Overwrite the book on the given row; its ISBN must stay the same."""
+        self.titles[row] = book[TITLE_COLUMN]
+        if self.title_keys is not None:
+            self.title_keys[row] = collation_key(book[TITLE_COLUMN])
+        for column in NUMBER_COLUMNS:
+            self.numbers[column][row] = NULL if book[column] is None else book[column]
+        for column in SHARED_TEXT_COLUMNS:
+            self.codes[column][row] = self.__code__(column, book[column])
+
+    def set_amount(self, row, amount):
+        """Change the amount in stock on the given row."""
+        self.numbers[AMOUNT_COLUMN][row] = NULL if amount is None else amount
+
+    def remove(self, row):
+        """Remove the book on the given row, moving the rows after it up by one."""
+        del self.index[self.isbns[row]]
+        del self.isbns[row]
+        del self.titles[row]
+        if self.title_keys is not None:
+            del self.title_keys[row]
+        for numbers in self.numbers.values():
+            del numbers[row]
+        for codes in self.codes.values():
+            del codes[row]
+        for position in range(row, len(self.isbns)):
+            self.index[self.isbns[position]] = position
+
+    def sort_keys(self, column):
+        """Return the sort key of every row in a column: numbers as they are, empty ones first, and texts collated."""
+        if column == ISBN_COLUMN:
+            return self.isbns
+        if column in self.numbers:
+            return self.numbers[column]
+        if column == TITLE_COLUMN:
+            if self.title_keys is None:
+                self.title_keys = list(map(collation_key, self.titles))
+            return self.title_keys
+        value_keys = self.value_keys[column]
+        value_keys.extend(map(collation_key, self.values[column][len(value_keys):]))
+        return [value_keys[code] for code in self.codes[column]]
+
+    def ordering(self, sort_order):
+        """Return the rows sorted on [(column, descending), ...], the most significant column first."""
+        order = list(range(len(self)))
+        for column, descending in reversed(sort_order):
+            order.sort(key=self.sort_keys(column).__getitem__, reverse=descending)
+        return order
+
+    def patch(self, changed):
+        """Apply {isbn: row tuple, or None for a removed book} in place."""
+        for isbn, book in changed.items():
+            row = self.find(isbn)
+            if book is None:
+                if row is not None:
+                    self.remove(row)
+            elif row is None:
+                self.append(book)
+            else:
+                self.replace(row, book)
@@ -0,0 +1,271 @@
+"""Local write-ahead journal of sales and stock adjustments, flushed to MariaDB in the background."""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from PyQt5 import QtCore
+
+from stock import apply_deltas, read_stock, record_sale
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "bokhandeln", "journal.sqlite3")
+SALE = "sale"
+ADJUSTMENT = "adjustment"
+BATCH_SIZE = 200
+RETENTION = timedelta(days=30)
+PRUNE_EVERY = 3600
+CLAIM_KEY = "INSERT IGNORE INTO journal_applied (journal_key, applied) VALUES (?, ?)"
+
+JournalEntry = namedtuple("JournalEntry", ["key", "kind", "payload", "created"])
+
+
+class SalesJournal:
+    """Durable SQLite journal of sales and stock adjustments waiting to be written to MariaDB."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        """Open or create the journal at path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              key TEXT NOT NULL UNIQUE,
+              kind TEXT NOT NULL,
+              payload TEXT NOT NULL,
+              created TEXT NOT NULL,
+              state TEXT NOT NULL DEFAULT 'pending',
+              error TEXT
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_state ON entries (state, id)")
+
+    def __append__(self, kind, payload):
+        """Durably append one entry and return its idempotency key."""
+        key = str(uuid.uuid4())
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO entries (key, kind, payload, created) VALUES (?, ?, ?, ?)",
+                (key, kind, json.dumps(payload), datetime.now().isoformat()),
+            )
+        return key
+
+    def record_sale(self, basket, prices, seller):
+        """Journal a basket of {isbn: quantity} sold at the given prices and return its key."""
+        return self.__append__(
+            SALE,
+            {"basket": dict(basket), "prices": {isbn: prices[isbn] for isbn in basket}, "seller": seller},
+        )
+
+    def record_adjustment(self, deltas):
+        """Journal a stock change of {isbn: delta} and return its key."""
+        return self.__append__(ADJUSTMENT, {"deltas": dict(deltas)})
+
+    def pending(self, limit=BATCH_SIZE):
+        """Return the oldest entries not yet written to MariaDB."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, kind, payload, created FROM entries WHERE state = 'pending' ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [JournalEntry(key, kind, json.loads(payload), datetime.fromisoformat(created)) for key, kind, payload, created in rows]
+
+    def count_pending(self):
+        """Return the number of entries not yet written to MariaDB."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries WHERE state = 'pending'").fetchone()[0]
+
+    def pending_deltas(self, isbns):
+        """Return {isbn: stock change} of the given ISBNs still waiting in the journal."""
+        isbns = set(isbns)
+        with self.lock:
+            rows = self.conn.execute("SELECT kind, payload FROM entries WHERE state = 'pending'").fetchall()
+        deltas = Counter()
+        for kind, payload in rows:
+            payload = json.loads(payload)
+            if kind == SALE:
+                changes = {isbn: -quantity for isbn, quantity in payload["basket"].items()}
+            else:
+                changes = payload["deltas"]
+            for isbn, delta in changes.items():
+                if isbn in isbns:
+                    deltas[isbn] += delta
+        return deltas
+
+    def mark_flushed(self, keys):
+        """Mark entries as written to MariaDB."""
+        with self.lock:
+            self.conn.executemany("UPDATE entries SET state = 'flushed' WHERE key = ?", [(key,) for key in keys])
+
+    def reject(self, key, error):
+        """Set aside an entry MariaDB refused, keeping it for manual follow-up."""
+        with self.lock:
+            self.conn.execute("UPDATE entries SET state = 'rejected', error = ? WHERE key = ?", (error, key))
+
+    def prune(self, older_than=RETENTION):
+        """Forget flushed entries older than older_than."""
+        cutoff = (datetime.now() - older_than).isoformat()
+        with self.lock:
+            self.conn.execute("DELETE FROM entries WHERE state = 'flushed' AND created < ?", (cutoff,))
+
+
+def apply_entries(database, conn, entries):
+    """Apply the entries MariaDB hasn't seen before in conn's transaction and return the ISBNs they touched."""
+    touched = set()
+    now = datetime.now()
+    for entry in entries:
+        cursor = database.cursor(conn, CLAIM_KEY)
+        cursor.execute(CLAIM_KEY, (entry.key, now))
+        if cursor.rowcount == 0:
+            continue
+        if entry.kind == SALE:
+            payload = entry.payload
+            record_sale(database, conn, payload["basket"], payload["prices"], payload["seller"], entry.created)
+            touched.update(payload["basket"])
+        else:
+            apply_deltas(database, conn, entry.payload["deltas"])
+            touched.update(entry.payload["deltas"])
+    return touched
+
+
+def flush(journal, database, limit=BATCH_SIZE):
+    """Write a batch of pending entries to MariaDB and return (new stock, rejected entries with their errors).
+
+    Lost connections and lock timeouts are raised, so the batch is retried later. Any other error is permanent for
+    some entry: the batch is then written entry by entry, and the entries MariaDB refuses are set aside as rejected
+    instead of holding up every later sale.
+    """
+    import mariadb  # pylint: disable=import-outside-toplevel
+    from db import RETRYABLE_ERRORS  # pylint: disable=import-outside-toplevel
+
+    entries = journal.pending(limit)
+    if not entries:
+        return {}, []
+    try:
+        with database.connection() as conn:
+            touched = apply_entries(database, conn, entries)
+            stock = read_stock(database, conn, touched)
+            conn.commit()
+        journal.mark_flushed([entry.key for entry in entries])
+        return stock, []
+    except RETRYABLE_ERRORS:
+        raise
+    except mariadb.Error:
+        pass
+    stock = {}
+    rejected = []
+    for entry in entries:
+        try:
+            with database.connection() as conn:
+                touched = apply_entries(database, conn, [entry])
+                stock.update(read_stock(database, conn, touched))
+                conn.commit()
+        except RETRYABLE_ERRORS:
+            raise
+        except mariadb.Error as error:
+            journal.reject(entry.key, str(error))
+            rejected.append((entry, str(error)))
+            continue
+        journal.mark_flushed([entry.key])
+    return stock, rejected
+
+
+def prune_applied(database, older_than=RETENTION):
+    """Forget applied journal keys older than older_than in MariaDB."""
+    with database.connection() as conn:
+        conn.cursor().execute("DELETE FROM journal_applied WHERE applied < ?", (datetime.now() - older_than,))
+        conn.commit()
+
+
+class FlushTask(QtCore.QRunnable):
+    """Runnable that flushes the journal on a worker thread and hands the result to its JournalFlusher."""
+
+    def __init__(self, flusher, prune=False):
+        """Initialize the task, optionally pruning old entries and keys first."""
+        super().__init__()
+        self.flusher = flusher
+        self.prune = prune
+
+    def run(self):
+        """Flush pending entries until the journal is empty or MariaDB fails."""
+        stock = {}
+        rejected = []
+        try:
+            if self.prune:
+                self.flusher.journal.prune()
+                prune_applied(self.flusher.database)
+            while True:
+                batch_stock, batch_rejected = flush(self.flusher.journal, self.flusher.database)
+                stock.update(batch_stock)
+                rejected.extend(batch_rejected)
+                if not self.flusher.journal.count_pending():
+                    break
+        except Exception as error:  # pylint: disable=broad-except
+            self.flusher.task_done.emit(stock, rejected, str(error))
+            return
+        self.flusher.task_done.emit(stock, rejected, "")
+
+
+class JournalFlusher(QtCore.QObject):
+    """Flushes the sales journal to MariaDB in the background and reports the resulting stock to the GUI thread."""
+
+    stock_changed = QtCore.pyqtSignal(object)
+    rejected = QtCore.pyqtSignal(object)
+    task_done = QtCore.pyqtSignal(object, object, str)
+
+    def __init__(self, journal, database, interval_ms=500, parent=None):
+        """Initialize the flusher to retry every interval_ms."""
+        super().__init__(parent)
+        self.journal = journal
+        self.database = database
+        self.running = False
+        self.again = False
+        self.polls = 0
+        self.error = ""
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.poll)
+        self.task_done.connect(self.__finish__)
+
+    def start(self):
+        """Start flushing."""
+        self.timer.start()
+
+    def stop(self):
+        """Stop flushing."""
+        self.timer.stop()
+
+    def poll(self):
+        """Flush now, or right after the flush that is still running."""
+        if self.running:
+            self.again = True
+            return
+        self.running = True
+        self.again = False
+        self.polls += 1
+        self.pool.start(FlushTask(self, prune=self.polls % PRUNE_EVERY == 0))
+
+    def __finish__(self, stock, rejected, error):
+        """Forward the result of a FlushTask, with the changes still waiting in the journal added to the stock read."""
+        self.running = False
+        if stock:
+            pending = self.journal.pending_deltas(stock)
+            self.stock_changed.emit({isbn: amount + pending[isbn] for isbn, amount in stock.items()})
+        if rejected:
+            self.rejected.emit(rejected)
+        if error and error != self.error:
+            print(f"Journal flush failed, retrying: {error}")
+        self.error = error
+        if not error and self.again:
+            self.poll()
@@ -0,0 +1,99 @@
+"""Background lookups of book metadata and covers."""
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage
+from meta_cache import BookNotFound, fetch_meta
+
+
+def cached_meta(meta_cache, isbn):
+    """Return the metadata of a book from meta_cache, or fetch and cache it; raise BookNotFound for unknown books."""
+    if meta_cache is not None:
+        hit, book_info = meta_cache.get(isbn)
+        if hit and book_info is None:
+            raise BookNotFound(f"Ingen information hittades för {isbn}")
+        if hit:
+            return book_info
+    try:
+        book_info = fetch_meta(isbn)
+    except BookNotFound:
+        if meta_cache is not None:
+            meta_cache.put(isbn, None)
+        raise
+    if meta_cache is not None:
+        meta_cache.put(isbn, book_info)
+    return book_info
+
+
+class LookupTask(QtCore.QRunnable):
+    """Runnable that calls a lookup function on a worker thread and reports the result to its LookupPool."""
+
+    def __init__(self, pool, key, isbn, function, args):
+        """Initialize the task."""
+        super().__init__()
+        self.setAutoDelete(False)
+        self.pool = pool
+        self.key = key
+        self.isbn = isbn
+        self.function = function
+        self.args = args
+
+    def run(self):
+        """Run the lookup and hand the result back to the GUI thread."""
+        try:
+            result = self.function(*self.args)
+        except Exception as error:  # pylint: disable=broad-except
+            self.pool.task_done.emit(self.key, None, error)
+            return
+        self.pool.task_done.emit(self.key, result, None)
+
+
+class LookupPool(QtCore.QObject):
+    """Runs metadata and cover lookups on a thread pool, sharing one fetch between identical requests."""
+
+    meta_ready = QtCore.pyqtSignal(str, object)
+    cover_ready = QtCore.pyqtSignal(str, QImage)
+    lookup_failed = QtCore.pyqtSignal(str, str)
+    task_done = QtCore.pyqtSignal(object, object, object)
+
+    def __init__(self, covers, meta_cache=None, parent=None):
+        """Initialize the pool with the cover cache used to fetch covers and an optional metadata cache."""
+        super().__init__(parent)
+        self.covers = covers
+        self.meta_cache = meta_cache
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.tasks = {}
+        self.task_done.connect(self.__finish__)
+
+    def __submit__(self, key, isbn, function, *args):
+        """Start a lookup unless an identical one is already in flight."""
+        if key in self.tasks:
+            return
+        task = LookupTask(self, key, isbn, function, args)
+        self.tasks[key] = task
+        self.pool.start(task)
+
+    def lookup_meta(self, isbn):
+        """Fetch the metadata of a book through the cache on a worker thread, reported through meta_ready or lookup_failed."""
+        self.__submit__(("meta", isbn), isbn, cached_meta, self.meta_cache, isbn)
+
+    def fetch_cover(self, isbn, url):
+        """Fetch a cover thumbnail, reported through cover_ready or lookup_failed."""
+        self.__submit__(("cover", url), isbn, self.covers.image, url)
+
+    def cancel(self, isbn):
+        """Drop the lookups for a book that have not started yet."""
+        for key, task in list(self.tasks.items()):
+            if task.isbn == isbn and self.pool.tryTake(task):
+                del self.tasks[key]
+
+    def __finish__(self, key, result, error):
+        """Forward the result of a finished task to the listeners."""
+        self.tasks.pop(key, None)
+        kind, subject = key
+        if error is not None:
+            self.lookup_failed.emit(subject, str(error) or type(error).__name__)
+        elif kind == "meta":
+            self.meta_ready.emit(subject, result)
+        elif result is None:
+            self.lookup_failed.emit(subject, "Omslaget kunde inte hämtas")
+        else:
+            self.cover_ready.emit(subject, result)
@@ -0,0 +1,117 @@
+"""Database cache of book metadata fetched from the internet."""
+from datetime import datetime, timedelta
+
+import metrics
+
+
+AUTHOR_SEPARATOR = "; "
+UPSERT_META = """
+    INSERT INTO isbn_meta (ISBN, found, title, authors, year, lang, cover, fetched)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE
+        found = VALUES(found),
+        title = VALUES(title),
+        authors = VALUES(authors),
+        year = VALUES(year),
+        lang = VALUES(lang),
+        cover = VALUES(cover),
+        fetched = VALUES(fetched)
+    """
+
+
+class BookNotFound(LookupError):
+    """Raised when the metadata providers do not know an ISBN."""
+
+
+def fetch_meta(isbn):
+    """Fetch the metadata and cover URL of a book from the internet."""
+    import isbnlib  # pylint: disable=import-outside-toplevel
+    from isbnlib.dev import DataNotFoundAtServiceError, NoDataForSelectorError  # pylint: disable=import-outside-toplevel
+
+    try:
+        with metrics.timed("lookup", "isbnlib.meta"):
+            info = isbnlib.meta(isbn)
+    except (isbnlib.NotValidISBNError, NoDataForSelectorError, DataNotFoundAtServiceError) as error:
+        raise BookNotFound(f"Ingen information hittades för {isbn}") from error
+    if not info:
+        raise BookNotFound(f"Ingen information hittades för {isbn}")
+    info = dict(info)
+    with metrics.timed("lookup", "isbnlib.cover"):
+        info["Cover"] = (isbnlib.cover(isbn) or {}).get("thumbnail")
+    return info
+
+
+class MetaCache:
+    """Keeps fetched metadata per ISBN for a while, and remembers ISBNs the providers don't know."""
+
+    def __init__(self, database, ttl=timedelta(days=90), negative_ttl=timedelta(days=7)):
+        """Initialize the cache on the given database with the time to live of found and unknown ISBNs."""
+        self.database = database
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def __decode__(self, isbn, result):
+        """Turn a cached row into (hit, book_info) according to its age."""
+        found, title, authors, year, lang, cover, fetched = result
+        age = datetime.now() - fetched
+        if not found:
+            return age < self.negative_ttl, None
+        if age >= self.ttl:
+            return False, None
+        book_info = {
+            "ISBN-13": isbn,
+            "Title": title,
+            "Authors": authors.split(AUTHOR_SEPARATOR) if authors else [],
+            "Year": year or "",
+            "Language": lang or "",
+            "Cover": cover,
+        }
+        return True, book_info
+
+    def get(self, isbn):
+        """Return (True, book_info) on a hit, (True, None) for a known-unknown ISBN and (False, None) on a miss."""
+        return self.get_many([isbn])[isbn]
+
+    def get_many(self, isbns):
+        """Return {isbn: (hit, book_info)} for all the given ISBNs with one query."""
+        isbns = list(isbns)
+        entries = {isbn: (False, None) for isbn in isbns}
+        if not isbns:
+            return entries
+        results = self.database.fetchall(
+            "SELECT ISBN, found, title, authors, year, lang, cover, fetched FROM isbn_meta "
+            f"WHERE ISBN IN ({', '.join(['?'] * len(isbns))})",
+            isbns,
+        )
+        for result in results:
+            entries[result[0]] = self.__decode__(result[0], result[1:])
+        return entries
+
+    def put(self, isbn, book_info):
+        """Store the metadata of a book, or mark the ISBN as unknown if book_info is None."""
+        self.put_many({isbn: book_info})
+
+    def put_many(self, books):
+        """Store {isbn: book_info} in one statement, marking ISBNs whose book_info is None as unknown."""
+        if not books:
+            return
+        now = datetime.now()
+        rows = []
+        for isbn, book_info in books.items():
+            if book_info is None:
+                rows.append((isbn, False, None, None, None, None, None, now))
+            else:
+                rows.append(
+                    (
+                        isbn,
+                        True,
+                        book_info.get("Title"),
+                        AUTHOR_SEPARATOR.join(book_info.get("Authors") or []),
+                        book_info.get("Year"),
+                        book_info.get("Language"),
+                        book_info.get("Cover"),
+                        now,
+                    )
+                )
+        with self.database.connection() as conn:
+            self.database.cursor(conn, UPSERT_META).executemany(UPSERT_META, rows)
+            conn.commit()
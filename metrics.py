@@ -0,0 +1,282 @@
+"""Opt-in timing of database statements, external lookups and UI actions, with a slow-operation log."""
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from decouple import config
+
+
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LABEL_LENGTH = 120
+SLOW_LOG = logging.getLogger("bokhandeln.slow")
+
+REGISTRY = None
+
+
+@lru_cache(maxsize=1024)
+def label(sql):
+    """Return a one-line name for a statement, short enough to use as a metric label."""
+    return " ".join(sql.split())[:LABEL_LENGTH]
+
+
+def escape(value):
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Latency and row count distribution of one operation."""
+
+    __slots__ = ("buckets", "count", "total_ms", "max_ms", "rows", "errors")
+
+    def __init__(self):
+        """Initialize an empty histogram."""
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.errors = 0
+
+    def observe(self, elapsed_ms, rows, failed):
+        """Add one measurement."""
+        for position, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[position] += 1
+                break
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows or 0
+        self.errors += failed
+
+    def to_dict(self):
+        """Return the histogram as a JSON-serializable dict."""
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "buckets_ms": dict(zip(map(str, BUCKETS_MS), self.buckets)),
+        }
+
+
+class Timer:
+    """Context manager timing one operation into a Registry; set rows to record how many rows it touched."""
+
+    __slots__ = ("registry", "kind", "name", "rows", "start")
+
+    def __init__(self, registry, kind, name):
+        """Initialize the timer for an operation of the given kind and name."""
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.rows = None
+        self.start = 0.0
+
+    def __enter__(self):
+        """Start timing."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        """Record the operation, failed or not."""
+        self.registry.observe(self.kind, self.name, (time.perf_counter() - self.start) * 1000, self.rows, exc_type is not None)
+        return False
+
+
+class Untimed:
+    """Stand-in for Timer while metrics are off."""
+
+    rows = None
+
+    def __enter__(self):
+        """Do nothing."""
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        """Do nothing."""
+        return False
+
+
+UNTIMED = Untimed()
+
+
+class Registry:
+    """Thread-safe collection of histograms keyed by operation kind and name."""
+
+    def __init__(self, slow_ms):
+        """Initialize the registry, logging operations that take at least slow_ms."""
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, kind, name, elapsed_ms, rows=None, failed=False):
+        """Record one operation and log it if it was slow."""
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.observe(elapsed_ms, rows, failed)
+        if elapsed_ms >= self.slow_ms:
+            SLOW_LOG.warning("%s %.1f ms rows=%s%s %s", kind, elapsed_ms, rows, " failed" if failed else "", name)
+
+    def snapshot(self):
+        """Return every histogram as a list of dicts."""
+        with self.lock:
+            return [{"kind": kind, "name": name, **histogram.to_dict()} for (kind, name), histogram in self.histograms.items()]
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP bokhandeln_operation_duration_ms Duration of database statements, lookups and UI actions.",
+            "# TYPE bokhandeln_operation_duration_ms histogram",
+        ]
+        rows = ["# HELP bokhandeln_operation_rows_total Rows read or written.", "# TYPE bokhandeln_operation_rows_total counter"]
+        errors = ["# HELP bokhandeln_operation_errors_total Operations that raised.", "# TYPE bokhandeln_operation_errors_total counter"]
+        for metric in self.snapshot():
+            labels = f'kind="{escape(metric["kind"])}",name="{escape(metric["name"])}"'
+            cumulative = 0
+            for bound, count in metric["buckets_ms"].items():
+                cumulative += count
+                lines.append(f'bokhandeln_operation_duration_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bokhandeln_operation_duration_ms_bucket{{{labels},le="+Inf"}} {metric["count"]}')
+            lines.append(f"bokhandeln_operation_duration_ms_sum{{{labels}}} {metric['total_ms']}")
+            lines.append(f"bokhandeln_operation_duration_ms_count{{{labels}}} {metric['count']}")
+            rows.append(f"bokhandeln_operation_rows_total{{{labels}}} {metric['rows']}")
+            errors.append(f"bokhandeln_operation_errors_total{{{labels}}} {metric['errors']}")
+        return "\n".join(lines + rows + errors) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically replace path with the current metrics, for the node exporter's textfile collector."""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.prometheus())
+        os.replace(temporary, path)
+
+
+def timed(kind, name):
+    """Return a context manager timing one operation, or a shared no-op one while metrics are off."""
+    registry = REGISTRY
+    if registry is None:
+        return UNTIMED
+    return Timer(registry, kind, name)
+
+
+def statement(sql):
+    """Return a context manager timing one database statement, or the no-op one while metrics are off."""
+    registry = REGISTRY
+    if registry is None:
+        return UNTIMED
+    return Timer(registry, "db", label(sql))
+
+
+class TimedCursor:
+    """Cursor wrapper timing every statement it runs."""
+
+    def __init__(self, cursor):
+        """Initialize the wrapper around a MariaDB cursor."""
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        """Run and time one statement."""
+        with statement(sql) as timer:
+            self.cursor.execute(sql, params)
+            timer.rows = self.cursor.rowcount
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        """Run and time one statement for every parameter tuple."""
+        seq_of_params = list(seq_of_params)
+        with statement(sql) as timer:
+            self.cursor.executemany(sql, seq_of_params)
+            timer.rows = len(seq_of_params)
+        return self
+
+    def __getattr__(self, name):
+        """Delegate everything else to the wrapped cursor."""
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        """Iterate over the wrapped cursor's rows."""
+        return iter(self.cursor)
+
+
+def cursor(raw_cursor):
+    """Return raw_cursor, wrapped to time its statements while metrics are on."""
+    if REGISTRY is None:
+        return raw_cursor
+    return TimedCursor(raw_cursor)
+
+
+def export_periodically(registry, path, interval):
+    """Rewrite the Prometheus file at path every interval seconds on a daemon thread."""
+
+    def export():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.write_prometheus(path)
+            except OSError as error:
+                print(f"Could not write metrics to {path}: {error}")
+
+    threading.Thread(target=export, name="bokhandeln-metrics-export", daemon=True).start()
+
+
+def serve(registry, host, port):
+    """Serve /metrics as Prometheus text and /metrics.json as JSON on a daemon thread, and return the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # pylint: disable=import-outside-toplevel
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Answers metrics requests."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Send the metrics in the requested format."""
+            if self.path == "/metrics":
+                body, content_type = registry.prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """Keep scrapes out of the console."""
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="bokhandeln-metrics-http", daemon=True).start()
+    return server
+
+
+def configure():
+    """Turn metrics on if BOKHANDELN_METRICS is set, and start the slow log and exporters configured in .env."""
+    global REGISTRY  # pylint: disable=global-statement
+    if not config("BOKHANDELN_METRICS", default=False, cast=bool):
+        REGISTRY = None
+        return None
+    registry = Registry(config("BOKHANDELN_SLOW_MS", default=250, cast=float))
+    slow_log = config("BOKHANDELN_SLOW_LOG", default="slow_operations.log")
+    if slow_log:
+        handler = logging.FileHandler(slow_log, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s %(message)s"))
+        SLOW_LOG.addHandler(handler)
+        SLOW_LOG.setLevel(logging.WARNING)
+        SLOW_LOG.propagate = False
+    prometheus_file = config("BOKHANDELN_METRICS_FILE", default="")
+    if prometheus_file:
+        export_periodically(registry, prometheus_file, config("BOKHANDELN_METRICS_INTERVAL_S", default=15, cast=float))
+    port = config("BOKHANDELN_METRICS_PORT", default=0, cast=int)
+    if port:
+        serve(registry, config("BOKHANDELN_METRICS_HOST", default="127.0.0.1"), port)
+    REGISTRY = registry
+    return registry
@@ -0,0 +1,379 @@
+"""Versioned schema migrations for the Bokhandeln database."""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import mariadb
+
+import db
+from core import canonical_isbn
+from sales_archive import UNDATED, initial_partitions
+
+
+INIT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_db.sql")
+BATCH_SIZE = 5000
+ISBN_TABLES = ("isbn_meta",)
+QUARANTINE_TABLE = "inventory_invalid_isbn"
+SALES_QUARANTINE_TABLE = "sales_invalid_isbn"
+MAX_YEAR = 65535
+
+
+class MigrationError(RuntimeError):
+    """Raised when a migration cannot be applied to the data in the database."""
+
+
+def baseline(database, progress):
+    """Create the tables and indexes of init_db.sql if they don't exist yet."""
+    with open(INIT_DB, encoding="utf-8") as script:
+        statements = [statement.strip() for statement in script.read().split(";")]
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        for statement in statements:
+            if statement and not statement.upper().startswith("CREATE DATABASE"):
+                cursor.execute(statement)
+        conn.commit()
+    progress("Grundschema skapat")
+
+
+def canonical_isbn13_keys(database, progress):
+    """Rewrite every stored ISBN as canonical ISBN-13, batch by batch, and narrow the ISBN columns to CHAR(13).
+
+    Books whose ISBN isn't valid are moved to QUARANTINE_TABLE, with their stock, to be corrected by hand. Sales are
+    rewritten on their own, so the history of books no longer in stock is kept too.
+    """
+    last = ""
+    invalid = []
+    with database.connection() as conn:
+        conn.cursor().execute(f"CREATE TABLE IF NOT EXISTS `{QUARANTINE_TABLE}` LIKE inventory")
+    while True:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT ISBN, amount FROM inventory WHERE ISBN > ? ORDER BY ISBN LIMIT ?",
+                (last, BATCH_SIZE),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for isbn, amount in rows:
+                isbn13 = canonical_isbn(isbn)
+                if isbn13 is None:
+                    cursor.execute(f"REPLACE INTO {QUARANTINE_TABLE} SELECT * FROM inventory WHERE ISBN = ?", (isbn,))
+                    cursor.execute("DELETE FROM inventory WHERE ISBN = ?", (isbn,))
+                    invalid.append(isbn)
+                elif isbn13 != isbn:
+                    cursor.execute("SELECT 1 FROM inventory WHERE ISBN = ?", (isbn13,))
+                    if cursor.fetchone() is None:
+                        cursor.execute("UPDATE inventory SET ISBN = ? WHERE ISBN = ?", (isbn13, isbn))
+                    else:
+                        cursor.execute(
+                            "UPDATE inventory SET amount = COALESCE(amount, 0) + ? WHERE ISBN = ?",
+                            (amount or 0, isbn13),
+                        )
+                        cursor.execute("DELETE FROM inventory WHERE ISBN = ?", (isbn,))
+                    for table in ISBN_TABLES:
+                        cursor.execute(f"UPDATE IGNORE {table} SET ISBN = ? WHERE ISBN = ?", (isbn13, isbn))
+            conn.commit()
+        last = rows[-1][0]
+        progress(f"ISBN omskrivna till och med {last}")
+    if invalid:
+        progress(f"Ogiltiga ISBN flyttade till {QUARANTINE_TABLE}: {', '.join(invalid)}")
+    canonical_sales_isbns(database, progress)
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM isbn_meta WHERE CHAR_LENGTH(ISBN) <> 13")
+        cursor.execute("DELETE FROM sales_daily")
+        cursor.execute("ALTER TABLE inventory MODIFY `ISBN` char(13) NOT NULL")
+        cursor.execute("ALTER TABLE isbn_meta MODIFY `ISBN` char(13) NOT NULL")
+        cursor.execute("ALTER TABLE sales_daily MODIFY `ISBN` char(13) NOT NULL")
+        cursor.execute("ALTER TABLE sales MODIFY `ISBN` char(13) DEFAULT NULL")
+        cursor.execute(
+            """
+            INSERT INTO sales_daily (day, seller, ISBN, units, revenue, cost)
+            SELECT DATE(s.date), COALESCE(s.seller, ''), s.ISBN, COUNT(*), COALESCE(SUM(s.price), 0),
+                   COUNT(*) * COALESCE(MAX(i.buy_price), 0)
+            FROM sales s LEFT JOIN inventory i ON i.ISBN = s.ISBN
+            WHERE s.ISBN IS NOT NULL
+            GROUP BY DATE(s.date), COALESCE(s.seller, ''), s.ISBN
+            """
+        )
+        conn.commit()
+    progress("ISBN-kolumner ändrade till CHAR(13)")
+
+
+def canonical_sales_isbns(database, progress):
+    """Rewrite the ISBNs of sales as canonical ISBN-13, a batch of distinct ISBNs at a time.
+
+    Sales of an ISBN that isn't valid are copied to SALES_QUARANTINE_TABLE before their ISBN is cleared, so the
+    original can still be corrected by hand.
+    """
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("ALTER TABLE sales ADD INDEX IF NOT EXISTS `idx_sales_isbn` (`ISBN`, `date`)")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS `{SALES_QUARANTINE_TABLE}` LIKE sales")
+    last = ""
+    invalid = []
+    while True:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT ISBN FROM sales WHERE ISBN > ? ORDER BY ISBN LIMIT ?", (last, BATCH_SIZE))
+            isbns = [isbn for (isbn,) in cursor.fetchall()]
+            if not isbns:
+                break
+            for isbn in isbns:
+                isbn13 = canonical_isbn(isbn)
+                if isbn13 is None:
+                    cursor.execute(f"INSERT INTO {SALES_QUARANTINE_TABLE} SELECT * FROM sales WHERE ISBN = ?", (isbn,))
+                    cursor.execute("UPDATE sales SET ISBN = NULL WHERE ISBN = ?", (isbn,))
+                    invalid.append(isbn)
+                elif isbn13 != isbn:
+                    cursor.execute("UPDATE sales SET ISBN = ? WHERE ISBN = ?", (isbn13, isbn))
+            conn.commit()
+        last = isbns[-1]
+        progress(f"ISBN i försäljningen omskrivna till och med {last}")
+    if invalid:
+        progress(f"Försäljning med ogiltiga ISBN kopierad till {SALES_QUARANTINE_TABLE}: {', '.join(invalid)}")
+
+
+def sales_keys(database, progress):
+    """Give sales a surrogate primary key and the composite indexes used by lookups and reports."""
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "ALTER TABLE sales ADD COLUMN IF NOT EXISTS `id` bigint unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST"
+        )
+        cursor.execute(
+            """
+            ALTER TABLE sales
+                ADD INDEX IF NOT EXISTS `idx_sales_date` (`date`),
+                ADD INDEX IF NOT EXISTS `idx_sales_isbn` (`ISBN`, `date`),
+                ADD INDEX IF NOT EXISTS `idx_sales_seller` (`seller`, `date`),
+                ALGORITHM=INPLACE, LOCK=NONE
+            """
+        )
+    progress("Primärnyckel och index på sales skapade")
+
+
+def stock_constraints(database, progress):
+    """Make prices and years unsigned and forbid negative or missing amounts in stock.
+
+    Years that don't fit in a smallint unsigned are cleared first, so the ALTER can't fail halfway through.
+    """
+    while True:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE inventory SET amount = 0 WHERE amount < 0 OR amount IS NULL LIMIT ?",
+                (BATCH_SIZE,),
+            )
+            changed = cursor.rowcount
+            cursor.execute(
+                "UPDATE inventory SET year = NULL WHERE year < 0 OR year > ? LIMIT ?",
+                (MAX_YEAR, BATCH_SIZE),
+            )
+            changed += cursor.rowcount
+            cursor.execute(
+                "UPDATE inventory SET buy_price = NULL WHERE buy_price < 0 LIMIT ?",
+                (BATCH_SIZE,),
+            )
+            changed += cursor.rowcount
+            cursor.execute(
+                "UPDATE inventory SET sell_price = NULL WHERE sell_price < 0 LIMIT ?",
+                (BATCH_SIZE,),
+            )
+            changed += cursor.rowcount
+            conn.commit()
+        if not changed:
+            break
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT 1 FROM information_schema.TABLE_CONSTRAINTS
+            WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'inventory' AND CONSTRAINT_NAME = 'amount_not_negative'
+            """
+        )
+        constrained = cursor.fetchone() is not None
+        cursor.execute(
+            f"""
+            ALTER TABLE inventory
+                MODIFY `year` smallint unsigned DEFAULT NULL,
+                MODIFY `amount` int NOT NULL DEFAULT 0,
+                MODIFY `sell_price` int unsigned DEFAULT NULL,
+                MODIFY `buy_price` int unsigned DEFAULT NULL
+                {"" if constrained else ", ADD CONSTRAINT `amount_not_negative` CHECK (`amount` >= 0)"}
+            """
+        )
+    progress("Lagerkolumner skärpta")
+
+
+def inventory_change_feed(database, progress):
+    """Create the change feed that other tills poll for inventory changes."""
+    with database.connection() as conn:
+        conn.cursor().execute(
+            """
+            CREATE TABLE IF NOT EXISTS `inventory_changes` (
+              `version` bigint unsigned NOT NULL AUTO_INCREMENT,
+              `ISBN` char(13) NOT NULL,
+              `changed` datetime NOT NULL,
+              PRIMARY KEY (`version`),
+              KEY `idx_inventory_changes_changed` (`changed`)
+            )
+            """
+        )
+    progress("Ändringslogg för lagret skapad")
+
+
+def journal_keys(database, progress):
+    """Create the table of journal entries already applied, so retried flushes from a till never double-count."""
+    with database.connection() as conn:
+        conn.cursor().execute(
+            """
+            CREATE TABLE IF NOT EXISTS `journal_applied` (
+              `journal_key` char(36) NOT NULL,
+              `applied` datetime NOT NULL,
+              PRIMARY KEY (`journal_key`),
+              KEY `idx_journal_applied_applied` (`applied`)
+            )
+            """
+        )
+    progress("Idempotensnycklar för kassajournalen skapade")
+
+
+def sales_partitions(database, progress):
+    """Partition sales by month, so closed months can be archived and queries on a period only read its partitions.
+
+    MariaDB requires the partitioning column in every unique key, so the primary key becomes (id, date) and
+    undated sales get the date UNDATED. The table of archived months is created at the same time.
+    """
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE sales SET date = ? WHERE date IS NULL", (UNDATED,))
+        cursor.execute("SELECT MIN(date) FROM sales WHERE date > ?", (UNDATED,))
+        first = cursor.fetchone()[0] or datetime.now()
+        conn.commit()
+        cursor.execute(
+            "ALTER TABLE sales MODIFY `date` datetime NOT NULL, DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `date`)"
+        )
+        progress("Primärnyckel på sales utökad med datum")
+        cursor.execute(
+            f"ALTER TABLE sales PARTITION BY RANGE COLUMNS(`date`) ({initial_partitions(first, datetime.now())})"
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS `sales_archives` (
+              `file` varchar(255) NOT NULL,
+              `first_date` datetime NOT NULL,
+              `last_date` datetime NOT NULL,
+              `sale_count` int unsigned NOT NULL,
+              `archived` datetime NOT NULL,
+              PRIMARY KEY (`file`),
+              KEY `idx_sales_archives_dates` (`first_date`, `last_date`)
+            )
+            """
+        )
+    progress("Försäljningen partitionerad per månad")
+
+
+def change_sequence(database, progress):
+    """Number change feed entries from a locked counter instead of AUTO_INCREMENT.
+
+    AUTO_INCREMENT values are handed out at insert time, so a transaction that commits late could publish a version
+    below one a till has already read past, and rollbacks left gaps that looked like pruned history.
+    """
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS `inventory_change_sequence` (
+              `id` tinyint unsigned NOT NULL,
+              `version` bigint unsigned NOT NULL,
+              PRIMARY KEY (`id`)
+            )
+            """
+        )
+        cursor.execute(
+            """
+            INSERT IGNORE INTO inventory_change_sequence (id, version)
+            SELECT 1, COALESCE(MAX(version), 0) FROM inventory_changes
+            """
+        )
+        cursor.execute("ALTER TABLE inventory_changes MODIFY `version` bigint unsigned NOT NULL")
+        conn.commit()
+    progress("Sekvensräknare för ändringsloggen skapad")
+
+
+MIGRATIONS = [
+    (1, "Grundschema från init_db.sql", baseline),
+    (2, "Kanoniska ISBN-13 som CHAR(13)", canonical_isbn13_keys),
+    (3, "Primärnyckel och sammansatta index på sales", sales_keys),
+    (4, "Osignerade priser och icke-negativt lager", stock_constraints),
+    (5, "Ändringslogg för synkronisering mellan kassor", inventory_change_feed),
+    (6, "Idempotensnycklar för kassajournalen", journal_keys),
+    (7, "Månadspartitioner och arkiv för försäljningen", sales_partitions),
+    (8, "Sekvensräknare för ändringsloggen", change_sequence),
+]
+
+
+def current_version(database):
+    """Return the version of the database schema, creating the version table if needed."""
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS `schema_version` (
+              `version` int(11) NOT NULL,
+              `description` varchar(255) NOT NULL,
+              `applied` datetime NOT NULL,
+              PRIMARY KEY (`version`)
+            )
+            """
+        )
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+
+
+def migrate(database, target=None, progress=print):
+    """Apply the migrations after the current schema version, up to target or the latest one."""
+    version = current_version(database)
+    for number, description, migration in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        progress(f"Migrering {number}: {description}")
+        migration(database, progress)
+        with database.connection() as conn:
+            conn.cursor().execute(
+                "INSERT INTO schema_version (version, description, applied) VALUES (?, ?, ?)",
+                (number, description, datetime.now()),
+            )
+            conn.commit()
+        version = number
+    return version
+
+
+def main(argv=None):
+    """Migrate the database from the command line."""
+    parser = argparse.ArgumentParser(description="Uppdatera databasschemat.")
+    parser.add_argument("--target", type=int, help="migrera bara fram till denna version")
+    parser.add_argument("--status", action="store_true", help="visa aktuell version utan att migrera")
+    args = parser.parse_args(argv)
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    if args.status:
+        print(f"Schemaversion {current_version(database)} av {MIGRATIONS[-1][0]}")
+        return 0
+    try:
+        version = migrate(database, args.target)
+    except (MigrationError, mariadb.Error) as e:
+        print(f"Migreringen misslyckades: {e}")
+        return 1
+    print(f"Schemaversion {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Table model that pages the inventory in from the database as it is scrolled."""
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from core import INVENTORY_COLUMNS, search_conditions
+from inventory_model import AMOUNT_COLUMN, InventoryModel, cell_text
+
+
+PAGE_SIZE = 200
+MAX_PAGES = 25
+COLUMN_NAMES = [name.strip() for name in INVENTORY_COLUMNS.split(",")]
+
+
+class PageTask(QtCore.QRunnable):
+    """Runnable that reads one page of books, or counts the matching books, on a worker thread for its model."""
+
+    def __init__(self, model, generation, page, sql, params):
+        """Initialize the task to run sql for page, or for the count when page is None."""
+        super().__init__()
+        self.model = model
+        self.generation = generation
+        self.page = page
+        self.sql = sql
+        self.params = params
+
+    def run(self):
+        """Run the query and hand the rows to the model."""
+        try:
+            rows = self.model.database.fetchall(self.sql, self.params)
+        except Exception as error:  # pylint: disable=broad-except
+            self.model.task_done.emit(self.generation, self.page, None, str(error))
+            return
+        self.model.task_done.emit(self.generation, self.page, rows, "")
+
+
+class PagedInventoryModel(QtCore.QAbstractTableModel):
+    """Read-only table model that sorts and searches in MariaDB and keeps only a few pages in memory.
+
+    Pages the view paints, and the matching books, are read and counted on worker threads and shown when they
+    arrive, so the GUI thread never waits for the database.
+    """
+
+    task_done = QtCore.pyqtSignal(int, object, object, str)
+
+    def __init__(self, database, parent=None):
+        """Initialize the model on the given database, sorted by ISBN."""
+        super().__init__(parent)
+        self.database = database
+        self.sort_column = 0
+        self.descending = False
+        self.query = ""
+        self.count = 0
+        self.pages = OrderedDict()
+        self.bookmarks = {}
+        self.generation = 0
+        self.loading = set()
+        self.counting = False
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.task_done.connect(self.__loaded__)
+        self.reload()
+
+    thumbnails = None
+    columnCount = InventoryModel.columnCount
+    headerData = InventoryModel.headerData
+
+    def rowCount(self, parent=QtCore.QModelIndex()):  # pylint: disable=invalid-name
+        """Return the number of books matching the current search."""
+        if parent.isValid():
+            return 0
+        return self.count
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """Return the text of a single cell, or nothing while its page is read in the background."""
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        page, offset = divmod(index.row(), PAGE_SIZE)
+        books = self.pages.get(page)
+        if books is None:
+            self.__request__(page)
+            return None
+        self.pages.move_to_end(page)
+        if offset >= len(books):
+            return None
+        return cell_text(books[offset][index.column()])
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort the inventory in the database."""
+        self.sort_column = column
+        self.descending = order == QtCore.Qt.DescendingOrder
+        self.reload()
+
+    def set_search(self, query):
+        """Show only books matching the query on ISBN, or on title and author through the FULLTEXT index."""
+        self.query = query.strip()
+        self.reload()
+
+    def reload(self):
+        """Drop all loaded pages and count the matching books again on a worker thread, showing the old count until then."""
+        self.__reset__(self.count)
+        self.__recount__()
+
+    def __reset__(self, count):
+        """Drop all loaded pages, and the pages and counts still being read, and show count books."""
+        self.beginResetModel()
+        self.pages.clear()
+        self.bookmarks.clear()
+        self.loading.clear()
+        self.generation += 1
+        self.count = count
+        self.endResetModel()
+
+    def __filter__(self):
+        """Return the WHERE conditions and parameters of the current search."""
+        return search_conditions(self.query)
+
+    def __count_query__(self):
+        """Return the SQL and parameters counting the books matching the current search."""
+        conditions, params = self.__filter__()
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT COUNT(*) FROM inventory{where}", params
+
+    def __request__(self, page):
+        """Start reading a page on a worker thread unless it is already being read."""
+        if page in self.loading:
+            return
+        self.loading.add(page)
+        self.pool.start(PageTask(self, self.generation, page, *self.__page_query__(page)))
+
+    def __recount__(self):
+        """Count the matching books again on a worker thread."""
+        if self.counting:
+            return
+        self.counting = True
+        self.pool.start(PageTask(self, self.generation, None, *self.__count_query__()))
+
+    def __loaded__(self, generation, page, rows, error):
+        """Show a page, or a new count, read by a PageTask unless the model was reset since it started."""
+        if page is None:
+            self.counting = False
+        if generation != self.generation:
+            if page is None:
+                self.__recount__()
+            return
+        if page is not None:
+            self.loading.discard(page)
+        if error:
+            print(f"Reading the inventory failed: {error}")
+            return
+        if page is None:
+            if rows[0][0] != self.count:
+                self.__reset__(rows[0][0])
+            return
+        self.__store__(page, rows)
+        first = page * PAGE_SIZE
+        last = min(first + PAGE_SIZE, self.count) - 1
+        if last >= first:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, self.columnCount() - 1))
+
+    def __page_query__(self, page):
+        """Return the SQL and parameters reading one page of books.
+
+        Pages after a known page are read by keyset on (sort column, ISBN), others by offset.
+        """
+        conditions, params = self.__filter__()
+        column = COLUMN_NAMES[self.sort_column]
+        direction = "DESC" if self.descending else "ASC"
+        bookmark = self.bookmarks.get(page - 1)
+        offset = ""
+        if page and bookmark is not None and bookmark[0] is not None:
+            value, isbn = bookmark
+            operator = "<" if self.descending else ">"
+            keyset = f"{column} {operator} ? OR ({column} = ? AND ISBN {operator} ?)"
+            if self.descending:
+                keyset += f" OR {column} IS NULL"
+            conditions = conditions + [f"({keyset})"]
+            params = params + [value, value, isbn]
+        elif page:
+            offset = f" OFFSET {page * PAGE_SIZE}"
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {INVENTORY_COLUMNS} FROM inventory{where} ORDER BY {column} {direction}, ISBN {direction} LIMIT {PAGE_SIZE}{offset}"
+        return sql, params
+
+    def __store__(self, page, books):
+        """Keep a page of books, and at most MAX_PAGES of them in memory."""
+        self.pages[page] = books
+        if len(self.pages) > MAX_PAGES:
+            self.pages.popitem(last=False)
+        if books:
+            self.bookmarks[page] = (books[-1][self.sort_column], books[-1][0])
+
+    def __book_at__(self, row):
+        """Return the book on the given row, or None while its page is read or if the inventory shrank since it was counted."""
+        page, offset = divmod(row, PAGE_SIZE)
+        books = self.pages.get(page)
+        if books is None:
+            self.__request__(page)
+            return None
+        self.pages.move_to_end(page)
+        if offset >= len(books):
+            return None
+        return books[offset]
+
+    def __locate__(self, isbn):
+        """Return the (page, offset) of a book in the loaded pages, or None."""
+        for page, books in self.pages.items():
+            for offset, book in enumerate(books):
+                if book[0] == isbn:
+                    return page, offset
+        return None
+
+    def __replace__(self, page, offset, book):
+        """Replace a loaded book and tell the view."""
+        self.pages[page][offset] = book
+        row = page * PAGE_SIZE + offset
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMN_NAMES) - 1))
+
+    def isbn(self, row):
+        """Return the ISBN of the book on the given row, or None until its page has been read."""
+        book = self.__book_at__(row)
+        return None if book is None else book[0]
+
+    def book(self, isbn):
+        """Return the row tuple of the book with the given ISBN, or None if it is not in the inventory."""
+        location = self.__locate__(isbn)
+        if location is not None:
+            page, offset = location
+            return self.pages[page][offset]
+        return self.database.fetchone(f"SELECT {INVENTORY_COLUMNS} FROM inventory WHERE ISBN = ?", (isbn,))
+
+    def set_amounts(self, stock):
+        """Update the amount in stock of the given {isbn: amount} on the loaded pages."""
+        for isbn, amount in stock.items():
+            location = self.__locate__(isbn)
+            if location is not None:
+                page, offset = location
+                book = self.pages[page][offset]
+                self.__replace__(page, offset, book[:AMOUNT_COLUMN] + (amount,) + book[AMOUNT_COLUMN + 1:])
+
+    def __remove__(self, page, offset):
+        """Remove a loaded book, dropping its page and the ones after it, whose rows have moved up."""
+        row = page * PAGE_SIZE + offset
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        for later in [loaded for loaded in self.pages if loaded >= page]:
+            del self.pages[later]
+        for later in [known for known in self.bookmarks if known >= page]:
+            del self.bookmarks[later]
+        self.generation += 1
+        self.loading.clear()
+        self.count -= 1
+        self.endRemoveRows()
+
+    def update_books(self, isbns, inventory):
+        """Patch the given ISBNs on the loaded pages from their freshly read rows.
+
+        A book on a loaded page that is no longer in inventory was removed. Whether a book on no loaded page was
+        added or removed can't be told from its row, so the books are counted again on a worker thread.
+        """
+        fetched = {book[0]: book for book in inventory}
+        unknown = False
+        for isbn in isbns:
+            location = self.__locate__(isbn)
+            if location is None:
+                unknown = True
+            elif isbn in fetched:
+                self.__replace__(*location, fetched[isbn])
+            else:
+                self.__remove__(*location)
+        if unknown:
+            self.__recount__()
@@ -0,0 +1,174 @@
+"""Sales reports computed from the daily sales rollup."""
+import argparse
+import sys
+from datetime import date, timedelta
+
+import mariadb
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtWidgets import QComboBox, QDateEdit, QDialog, QHBoxLayout, QMessageBox, QTableView, QVBoxLayout
+
+import db
+from sales_archive import archive_directory, archived_sales
+from stock import ROLLUP_SALE, placeholders
+
+
+PERIODS = {
+    "day": ("Dag", "DATE_FORMAT(day, '%Y-%m-%d')"),
+    "week": ("Vecka", "DATE_FORMAT(day, '%x-v%v')"),
+    "month": ("Månad", "DATE_FORMAT(day, '%Y-%m')"),
+}
+REPORT_HEADERS = ["Period", "Säljare", "Antal", "Intäkt", "Kostnad", "Marginal"]
+CHUNK_SIZE = 500
+
+
+def summary(database, period="day", start=None, end=None, by_seller=False):
+    """Return (period, seller, units, revenue, cost, margin) rows per period between start and end, inclusive."""
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+    label = PERIODS[period][1]
+    seller = "seller" if by_seller else "''"
+    group = f"{label}, seller" if by_seller else label
+    return database.fetchall(
+        f"""
+        SELECT {label} AS period, {seller}, SUM(units), SUM(revenue), SUM(cost), SUM(revenue) - SUM(cost)
+        FROM sales_daily WHERE day BETWEEN ? AND ?
+        GROUP BY {group} ORDER BY period
+        """,
+        (start, end),
+    )
+
+
+def archived_rollups(database, directory, start=None, end=None):
+    """Return (day, seller, ISBN, units, revenue, cost) rollup rows of the archived sales from start up to end."""
+    totals = {}
+    for _, moment, isbn, price, seller in archived_sales(database, directory, start, end):
+        if isbn is None:
+            continue
+        key = (moment.date(), seller or "", isbn)
+        units, revenue = totals.get(key, (0, 0))
+        totals[key] = (units + 1, revenue + (price or 0))
+    isbns = list({key[2] for key in totals})
+    buy_prices = {}
+    for first in range(0, len(isbns), CHUNK_SIZE):
+        chunk = isbns[first:first + CHUNK_SIZE]
+        buy_prices.update(
+            database.fetchall(f"SELECT ISBN, buy_price FROM inventory WHERE ISBN IN ({placeholders(len(chunk))})", chunk)
+        )
+    return [
+        (*key, units, revenue, units * (buy_prices.get(key[2]) or 0))
+        for key, (units, revenue) in totals.items()
+    ]
+
+
+def rebuild_rollups(database, start=None, end=None, directory=None):
+    """Recompute the daily rollup from the sales table and the archive, for all days or the days between start and end.
+
+    The live sales are summed in the database, where only the partitions of the period are read; archived sales
+    are summed from the archive files covering the period and added on top.
+    """
+    directory = directory or archive_directory()
+    archived = archived_rollups(database, directory, start, end and end + timedelta(days=1))
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("s.date >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("s.date < ?")
+        params.append(end + timedelta(days=1))
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    day_conditions = " AND ".join(condition.replace("s.date", "day") for condition in conditions)
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM sales_daily{' WHERE ' + day_conditions if conditions else ''}", tuple(params))
+        cursor.execute(
+            f"""
+            INSERT INTO sales_daily (day, seller, ISBN, units, revenue, cost)
+            SELECT DATE(s.date), COALESCE(s.seller, ''), s.ISBN, COUNT(*), COALESCE(SUM(s.price), 0),
+                   COUNT(*) * COALESCE(MAX(i.buy_price), 0)
+            FROM sales s LEFT JOIN inventory i ON i.ISBN = s.ISBN{where}
+            GROUP BY DATE(s.date), COALESCE(s.seller, ''), s.ISBN
+            """,
+            tuple(params),
+        )
+        if archived:
+            database.cursor(conn, ROLLUP_SALE).executemany(ROLLUP_SALE, archived)
+        conn.commit()
+
+
+class ReportDialog(QDialog):
+    """Window showing day, week or month sales summaries."""
+
+    def __init__(self, database, parent=None):
+        """Initialize the report window."""
+        super().__init__(parent)
+        self.database = database
+        self.setWindowTitle("Försäljningsrapport")
+        self.resize(700, 500)
+        self.combo_period = QComboBox(self)
+        for key, (name, _) in PERIODS.items():
+            self.combo_period.addItem(name, key)
+        self.combo_seller = QComboBox(self)
+        self.combo_seller.addItem("Alla säljare", False)
+        self.combo_seller.addItem("Per säljare", True)
+        self.date_start = QDateEdit(QtCore.QDate.currentDate().addDays(-30), self)
+        self.date_end = QDateEdit(QtCore.QDate.currentDate(), self)
+        for date_edit in (self.date_start, self.date_end):
+            date_edit.setCalendarPopup(True)
+        self.table_report = QTableView(self)
+        self.model = QtGui.QStandardItemModel(self)
+        self.table_report.setModel(self.model)
+        controls = QHBoxLayout()
+        for widget in (self.combo_period, self.combo_seller, self.date_start, self.date_end):
+            controls.addWidget(widget)
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.table_report)
+        self.combo_period.currentIndexChanged.connect(self.update_report)
+        self.combo_seller.currentIndexChanged.connect(self.update_report)
+        self.date_start.dateChanged.connect(self.update_report)
+        self.date_end.dateChanged.connect(self.update_report)
+        self.update_report()
+
+    def update_report(self):
+        """Recompute the report for the chosen period and dates."""
+        try:
+            rows = summary(
+                self.database,
+                self.combo_period.currentData(),
+                self.date_start.date().toPyDate(),
+                self.date_end.date().toPyDate(),
+                self.combo_seller.currentData(),
+            )
+        except mariadb.Error as e:
+            QMessageBox.warning(self, "Rapporten kunde inte hämtas", str(e))
+            return
+        self.model.clear()
+        self.model.setHorizontalHeaderLabels(REPORT_HEADERS)
+        for row in rows:
+            self.model.appendRow([QtGui.QStandardItem("" if value is None else str(value)) for value in row])
+
+
+def main(argv=None):
+    """Print sales summaries or rebuild the rollup from the command line."""
+    parser = argparse.ArgumentParser(description="Försäljningsrapporter.")
+    parser.add_argument("--period", choices=PERIODS, default="day")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--by-seller", action="store_true")
+    parser.add_argument("--rebuild", action="store_true", help="räkna om dagssammanställningen från sales och arkivet")
+    args = parser.parse_args(argv)
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    if args.rebuild:
+        rebuild_rollups(database, args.start, args.end)
+    for row in summary(database, args.period, args.start, args.end, args.by_seller):
+        print("\t".join("" if value is None else str(value) for value in row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
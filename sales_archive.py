@@ -0,0 +1,342 @@
+"""Monthly partitions of the sales table, and the archive of closed months in compressed column files."""
+import argparse
+import json
+import lzma
+import os
+import struct
+import sys
+from array import array
+from datetime import date, datetime, timedelta
+
+from decouple import config
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".local", "share", "bokhandeln", "archive")
+MAGIC = b"BOKSALE\0"
+FORMAT = 1
+HEADER = struct.Struct("<8sIQ")
+LENGTH = struct.Struct("<I")
+NULL = -(2**31)
+EPOCH = datetime(1970, 1, 1)
+UNDATED = EPOCH
+PARTITIONS_AHEAD = 3
+KEEP_MONTHS = 24
+FUTURE = "p_future"
+BEFORE = "p_before"
+STAGING = "sales_archiving"
+SALES_COLUMNS = "id, date, ISBN, price, seller"
+
+
+class ArchiveError(RuntimeError):
+    """Raised when archived sales can't be written or read back."""
+
+
+def archive_directory():
+    """Return the directory of the sales archive given by BOKHANDELN_ARCHIVE_DIR."""
+    return config("BOKHANDELN_ARCHIVE_DIR", default=DEFAULT_DIRECTORY)
+
+
+def month_start(day):
+    """Return the first day of the month of a date or datetime."""
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, months):
+    """Return the first day of the month months after the month starting on month."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """Return the name of the partition holding the sales of the month before the one starting on month."""
+    previous = add_months(month, -1)
+    return f"p{previous.year}{previous.month:02}"
+
+
+def partition_definitions(bounds):
+    """Return the PARTITION clauses for sales ending at each month start in bounds, plus the one for later sales."""
+    definitions = [f"PARTITION `{partition_name(bound)}` VALUES LESS THAN ('{bound.isoformat()}')" for bound in bounds]
+    definitions.append(f"PARTITION `{FUTURE}` VALUES LESS THAN (MAXVALUE)")
+    return ", ".join(definitions)
+
+
+def initial_partitions(first, today, ahead=PARTITIONS_AHEAD):
+    """Return the PARTITION clauses for sales from the month of first up to ahead months after today.
+
+    Undated sales and anything older than first go in a partition of their own.
+    """
+    first = month_start(first)
+    last = add_months(month_start(today), ahead + 1)
+    bounds = []
+    month = add_months(first, 1)
+    while month <= last:
+        bounds.append(month)
+        month = add_months(month, 1)
+    return f"PARTITION `{BEFORE}` VALUES LESS THAN ('{first.isoformat()}'), " + partition_definitions(bounds)
+
+
+def partitions(database):
+    """Return [(name, upper bound or None for the last one)] of the sales table, oldest first."""
+    rows = database.fetchall(
+        """
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sales' AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """
+    )
+    return [(name, None if bound == "MAXVALUE" else date.fromisoformat(bound.strip("'")[:10])) for name, bound in rows]
+
+
+def ensure_partitions(database, ahead=PARTITIONS_AHEAD, today=None):
+    """Split the partition of future sales so that every month up to ahead months from today has its own.
+
+    This is cheap while the future partition is empty, which it stays as long as this runs at least every few months.
+    """
+    bounds = [bound for _, bound in partitions(database) if bound is not None]
+    if not bounds:
+        return []
+    last = add_months(month_start(today or date.today()), ahead + 1)
+    month = max(bounds)
+    added = []
+    while month < last:
+        month = add_months(month, 1)
+        added.append(month)
+    if added:
+        with database.connection() as conn:
+            conn.cursor().execute(
+                f"ALTER TABLE sales REORGANIZE PARTITION `{FUTURE}` INTO ({partition_definitions(added)})"
+            )
+    return [partition_name(month) for month in added]
+
+
+def closed_partitions(database, keep_months=KEEP_MONTHS, today=None):
+    """Return the names of the partitions holding only sales older than keep_months whole months before today."""
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+    return [name for name, bound in partitions(database) if bound is not None and bound <= cutoff]
+
+
+def __seconds__(moment):
+    """Return a datetime as whole seconds since EPOCH."""
+    return (moment - EPOCH) // timedelta(seconds=1)
+
+
+def __write_texts__(archive_file, values):
+    """Write a text column as a code per row followed by its distinct values as JSON."""
+    lookup = {}
+    codes = array("I", (lookup.setdefault(value, len(lookup)) for value in values))
+    distinct = json.dumps(list(lookup), ensure_ascii=False).encode("utf-8")
+    archive_file.write(codes.tobytes())
+    archive_file.write(LENGTH.pack(len(distinct)))
+    archive_file.write(distinct)
+
+
+def write_archive(path, rows):
+    """Atomically write sales rows (id, date, ISBN, price, seller) to path, column by column, compressed with xz."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = path + ".part"
+    with lzma.open(partial, "wb") as archive_file:
+        archive_file.write(HEADER.pack(MAGIC, FORMAT, len(rows)))
+        archive_file.write(array("Q", (row[0] for row in rows)).tobytes())
+        archive_file.write(array("q", (__seconds__(row[1]) for row in rows)).tobytes())
+        archive_file.write(array("i", (NULL if row[3] is None else row[3] for row in rows)).tobytes())
+        __write_texts__(archive_file, [row[2] for row in rows])
+        __write_texts__(archive_file, [row[4] for row in rows])
+    os.replace(partial, path)
+
+
+def read_archive(path):
+    """Return the sales rows (id, date, ISBN, price, seller) of an archive file, raising ArchiveError if it isn't one."""
+    try:
+        with lzma.open(path, "rb") as archive_file:
+            data = memoryview(archive_file.read())
+    except (OSError, lzma.LZMAError) as error:
+        raise ArchiveError(f"Kan inte läsa försäljningsarkivet {path}: {error}") from error
+    if len(data) < HEADER.size:
+        raise ArchiveError(f"{path} är inget försäljningsarkiv")
+    magic, file_format, count = HEADER.unpack_from(data)
+    if magic != MAGIC or file_format != FORMAT:
+        raise ArchiveError(f"{path} är inget försäljningsarkiv")
+    position = HEADER.size
+    columns = []
+    texts = []
+    try:
+        for typecode, size in (("Q", 8), ("q", 8), ("i", 4)):
+            column = array(typecode)
+            column.frombytes(data[position:position + size * count])
+            columns.append(column)
+            position += size * count
+        for _ in range(2):
+            codes = array("I")
+            codes.frombytes(data[position:position + 4 * count])
+            position += 4 * count
+            (length,) = LENGTH.unpack_from(data, position)
+            position += LENGTH.size
+            values = json.loads(bytes(data[position:position + length]).decode("utf-8"))
+            position += length
+            texts.append([values[code] for code in codes])
+    except (struct.error, ValueError, IndexError) as error:
+        raise ArchiveError(f"{path} är skadad: {error}") from error
+    if position != len(data) or any(len(column) != count for column in columns + texts):
+        raise ArchiveError(f"{path} är skadad")
+    ids, seconds, prices = columns
+    isbns, sellers = texts
+    return [
+        (ids[row], EPOCH + timedelta(seconds=seconds[row]), isbns[row], None if prices[row] == NULL else prices[row], sellers[row])
+        for row in range(count)
+    ]
+
+
+def __stage__(database, name):
+    """Swap the rows of a closed partition out into a staging table and merge the emptied partition into the next one.
+
+    The swap is instant, so sales written meanwhile are never lost; ones that land in the partition after it is
+    emptied are kept in the next partition by the merge.
+    """
+    staging = f"{STAGING}_{name}"
+    existing = partitions(database)
+    following, following_bound = existing[[partition for partition, _ in existing].index(name) + 1]
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE TABLE `{staging}` LIKE sales")
+        cursor.execute(f"ALTER TABLE `{staging}` REMOVE PARTITIONING")
+        cursor.execute(f"ALTER TABLE sales EXCHANGE PARTITION `{name}` WITH TABLE `{staging}`")
+        bound = "MAXVALUE" if following_bound is None else f"'{following_bound.isoformat()}'"
+        cursor.execute(
+            f"ALTER TABLE sales REORGANIZE PARTITION `{name}`, `{following}` INTO "
+            f"(PARTITION `{following}` VALUES LESS THAN ({bound}))"
+        )
+    return staging
+
+
+def __finish__(database, directory, staging):
+    """Write the rows of a staging table to an archive file, register it and drop the table; return the number of rows."""
+    name = staging[len(STAGING) + 1:]
+    rows = database.fetchall(f"SELECT {SALES_COLUMNS} FROM `{staging}` ORDER BY id")
+    if rows:
+        file_name = f"sales-{name}-{rows[0][0]}-{rows[-1][0]}.xz"
+        path = os.path.join(directory, file_name)
+        write_archive(path, rows)
+        if len(read_archive(path)) != len(rows):
+            raise ArchiveError(f"{path} kunde inte läsas tillbaka")
+        with database.connection() as conn:
+            conn.cursor().execute(
+                """
+                INSERT IGNORE INTO sales_archives (file, first_date, last_date, sale_count, archived)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (file_name, min(row[1] for row in rows), max(row[1] for row in rows), len(rows), datetime.now()),
+            )
+            conn.commit()
+    with database.connection() as conn:
+        conn.cursor().execute(f"DROP TABLE `{staging}`")
+    return len(rows)
+
+
+def archive(database, directory, keep_months=KEEP_MONTHS, today=None, progress=print):
+    """Move the sales older than keep_months whole months to archive files and add partitions for the coming months.
+
+    A run that was interrupted is finished first, from the staging tables it left behind.
+    """
+    for (staging,) in database.fetchall(
+        "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE ?",
+        (f"{STAGING}\\_%",),
+    ):
+        progress(f"{staging}: {__finish__(database, directory, staging)} försäljningar arkiverade")
+    for name in closed_partitions(database, keep_months, today):
+        staging = __stage__(database, name)
+        progress(f"{name}: {__finish__(database, directory, staging)} försäljningar arkiverade")
+    for name in ensure_partitions(database, today=today):
+        progress(f"Partition {name} skapad")
+
+
+def __moment__(day):
+    """Return a date as the datetime of its midnight, leaving datetimes and None as they are."""
+    if isinstance(day, date) and not isinstance(day, datetime):
+        return datetime.combine(day, datetime.min.time())
+    return day
+
+
+def archives(database, start=None, end=None):
+    """Return [(file, first date, last date)] of the archives that may hold sales from start up to, not including, end."""
+    return database.fetchall(
+        """
+        SELECT file, first_date, last_date FROM sales_archives
+        WHERE (? IS NULL OR last_date >= ?) AND (? IS NULL OR first_date < ?)
+        ORDER BY first_date
+        """,
+        (start, start, end, end),
+    )
+
+
+def archived_sales(database, directory, start=None, end=None):
+    """Yield the archived sales rows (id, date, ISBN, price, seller) from start up to, not including, end.
+
+    Only the archive files covering the period are read.
+    """
+    start, end = __moment__(start), __moment__(end)
+    for file_name, _, _ in archives(database, start, end):
+        for row in read_archive(os.path.join(directory, file_name)):
+            if (start is None or row[1] >= start) and (end is None or row[1] < end):
+                yield row
+
+
+def read_sales(database, directory, start=None, end=None, isbn=None, seller=None):
+    """Yield the sales rows (id, date, ISBN, price, seller) from start up to, not including, end, archived ones first.
+
+    Only the sales of one title or one seller are yielded if isbn or seller is given. The live table is streamed
+    with a date range, so only its partitions for the period are touched.
+    """
+    for row in archived_sales(database, directory, start, end):
+        if (isbn is None or row[2] == isbn) and (seller is None or row[4] == seller):
+            yield row
+    conditions = []
+    params = []
+    for condition, value in (("date >= ?", start), ("date < ?", end), ("ISBN = ?", isbn), ("seller = ?", seller)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    for rows in database.stream(f"SELECT {SALES_COLUMNS} FROM sales{where} ORDER BY date, id", params):
+        yield from rows
+
+
+def main(argv=None):
+    """Archive closed months, list the archives or show the sales of a title from the command line."""
+    import mariadb  # pylint: disable=import-outside-toplevel
+    import db  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Arkivera gammal försäljning till komprimerade filer.")
+    parser.add_argument("--keep-months", type=int, default=KEEP_MONTHS, help="antal hela månader som stannar i databasen")
+    parser.add_argument("--list", action="store_true", help="visa arkiven och partitionerna utan att arkivera")
+    parser.add_argument("--history", metavar="ISBN", help="visa all försäljning av en titel, även arkiverad")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args(argv)
+    try:
+        database = db.Database(pool_size=1)
+    except mariadb.Error as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
+        return 1
+    directory = archive_directory()
+    try:
+        if args.list:
+            for row in database.fetchall("SELECT file, first_date, last_date, sale_count FROM sales_archives ORDER BY first_date"):
+                print("\t".join(str(value) for value in row))
+            for name, bound in partitions(database):
+                print(f"{name}\t< {bound or 'MAXVALUE'}")
+        elif args.history:
+            end = args.end and args.end + timedelta(days=1)
+            for row in read_sales(database, directory, args.start, end, args.history):
+                print("\t".join("" if value is None else str(value) for value in row))
+        else:
+            archive(database, directory, args.keep_months)
+    except (ArchiveError, mariadb.Error) as e:
+        print(f"Arkiveringen misslyckades: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""Scan-to-sell checkout: books read by a barcode scanner are sold from memory, without dialogs or database lookups."""
+import time
+from collections import Counter, OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import (
+    QAbstractSpinBox,
+    QApplication,
+    QDockWidget,
+    QLabel,
+    QLineEdit,
+    QListWidget,
+    QListWidgetItem,
+    QPlainTextEdit,
+    QPushButton,
+    QTextEdit,
+    QVBoxLayout,
+    QWidget,
+)
+
+from core import canonical_isbn
+from inventory_model import AMOUNT_COLUMN, SELL_PRICE_COLUMN, cell_text
+import metrics
+
+
+BURST_GAP_MS = 30
+MIN_SCAN_LENGTH = 10
+HOT_TITLES = 2000
+AUTHOR_COLUMN = 1
+TITLE_COLUMN = 2
+TEXT_INPUTS = (QLineEdit, QTextEdit, QPlainTextEdit, QAbstractSpinBox)
+
+
+class ScanDetector(QtCore.QObject):
+    """Application event filter telling barcode scanner bursts apart from typing and reporting each scanned code.
+
+    Keys typed while no text input has focus are routed to the scan input instead, so a scan never reaches the
+    table's keyboard search or a focused button. Only keys for window, and the scan input's own window if its dock is
+    floating, are looked at; other windows and dialogs get theirs untouched.
+    """
+
+    scanned = QtCore.pyqtSignal(str)
+
+    def __init__(self, gap_ms=BURST_GAP_MS, min_length=MIN_SCAN_LENGTH, scan_input=None, window=None, parent=None):
+        """Initialize the detector to treat at least min_length keys at most gap_ms apart, ended by Enter, as a scan."""
+        super().__init__(parent)
+        self.window = window
+        self.gap = gap_ms / 1000
+        self.min_length = min_length
+        self.scan_input = scan_input
+        self.burst = []
+        self.last = 0.0
+
+    def eventFilter(self, watched, event):  # pylint: disable=invalid-name
+        """Collect the keys of a burst and report it when the scanner presses Enter."""
+        if event.type() != QtCore.QEvent.KeyPress or event.isAutoRepeat():
+            return False
+        # Application filters see a key once for the window and once more for every widget it propagates to.
+        if watched is not (QApplication.focusWidget() or QApplication.activeWindow()) or not self.__watches__(watched):
+            return False
+        if self.__redirect__(watched, event):
+            return True
+        now = time.perf_counter()
+        fast = now - self.last <= self.gap
+        self.last = now
+        if event.key() in (QtCore.Qt.Key_Return, QtCore.Qt.Key_Enter):
+            code = "".join(self.burst)
+            self.burst = []
+            if not fast or len(code) < self.min_length:
+                return False
+            self.__take_back__(code)
+            self.scanned.emit(code)
+            return True
+        text = event.text()
+        if not text or not text.isprintable():
+            self.burst = []
+            return False
+        if not fast:
+            self.burst = []
+        self.burst.append(text)
+        return False
+
+    def __watches__(self, watched):
+        """Return whether keys for the watched object belong to the window the detector scans for."""
+        if self.window is None:
+            return True
+        if not isinstance(watched, QWidget):
+            return False
+        windows = (self.window, self.scan_input.window() if self.scan_input is not None else self.window)
+        return any(watched.window() is window for window in windows)
+
+    def __redirect__(self, watched, event):
+        """Send a printable key meant for a widget that doesn't take text to the scan input, and focus it."""
+        text = event.text()
+        if self.scan_input is None or not self.scan_input.isVisible() or isinstance(watched, TEXT_INPUTS):
+            return False
+        if not text or not text.isprintable() or event.modifiers() & ~QtCore.Qt.ShiftModifier:
+            return False
+        self.scan_input.setFocus()
+        QApplication.sendEvent(self.scan_input, event)
+        return True
+
+    @staticmethod
+    def __take_back__(code):
+        """Remove a scanned code from the line edit that had focus while it was typed."""
+        widget = QApplication.focusWidget()
+        if isinstance(widget, QLineEdit) and widget.text().endswith(code):
+            widget.setText(widget.text()[: -len(code)])
+
+
+class HotTitles:
+    """Least recently used cache of inventory rows, for resolving scans when the whole inventory isn't in memory."""
+
+    def __init__(self, load, capacity=HOT_TITLES):
+        """Initialize the cache to load missing books with load(isbn), keeping at most capacity of them."""
+        self.load = load
+        self.capacity = capacity
+        self.books = OrderedDict()
+
+    def get(self, isbn):
+        """Return the row tuple of a book, or None if it is not in the inventory."""
+        book = self.books.get(isbn)
+        if book is not None:
+            self.books.move_to_end(isbn)
+            return book
+        book = self.load(isbn)
+        if book is not None:
+            self.books[isbn] = book
+            if len(self.books) > self.capacity:
+                self.books.popitem(last=False)
+        return book
+
+    def set_amounts(self, stock):
+        """Update the amount in stock of the cached books in {isbn: amount}."""
+        for isbn, amount in stock.items():
+            book = self.books.get(isbn)
+            if book is not None:
+                self.books[isbn] = book[:AMOUNT_COLUMN] + (amount,) + book[AMOUNT_COLUMN + 1:]
+
+    def update_books(self, isbns, inventory):
+        """Refresh the cached books among isbns from the freshly read inventory rows, forgetting removed ones."""
+        fetched = {book[0]: book for book in inventory}
+        for isbn in isbns:
+            if isbn in self.books:
+                if isbn in fetched:
+                    self.books[isbn] = fetched[isbn]
+                else:
+                    del self.books[isbn]
+
+
+class CheckoutPanel(QDockWidget):
+    """Dock showing the basket being scanned, with buttons to sell or empty it."""
+
+    sell_requested = QtCore.pyqtSignal(object)
+
+    def __init__(self, resolve, parent=None):
+        """Initialize an empty basket that looks scanned books up with resolve(isbn)."""
+        super().__init__("Kassa", parent)
+        self.setFeatures(QDockWidget.DockWidgetMovable | QDockWidget.DockWidgetFloatable)
+        self.resolve = resolve
+        self.basket = Counter()
+        self.books = {}
+        self.items = {}
+        self.line_scan = QLineEdit()
+        self.line_scan.setPlaceholderText("Skanna eller skriv ISBN")
+        self.line_scan.returnPressed.connect(self.__scan_typed__)
+        self.list_basket = QListWidget()
+        self.label_total = QLabel()
+        self.label_status = QLabel()
+        self.label_status.setWordWrap(True)
+        self.button_sell = QPushButton("Slutför försäljning")
+        self.button_sell.clicked.connect(self.sell)
+        self.button_remove = QPushButton("Ta bort markerad")
+        self.button_remove.clicked.connect(self.remove_selected)
+        self.button_clear = QPushButton("Töm korgen")
+        self.button_clear.clicked.connect(self.clear)
+        for button in (self.button_sell, self.button_remove, self.button_clear):
+            button.setFocusPolicy(QtCore.Qt.NoFocus)
+        layout = QVBoxLayout()
+        for widget in (self.line_scan, self.label_status, self.list_basket, self.label_total, self.button_sell, self.button_remove, self.button_clear):
+            layout.addWidget(widget)
+        contents = QWidget()
+        contents.setLayout(layout)
+        self.setWidget(contents)
+        self.__show_total__()
+
+    def __show_total__(self):
+        """Show the number of books and the total price of the basket."""
+        total = sum((self.books[isbn][SELL_PRICE_COLUMN] or 0) * quantity for isbn, quantity in self.basket.items())
+        self.label_total.setText(f"{sum(self.basket.values())} böcker, totalt {total} kr")
+        self.button_sell.setEnabled(bool(self.basket))
+
+    def __show_line__(self, isbn):
+        """Show or refresh the basket line of a book."""
+        book = self.books[isbn]
+        text = f"{self.basket[isbn]} × {book[TITLE_COLUMN]} ({book[AUTHOR_COLUMN]}) {cell_text(book[SELL_PRICE_COLUMN])} kr"
+        item = self.items.get(isbn)
+        if item is None:
+            item = self.items[isbn] = QListWidgetItem(text, self.list_basket)
+            item.setData(QtCore.Qt.UserRole, isbn)
+        else:
+            item.setText(text)
+        self.list_basket.setCurrentItem(item)
+
+    def __reject__(self, message):
+        """Tell the user a scan wasn't added to the basket, without stopping the next one."""
+        QApplication.beep()
+        self.label_status.setText(message)
+
+    def __scan_typed__(self):
+        """Add the ISBN typed into the scan input by hand."""
+        code = self.line_scan.text().strip()
+        self.line_scan.clear()
+        if code:
+            self.scan(code)
+
+    def scan(self, code):
+        """Add one copy of a scanned book to the basket if it is in stock."""
+        with metrics.timed("ui", "scan"):
+            isbn = canonical_isbn(code)
+            if isbn is None:
+                self.__reject__(f"{code} är inte ett giltigt ISBN.")
+                return
+            book = self.resolve(isbn)
+            if book is None:
+                self.__reject__(f"{isbn} finns inte i lagret.")
+                return
+            if self.basket[isbn] + 1 > (book[AMOUNT_COLUMN] or 0):
+                self.__reject__(f"{book[TITLE_COLUMN]} är slut i lager.")
+                return
+            self.books[isbn] = book
+            self.basket[isbn] += 1
+            self.__show_line__(isbn)
+            self.__show_total__()
+            self.label_status.setText(book[TITLE_COLUMN])
+
+    def remove_selected(self):
+        """Remove one copy of the selected book from the basket."""
+        item = self.list_basket.currentItem()
+        if item is None:
+            return
+        isbn = item.data(QtCore.Qt.UserRole)
+        self.basket[isbn] -= 1
+        if self.basket[isbn]:
+            self.__show_line__(isbn)
+        else:
+            del self.basket[isbn]
+            del self.books[isbn]
+            del self.items[isbn]
+            self.list_basket.takeItem(self.list_basket.row(item))
+        self.__show_total__()
+
+    def clear(self):
+        """Empty the basket."""
+        self.basket.clear()
+        self.books.clear()
+        self.items.clear()
+        self.list_basket.clear()
+        self.label_status.clear()
+        self.__show_total__()
+
+    def sell(self):
+        """Ask for the basket to be sold."""
+        if self.basket:
+            self.sell_requested.emit(Counter(self.basket))
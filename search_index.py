@@ -0,0 +1,154 @@
+"""In-memory search index over the inventory."""
+import re
+import unicodedata
+
+
+KEEP = set("åäö")
+EQUIVALENTS = str.maketrans({"æ": "ä", "ø": "ö", "ß": "ss", "-": None})
+WORD = re.compile(r"\w+")
+SORT_EQUIVALENTS = str.maketrans({"ü": "y"})
+GRAM = 3
+AFTER_Z = str.maketrans({"å": "{", "ä": "|", "ö": "}"})
+
+
+def fold(text):
+    """Fold text for searching: ignore case and diacritics, but keep å, ä and ö apart as Swedish does."""
+    text = text.casefold().translate(EQUIVALENTS)
+    folded = []
+    for char in text:
+        if char in KEEP or char.isascii():
+            folded.append(char)
+        else:
+            folded.append("".join(part for part in unicodedata.normalize("NFD", char) if not unicodedata.combining(part)))
+    return "".join(folded)
+
+
+def collation_key(text):
+    """Return a key that sorts text as Swedish does: ignoring case and most diacritics, with å, ä and ö after z."""
+    if not text:
+        return ""
+    if text.isascii():
+        return text.casefold().translate(EQUIVALENTS)
+    return fold(text.casefold().translate(SORT_EQUIVALENTS)).translate(AFTER_Z)
+
+
+def tokenize(text):
+    """Split text into folded words."""
+    return WORD.findall(fold(text or ""))
+
+
+def grams_of(word):
+    """Return the distinct GRAM letter substrings of a word."""
+    return {word[start:start + GRAM] for start in range(len(word) - GRAM + 1)}
+
+
+def words_of(fields):
+    """Return the distinct folded words of the given field values."""
+    words = set()
+    for value in fields:
+        words.update(tokenize(str(value) if value is not None else ""))
+    return words
+
+
+class SearchIndex:
+    """Inverted index from words to ISBNs, matching query words anywhere inside indexed words.
+
+    The words themselves are indexed by their three letter substrings, so the words containing a query word are found
+    by intersecting a few of those instead of scanning the whole vocabulary. Numbers, mostly ISBNs that each add a
+    word of their own, and words too short to have a substring are kept apart and scanned instead. The index keeps no
+    per-book copy of the words; the inventory store has the fields, so callers pass the fields a book was indexed
+    under when they remove it.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.postings = {}
+        self.grams = {}
+        self.short_words = set()
+        self.numbers = {}  # a dict, as its words are scanned in the order they were added, which is faster than a set
+
+    def add(self, isbn, *fields):
+        """Index a book under the words of the given fields."""
+        for word in words_of(fields):
+            isbns = self.postings.get(word)
+            if isbns is None:
+                isbns = self.postings[word] = set()
+                self.__add_word__(word)
+            isbns.add(isbn)
+
+    def remove(self, isbn, *fields):
+        """Remove a book indexed under the given fields from the index."""
+        for word in words_of(fields):
+            isbns = self.postings.get(word)
+            if isbns is None:
+                continue
+            isbns.discard(isbn)
+            if not isbns:
+                del self.postings[word]
+                self.__remove_word__(word)
+
+    def clear(self):
+        """Remove all books from the index."""
+        self.postings.clear()
+        self.grams.clear()
+        self.short_words.clear()
+        self.numbers.clear()
+
+    def __add_word__(self, word):
+        """Add a new word to the substring index."""
+        if word.isdigit():
+            self.numbers[word] = None
+            return
+        if len(word) < GRAM:
+            self.short_words.add(word)
+        for gram in grams_of(word):
+            self.grams.setdefault(gram, set()).add(word)
+
+    def __remove_word__(self, word):
+        """Remove a word no book has any more from the substring index."""
+        if word.isdigit():
+            self.numbers.pop(word, None)
+            return
+        self.short_words.discard(word)
+        for gram in grams_of(word):
+            words = self.grams.get(gram)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self.grams[gram]
+
+    def words_containing(self, token):
+        """Return the indexed words that contain token."""
+        words = {word for word in self.numbers if token in word} if token.isdigit() else set()
+        if len(token) < GRAM:
+            words.update(word for word in self.short_words if token in word)
+            for gram, gram_words in self.grams.items():
+                if token in gram:
+                    words.update(gram_words)
+            return words
+        candidates = []
+        for gram in grams_of(token):
+            gram_words = self.grams.get(gram)
+            if gram_words is None:
+                return words
+            candidates.append(gram_words)
+        candidates.sort(key=len)
+        found = candidates[0].intersection(*candidates[1:])
+        words.update(found if len(token) == GRAM else (word for word in found if token in word))
+        return words
+
+    def search(self, query):
+        """Return the ISBNs matching every word of the query, or None if the query is empty."""
+        tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not tokens:
+            return None
+        result = None
+        for token in tokens:
+            matches = set()
+            for word in self.words_containing(token):
+                isbns = self.postings[word]
+                matches.update(isbns if result is None else isbns & result)
+            result = matches
+            if not result:
+                break
+        return result
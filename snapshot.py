@@ -0,0 +1,143 @@
+"""Compact, memory-mapped snapshot of the last known inventory, for showing the window before the database answers."""
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import Sequence
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bokhandeln", "inventory.snapshot")
+MAGIC = b"BOKSNAP\0"
+FORMAT = 1
+HEADER = struct.Struct("<8sIIQd")
+NULL = -(2**31)
+TEXT_COLUMNS = (0, 1, 2, 3, 7)
+NUMBER_COLUMNS = (4, 5, 6, 8)
+NULLABLE_TEXT_COLUMNS = (3, 7)
+COLUMN_COUNT = len(TEXT_COLUMNS) + len(NUMBER_COLUMNS)
+
+
+def padding(size):
+    """Return the number of bytes that align size to four bytes."""
+    return -size % 4
+
+
+def write_snapshot(path, rows, version):
+    """Atomically write inventory rows in INVENTORY_COLUMNS order, as of change feed version, to path."""
+    rows = rows if isinstance(rows, Sequence) else list(rows)
+    numbers = {column: array("i") for column in NUMBER_COLUMNS}
+    offsets = {column: array("I", [0]) for column in TEXT_COLUMNS}
+    blobs = {column: bytearray() for column in TEXT_COLUMNS}
+    for row in rows:
+        for column in NUMBER_COLUMNS:
+            numbers[column].append(NULL if row[column] is None else row[column])
+        for column in TEXT_COLUMNS:
+            blobs[column] += (row[column] or "").encode("utf-8")
+            offsets[column].append(len(blobs[column]))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = path + ".part"
+    with open(partial, "wb") as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, FORMAT, len(rows), version, time.time()))
+        for column in NUMBER_COLUMNS:
+            snapshot_file.write(numbers[column].tobytes())
+        for column in TEXT_COLUMNS:
+            snapshot_file.write(offsets[column].tobytes())
+            snapshot_file.write(blobs[column])
+            snapshot_file.write(b"\0" * padding(len(blobs[column])))
+    os.replace(partial, path)
+
+
+class Snapshot(Sequence):
+    """Read-only sequence of inventory rows decoded on demand from a memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        """Map the snapshot at path, raising ValueError if it isn't one."""
+        with open(path, "rb") as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise ValueError(f"{path} är ingen lagerögonblicksbild")
+        magic, file_format, self.count, self.version, self.created = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError(f"{path} är ingen lagerögonblicksbild")
+        if HEADER.size + 4 * self.count * len(NUMBER_COLUMNS) + 4 * (self.count + 1) * len(TEXT_COLUMNS) > len(self.mmap):
+            raise ValueError(f"{path} är avkortad")
+        view = memoryview(self.mmap)
+        position = HEADER.size
+        self.numbers = {}
+        for column in NUMBER_COLUMNS:
+            self.numbers[column] = view[position:position + 4 * self.count].cast("i")
+            position += 4 * self.count
+        self.texts = {}
+        for column in TEXT_COLUMNS:
+            offsets = view[position:position + 4 * (self.count + 1)].cast("I")
+            position += 4 * (self.count + 1)
+            size = offsets[self.count]
+            self.texts[column] = (offsets, view[position:position + size])
+            position += size + padding(size)
+        if position > len(self.mmap):
+            raise ValueError(f"{path} är avkortad")
+
+    def __len__(self):
+        """Return the number of books in the snapshot."""
+        return self.count
+
+    def __text__(self, column, row):
+        """Decode one text cell."""
+        offsets, blob = self.texts[column]
+        text = str(blob[offsets[row]:offsets[row + 1]], "utf-8")
+        if not text and column in NULLABLE_TEXT_COLUMNS:
+            return None
+        return text
+
+    def __getitem__(self, row):
+        """Return the row tuple at the given position, or a list of them for a slice."""
+        if isinstance(row, slice):
+            return [self[position] for position in range(*row.indices(self.count))]
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError(row)
+        numbers = [self.numbers[column][row] for column in NUMBER_COLUMNS]
+        year, buy_price, sell_price, amount = (None if value == NULL else value for value in numbers)
+        isbn, author, title, lang, shelf = (self.__text__(column, row) for column in TEXT_COLUMNS)
+        return (isbn, author, title, lang, year, buy_price, sell_price, shelf, amount)
+
+    def value(self, row, column):
+        """Decode one cell."""
+        if column in self.numbers:
+            value = self.numbers[column][row]
+            return None if value == NULL else value
+        return self.__text__(column, row)
+
+    def isbn(self, row):
+        """Return the ISBN on the given row."""
+        return self.__text__(0, row)
+
+    def column(self, column):
+        """Decode a whole column into a list."""
+        if column in self.numbers:
+            return [None if value == NULL else value for value in self.numbers[column]]
+        offsets, blob = self.texts[column]
+        data = bytes(blob)
+        starts = offsets.tolist()
+        texts = [data[start:end].decode("utf-8") for start, end in zip(starts, starts[1:])]
+        if column in NULLABLE_TEXT_COLUMNS:
+            return [text or None for text in texts]
+        return texts
+
+    def rows(self):
+        """Decode every row at once, much faster than iterating."""
+        return list(zip(*(self.column(column) for column in range(COLUMN_COUNT))))
+
+
+def load_snapshot(path):
+    """Return the snapshot at path, or None if there is no usable one."""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError) as error:
+        if os.path.exists(path):
+            print(f"Ignoring inventory snapshot {path}: {error}")
+        return None
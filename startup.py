@@ -0,0 +1,73 @@
+"""Connecting to the database and catching up with it in the background after a fast start."""
+from PyQt5 import QtCore
+
+from change_feed import latest_version, read_changes
+from core import InventoryRepository
+from inventory_store import InventoryStore
+
+
+def patch_snapshot(snapshot, changed):
+    """Return an InventoryStore of the snapshot with the books in {isbn: row or None} replaced, removed or appended."""
+    store = InventoryStore.from_snapshot(snapshot)
+    store.patch(changed)
+    return store
+
+
+def reconcile(database, snapshot):
+    """Return (change feed version, current inventory store) for a snapshot, the store being None if it is up to date."""
+    if snapshot is not None and snapshot.version:
+        since = snapshot.version
+        changed = {}
+        while True:
+            version, isbns, inventory, reload = read_changes(database, since)
+            if reload:
+                break
+            if not isbns:
+                return since, patch_snapshot(snapshot, changed) if changed else None
+            changed.update(dict.fromkeys(isbns))
+            changed.update((book[0], book) for book in inventory)
+            since = version
+    version = latest_version(database)
+    return version, InventoryStore(InventoryRepository(database).rows())
+
+
+class StartupTask(QtCore.QRunnable):
+    """Runnable that opens the database, migrates it if asked to, and reconciles the snapshot on a worker thread."""
+
+    def __init__(self, startup, snapshot):
+        """Initialize the task to report to startup."""
+        super().__init__()
+        self.startup = startup
+        self.snapshot = snapshot
+
+    def run(self):
+        """Connect and catch up."""
+        # Imported here so the window can appear before the MariaDB driver and the migrations are loaded.
+        import db  # pylint: disable=import-outside-toplevel
+        import migrations  # pylint: disable=import-outside-toplevel
+
+        try:
+            database = db.Database()
+            if self.startup.migrate:
+                migrations.migrate(database, progress=lambda _: None)
+            version, rows = reconcile(database, self.snapshot)
+        except Exception as error:  # pylint: disable=broad-except
+            self.startup.failed.emit(str(error))
+            return
+        self.startup.connected.emit(database, version, rows)
+
+
+class Startup(QtCore.QObject):
+    """Connects to the database in the background and reports back to the GUI thread."""
+
+    connected = QtCore.pyqtSignal(object, object, object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, migrate=True, parent=None):
+        """Initialize the startup, migrating the database first if migrate is set."""
+        super().__init__(parent)
+        self.migrate = migrate
+
+    def start(self, snapshot):
+        """Connect and reconcile snapshot with the database."""
+        QtCore.QThreadPool.globalInstance().start(StartupTask(self, snapshot))
@@ -0,0 +1,100 @@
+"""Batched stock adjustments and sales for the Bokhandeln inventory."""
+from datetime import datetime
+
+
+INSERT_SALE = "INSERT INTO sales (ISBN, date, price, seller) VALUES (?,?,?,?)"
+INSERT_CHANGE = "INSERT INTO inventory_changes (version, ISBN, changed) VALUES (?, ?, ?)"
+RESERVE_VERSIONS = "UPDATE inventory_change_sequence SET version = version + ? WHERE id = 1"
+LAST_VERSION = "SELECT version FROM inventory_change_sequence WHERE id = 1"
+ROLLUP_SALE = """
+    INSERT INTO sales_daily (day, seller, ISBN, units, revenue, cost) VALUES (?, ?, ?, ?, ?, ?)
+    ON DUPLICATE KEY UPDATE
+        units = units + VALUES(units),
+        revenue = revenue + VALUES(revenue),
+        cost = cost + VALUES(cost)
+    """
+
+
+def placeholders(count):
+    """Return a comma separated list of ``count`` query placeholders."""
+    return ", ".join(["?"] * count)
+
+
+def record_changes(database, conn, isbns):
+    """Append the given ISBNs to the inventory change feed, in the caller's transaction.
+
+    Versions are taken from a counter row that stays locked until the transaction ends, so versions become visible
+    in the order they were handed out and a rolled back transaction leaves no gap.
+    """
+    isbns = list(dict.fromkeys(isbns))
+    if not isbns:
+        return
+    database.cursor(conn, RESERVE_VERSIONS).execute(RESERVE_VERSIONS, (len(isbns),))
+    cursor = database.cursor(conn, LAST_VERSION)
+    cursor.execute(LAST_VERSION)
+    first = cursor.fetchone()[0] - len(isbns) + 1
+    now = datetime.now()
+    changes = [(first + offset, isbn, now) for offset, isbn in enumerate(isbns)]
+    database.cursor(conn, INSERT_CHANGE).executemany(INSERT_CHANGE, changes)
+
+
+def apply_deltas(database, conn, deltas):
+    """Change the amount of every ISBN in ``deltas`` by its value with a single UPDATE."""
+    deltas = {isbn: delta for isbn, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    cases = " ".join(["WHEN ? THEN ?"] * len(deltas))
+    params = [value for isbn, delta in deltas.items() for value in (isbn, delta)]
+    sql = f"UPDATE inventory SET amount = amount + CASE ISBN {cases} END WHERE ISBN IN ({placeholders(len(deltas))})"
+    database.cursor(conn, sql).execute(sql, tuple(params) + tuple(deltas))
+    record_changes(database, conn, deltas)
+
+
+def read_books(database, conn, isbns):
+    """Return {isbn: (amount, buy_price)} for each of the given ISBNs that exists."""
+    isbns = list(isbns)
+    if not isbns:
+        return {}
+    sql = f"SELECT ISBN, amount, buy_price FROM inventory WHERE ISBN IN ({placeholders(len(isbns))})"
+    cursor = database.cursor(conn, sql)
+    cursor.execute(sql, tuple(isbns))
+    return {isbn: (amount, buy_price) for isbn, amount, buy_price in cursor.fetchall()}
+
+
+def read_stock(database, conn, isbns):
+    """Return the current amount in stock for each of the given ISBNs that exists."""
+    return {isbn: amount for isbn, (amount, _) in read_books(database, conn, isbns).items()}
+
+
+def adjust_stock(database, deltas):
+    """Apply per-ISBN stock deltas in one transaction and return the stock afterwards."""
+    with database.connection() as conn:
+        apply_deltas(database, conn, deltas)
+        stock = read_stock(database, conn, deltas)
+        conn.commit()
+    return stock
+
+
+def record_sale(database, conn, basket, prices, seller, when):
+    """Record a basket of {isbn: quantity} sold at when in the caller's transaction and return the new stock."""
+    sales = [(isbn, when, prices[isbn], seller) for isbn, quantity in basket.items() for _ in range(quantity)]
+    apply_deltas(database, conn, {isbn: -quantity for isbn, quantity in basket.items()})
+    if sales:
+        database.cursor(conn, INSERT_SALE).executemany(INSERT_SALE, sales)
+    books = read_books(database, conn, basket)
+    rollups = [
+        (when.date(), seller or "", isbn, quantity, int(prices[isbn] or 0) * quantity, (books[isbn][1] or 0) * quantity)
+        for isbn, quantity in basket.items()
+        if quantity and isbn in books
+    ]
+    if rollups:
+        database.cursor(conn, ROLLUP_SALE).executemany(ROLLUP_SALE, rollups)
+    return {isbn: amount for isbn, (amount, _) in books.items()}
+
+
+def sell(database, basket, prices, seller):
+    """Sell a basket of {isbn: quantity} in one transaction, one sales row per copy plus the daily rollup, and return the new stock."""
+    with database.connection() as conn:
+        stock = record_sale(database, conn, basket, prices, seller, datetime.now())
+        conn.commit()
+    return stock
@@ -0,0 +1,99 @@
+"""Tests for the stock valuation and sell-through arithmetic."""
+import pytest
+
+pytest.importorskip("decouple")
+np = pytest.importorskip("numpy")
+pytest.importorskip("PyQt5.QtWidgets")
+
+from analytics import UNKNOWN, GroupValuation, StockData, factorize, number, percent, totals, valuation  # noqa: E402  pylint: disable=wrong-import-position
+
+
+INVENTORY = [
+    ("9789113000015", 2, 100, 150, "A1", "sv", 1994),
+    ("9789113000022", 1, 50, None, "A1", "en", 2003),
+    ("9789113000039", 0, 80, 120, "B2", "sv", 1999),
+    ("9789113000046", None, None, 200, None, None, None),
+    ("9789113000053", -3, 40, 90, "B2", "sv", 2010),
+]
+SALES = [
+    ("9789113000015", 3, 450),
+    ("9789113000039", 4, 480),
+    ("9789113000099", 7, 700),
+]
+
+
+@pytest.fixture(name="data")
+def fixture_data():
+    """A year of stock data for the sample inventory and sales."""
+    return StockData(INVENTORY, SALES, 365)
+
+
+def test_factorize():
+    """Labels are numbered in order of appearance, with missing values grouped as unknown."""
+    codes, labels = factorize(["A1", None, "B2", "A1", ""])
+    assert codes.tolist() == [0, 1, 2, 0, 1]
+    assert labels == ["A1", UNKNOWN, "B2"]
+
+
+def test_percent_is_nan_of_nothing():
+    """A percentage of a zero total is NaN rather than a division error."""
+    result = percent(np.array([1.0, 0.0]), np.array([4.0, 0.0]))
+    assert result[0] == 25
+    assert np.isnan(result[1])
+
+
+def test_number():
+    """NumPy numbers become plain ints or rounded floats, and NaN becomes None."""
+    assert number(np.float64(3.0)) == 3
+    assert isinstance(number(np.float64(3.0)), int)
+    assert number(np.float64(2.345)) == 2.3
+    assert number(np.float64("nan")) is None
+
+
+def test_stock_data(data):
+    """Negative and missing amounts count as zero, and sales of titles no longer in stock are ignored."""
+    assert len(data) == 5
+    assert data.amount.tolist() == [2, 1, 0, 0, 0]
+    assert data.cost.tolist() == [200, 50, 0, 0, 0]
+    assert data.retail.tolist() == [300, 0, 0, 0, 0]
+    assert data.sold.tolist() == [3, 0, 4, 0, 0]
+    assert data.revenue.tolist() == [450, 0, 480, 0, 0]
+
+
+def test_stock_data_without_sales():
+    """A period without sales gives zero sold and zero revenue for every title."""
+    data = StockData(INVENTORY, [], 30)
+    assert data.sold.tolist() == [0] * 5
+    assert data.revenue.tolist() == [0] * 5
+
+
+def test_totals(data):
+    """The totals add up value, margin and sell-through over the whole inventory."""
+    assert totals(data) == {
+        "titles": 5,
+        "copies": 3,
+        "cost": 250,
+        "retail": 300,
+        "margin": 50,
+        "margin_percent": 16.7,
+        "sold": 7,
+        "revenue": 930,
+        "sell_through": 70,
+        "without_buy_price": 0,
+        "without_sell_price": 1,
+    }
+
+
+def test_valuation_by_shelf(data):
+    """Shelves are valued separately, with titles without a shelf grouped as unknown."""
+    assert valuation(data, "shelf") == [
+        GroupValuation("A1", 2, 3, 250, 300, 50, 16.7, 3, 450, 50),
+        GroupValuation("B2", 2, 0, 0, 0, 0, None, 4, 480, 100),
+        GroupValuation(UNKNOWN, 1, 0, 0, 0, 0, None, 0, 0, None),
+    ]
+
+
+def test_valuation_by_decade(data):
+    """Publication years are grouped by decade."""
+    groups = {group.group: group.titles for group in valuation(data, "decade")}
+    assert groups == {"1990-tal": 2, "2000-tal": 1, "2010-tal": 1, UNKNOWN: 1}
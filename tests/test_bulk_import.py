@@ -0,0 +1,71 @@
+"""Tests for parsing shipment files in the bulk import."""
+import pytest
+
+pytest.importorskip("decouple")
+
+from bulk_import import ShipmentLine, parse_price, parse_shipment  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.mark.parametrize("text, price", [("129", 129), ("129,50", 130), ("99.4", 99), (" ", None), ("", None), (None, None)])
+def test_parse_price(text, price):
+    """Prices are rounded to whole kronor and empty cells are None."""
+    assert parse_price(text) == price
+
+
+@pytest.mark.parametrize("delimiter", [",", ";", "\t"])
+def test_dialects(delimiter):
+    """Comma, semicolon and tab separated shipments parse the same way."""
+    lines = [
+        delimiter.join(["9789113000015", "2", "100", "150", "A1"]) + "\n",
+        delimiter.join(["0306406152", "1", "80", "120", "B2"]) + "\n",
+    ]
+    books, invalid = parse_shipment(lines)
+    assert invalid == []
+    assert books == {
+        "9789113000015": ShipmentLine("9789113000015", 2, 100, 150, "A1"),
+        "9780306406157": ShipmentLine("9780306406157", 1, 80, 120, "B2"),
+    }
+
+
+def test_deduplicates_and_sums_amounts():
+    """Repeated ISBNs, in any form, are merged with their amounts summed and the last given prices and shelf kept."""
+    lines = [
+        "9789113000015,2,100,150,A1\n",
+        "978-91-1-300001-5,3,,,\n",
+        "9789113000015\n",
+        "9789113000015,1,90,,B2\n",
+    ]
+    books, invalid = parse_shipment(lines)
+    assert invalid == []
+    assert books == {"9789113000015": ShipmentLine("9789113000015", 7, 90, 150, "B2")}
+
+
+def test_skips_header_without_digits():
+    """A first line without digits is a header and is neither imported nor reported."""
+    books, invalid = parse_shipment(["ISBN;antal;inköpspris;säljpris;hylla\n", "9789113000015;2;100;150;A1\n"])
+    assert invalid == []
+    assert list(books) == ["9789113000015"]
+
+
+def test_reports_invalid_first_line():
+    """A first line with digits that isn't a valid ISBN is reported as invalid instead of being taken for a header."""
+    books, invalid = parse_shipment(["9789113000016,2\n", "9789113000015,1\n"])
+    assert invalid == ["9789113000016,2"]
+    assert list(books) == ["9789113000015"]
+
+
+@pytest.mark.parametrize(
+    "line",
+    ["9789113000015,två", "9789113000015,0", "9789113000015,-1", "9789113000015,1,gratis", "9789113000015,1,100,-5", "inte ett isbn,1"],
+)
+def test_invalid_lines(line):
+    """Lines with a bad ISBN, a non-positive or non-numeric amount or a negative or non-numeric price are invalid."""
+    books, invalid = parse_shipment(["9789113000022,1\n", line + "\n"])
+    assert invalid == [line]
+    assert list(books) == ["9789113000022"]
+
+
+def test_empty_shipment():
+    """Blank files and blank lines give no books and no invalid lines."""
+    assert parse_shipment([]) == ({}, [])
+    assert parse_shipment(["\n", "   \n"]) == ({}, [])
@@ -0,0 +1,33 @@
+"""Tests for ISBN parsing in the headless core."""
+import pytest
+
+pytest.importorskip("decouple")
+
+from core import canonical_isbn  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.mark.parametrize(
+    "text, isbn",
+    [
+        ("9789113000015", "9789113000015"),
+        ("978-91-1-300001-5", "9789113000015"),
+        (" 978 91 1300001 5\n", "9789113000015"),
+        ("0306406152", "9780306406157"),
+        ("0-306-40615-2", "9780306406157"),
+        ("080442957X", "9780804429573"),
+        ("080442957x", "9780804429573"),
+        ("9791000000015", "9791000000015"),
+    ],
+)
+def test_canonical_isbn(text, isbn):
+    """ISBN-10 and ISBN-13, with or without separators, become ISBN-13."""
+    assert canonical_isbn(text) == isbn
+
+
+@pytest.mark.parametrize(
+    "text",
+    [None, "", "9789113000016", "0306406153", "08044295X7", "9771234567898", "978911300001", "97891130000155", "abc"],
+)
+def test_canonical_isbn_rejects_invalid(text):
+    """Text with a bad checksum, prefix or length is not an ISBN."""
+    assert canonical_isbn(text) is None
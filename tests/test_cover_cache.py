@@ -0,0 +1,116 @@
+"""Tests for the on-disk cover cache, against a cover server on localhost."""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("decouple")
+pytest.importorskip("requests")
+QtGui = pytest.importorskip("PyQt5.QtGui")
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice  # noqa: E402  pylint: disable=wrong-import-position
+
+from cover_cache import CoverCache  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def png_bytes():
+    """Return a small PNG cover."""
+    image = QtGui.QImage(20, 30, QtGui.QImage.Format_RGB32)
+    image.fill(0x336699)
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    return bytes(data)
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """Serve the same PNG under /covers/*, garbage under /broken and 404 elsewhere, counting the requests."""
+    cover = png_bytes()
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        """Answer cover requests from memory."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Send a cover, undecodable bytes or a 404 depending on the path."""
+            requests.append(self.path)
+            if self.path.startswith("/covers/"):
+                body = cover
+            elif self.path == "/broken":
+                body = b"not an image"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            """Keep the test output quiet."""
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.requests = requests
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def files(directory):
+    """Return the names of the files in the cache directory."""
+    return sorted(os.listdir(directory))
+
+
+def test_miss_then_disk_hit(server, tmp_path):
+    """A miss downloads and stores the cover; the next lookup reads it from disk without a request."""
+    cache = CoverCache(str(tmp_path))
+    url = server.base + "/covers/a"
+    image = cache.image(url)
+    assert image is not None and not image.isNull()
+    assert server.requests == ["/covers/a"]
+    assert files(tmp_path) == [os.path.basename(cache.path(url))]
+    assert cache.total == os.path.getsize(cache.path(url))
+
+    again = cache.image(url)
+    assert again is not None and again.size() == image.size()
+    assert server.requests == ["/covers/a"]
+
+
+def test_evicts_least_recently_used(server, tmp_path):
+    """Storing past max_bytes removes the least recently used thumbnail, and a new cache finds the rest on disk."""
+    cache = CoverCache(str(tmp_path))
+    first, second, third = (server.base + "/covers/" + name for name in "abc")
+    cache.image(first)
+    size = os.path.getsize(cache.path(first))
+    cache.max_bytes = 2 * size
+    cache.image(second)
+    cache.image(first)
+    cache.image(third)
+
+    assert os.path.exists(cache.path(first))
+    assert not os.path.exists(cache.path(second))
+    assert os.path.exists(cache.path(third))
+    assert cache.total == 2 * size
+
+    reopened = CoverCache(str(tmp_path), max_bytes=2 * size)
+    assert reopened.total == 2 * size
+    smaller = CoverCache(str(tmp_path), max_bytes=size)
+    assert smaller.total == size
+    assert len(files(tmp_path)) == 1
+
+
+@pytest.mark.parametrize("path", ["/missing", "/broken"])
+def test_failed_fetch_leaves_no_file(server, tmp_path, path):
+    """A cover that can't be fetched or decoded returns None and leaves nothing in the cache directory."""
+    cache = CoverCache(str(tmp_path))
+    assert cache.image(server.base + path) is None
+    assert files(tmp_path) == []
+    assert cache.total == 0
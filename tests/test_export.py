@@ -0,0 +1,64 @@
+"""Tests for the chunking and file writers of the export."""
+import csv
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("decouple")
+pytest.importorskip("PyQt5.QtWidgets")
+
+from export import COLUMN_TYPES, CsvWriter, JsonLinesWriter, chunks, default_path  # noqa: E402  pylint: disable=wrong-import-position
+
+
+SALES = [
+    (1, datetime(2024, 1, 31, 12, 0), "9789113000015", 129, "Åsa"),
+    (2, datetime(2024, 2, 1, 9, 30), None, None, None),
+]
+
+
+@pytest.mark.parametrize(
+    "count, size, lengths",
+    [(0, 3, []), (1, 3, [1]), (3, 3, [3]), (7, 3, [3, 3, 1]), (6, 2, [2, 2, 2])],
+)
+def test_chunks(count, size, lengths):
+    """Rows are split into lists of at most size, in order."""
+    result = list(chunks(iter(range(count)), size))
+    assert [len(chunk) for chunk in result] == lengths
+    assert [row for chunk in result for row in chunk] == list(range(count))
+
+
+def test_default_path():
+    """The default file name is the table and format, with .gz only where gzip applies."""
+    assert default_path("inventory", "csv", False) == "inventory.csv"
+    assert default_path("sales", "jsonl", True) == "sales.jsonl.gz"
+    assert default_path("sales", "parquet", True) == "sales.parquet"
+
+
+def test_csv_writer(tmp_path):
+    """CSV exports start with a header and write None as an empty cell."""
+    path = str(tmp_path / "sales.csv.gz")
+    writer = CsvWriter(path, COLUMN_TYPES["sales"], True)
+    writer.write(SALES)
+    writer.close()
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as exported:
+        assert list(csv.reader(exported)) == [
+            ["id", "date", "ISBN", "price", "seller"],
+            ["1", "2024-01-31 12:00:00", "9789113000015", "129", "Åsa"],
+            ["2", "2024-02-01 09:30:00", "", "", ""],
+        ]
+
+
+def test_json_lines_writer(tmp_path):
+    """JSON Lines exports write one object per row, with ISO dates and null for None."""
+    path = str(tmp_path / "sales.jsonl")
+    writer = JsonLinesWriter(path, COLUMN_TYPES["sales"], False)
+    writer.write(SALES[:1])
+    writer.write(SALES[1:])
+    writer.close()
+    with open(path, encoding="utf-8") as exported:
+        assert [json.loads(line) for line in exported] == [
+            {"id": 1, "date": "2024-01-31T12:00:00", "ISBN": "9789113000015", "price": 129, "seller": "Åsa"},
+            {"id": 2, "date": "2024-02-01T09:30:00", "ISBN": None, "price": None, "seller": None},
+        ]
@@ -0,0 +1,102 @@
+"""Tests for the sales archive file format and the monthly partitions of sales."""
+import lzma
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("decouple")
+
+from sales_archive import (  # noqa: E402  pylint: disable=wrong-import-position
+    UNDATED,
+    ArchiveError,
+    add_months,
+    initial_partitions,
+    partition_name,
+    read_archive,
+    write_archive,
+)
+
+
+SALES = [
+    (1, datetime(2023, 1, 31, 23, 59, 59), "9789113000015", 129, "Anna"),
+    (2, datetime(2023, 1, 1, 0, 0, 0), "9789113000022", None, "Bertil"),
+    (3, UNDATED, None, 0, None),
+    (2**40, datetime(2023, 1, 15, 12, 30, 0), "9789113000015", 2**31 - 1, "Åsa Öberg"),
+]
+
+
+def test_round_trip(tmp_path):
+    """An archive reads back the sales it was written with and leaves no partial file."""
+    path = str(tmp_path / "archive" / "p202301.sales.xz")
+    write_archive(path, SALES)
+    assert read_archive(path) == SALES
+    assert not (tmp_path / "archive" / "p202301.sales.xz.part").exists()
+
+
+def test_round_trip_without_sales(tmp_path):
+    """An archive of no sales reads back as empty."""
+    path = str(tmp_path / "empty.sales.xz")
+    write_archive(path, [])
+    assert not read_archive(path)
+
+
+def test_read_rejects_other_files(tmp_path):
+    """Files that aren't sales archives raise ArchiveError."""
+    path = tmp_path / "other.xz"
+    with lzma.open(path, "wb") as other:
+        other.write(b"inte ett arkiv, men tillr\xc3\xa4ckligt l\xc3\xa5ngt")
+    with pytest.raises(ArchiveError):
+        read_archive(str(path))
+
+
+def test_read_rejects_truncated_files(tmp_path):
+    """Truncated archives raise ArchiveError."""
+    path = str(tmp_path / "p202301.sales.xz")
+    write_archive(path, SALES)
+    with lzma.open(path, "rb") as archive_file:
+        data = archive_file.read()
+    with lzma.open(path, "wb") as archive_file:
+        archive_file.write(data[:-5])
+    with pytest.raises(ArchiveError):
+        read_archive(path)
+
+
+def test_read_rejects_missing_files(tmp_path):
+    """A missing archive raises ArchiveError."""
+    with pytest.raises(ArchiveError):
+        read_archive(str(tmp_path / "missing.sales.xz"))
+
+
+def test_add_months():
+    """Adding months crosses year boundaries in both directions."""
+    assert add_months(date(2023, 11, 1), 1) == date(2023, 12, 1)
+    assert add_months(date(2023, 12, 1), 1) == date(2024, 1, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert add_months(date(2024, 3, 1), -27) == date(2021, 12, 1)
+
+
+def test_partition_name_is_the_month_before_its_bound():
+    """A partition is named after the month that ends at its bound."""
+    assert partition_name(date(2024, 1, 1)) == "p202312"
+    assert partition_name(date(2024, 10, 1)) == "p202409"
+
+
+def test_initial_partitions():
+    """There is a partition per month from the first sale to ahead months after today, and a catch-all at both ends."""
+    assert initial_partitions(datetime(2023, 11, 20, 10, 0), date(2024, 1, 5), ahead=1) == (
+        "PARTITION `p_before` VALUES LESS THAN ('2023-11-01'), "
+        "PARTITION `p202311` VALUES LESS THAN ('2023-12-01'), "
+        "PARTITION `p202312` VALUES LESS THAN ('2024-01-01'), "
+        "PARTITION `p202401` VALUES LESS THAN ('2024-02-01'), "
+        "PARTITION `p202402` VALUES LESS THAN ('2024-03-01'), "
+        "PARTITION `p_future` VALUES LESS THAN (MAXVALUE)"
+    )
+
+
+def test_initial_partitions_of_a_new_database():
+    """When the first sale is today, only the current month and the catch-alls are created."""
+    assert initial_partitions(date(2024, 1, 5), date(2024, 1, 5), ahead=0) == (
+        "PARTITION `p_before` VALUES LESS THAN ('2024-01-01'), "
+        "PARTITION `p202401` VALUES LESS THAN ('2024-02-01'), "
+        "PARTITION `p_future` VALUES LESS THAN (MAXVALUE)"
+    )
@@ -0,0 +1,124 @@
+"""Tests for the in-memory search index."""
+import pytest
+
+from search_index import SearchIndex, collation_key, fold, tokenize
+
+
+@pytest.mark.parametrize(
+    "text, folded",
+    [
+        ("Lagerlöf", "lagerlöf"),
+        ("ÅSA", "åsa"),
+        ("Brontë", "bronte"),
+        ("Müller", "muller"),
+        ("Ærø", "ärö"),
+        ("Straße", "strasse"),
+        ("91-1-300001", "911300001"),
+    ],
+)
+def test_fold(text, folded):
+    """Folding lowercases, strips foreign accents, expands ligatures and drops punctuation."""
+    assert fold(text) == folded
+
+
+def test_fold_keeps_swedish_letters_apart():
+    """Å, ä and ö are letters of their own and are not folded to a or o."""
+    assert fold("å") != fold("a")
+    assert fold("ä") != fold("a")
+    assert fold("ö") != fold("o")
+
+
+def test_collation_key_sorts_swedish():
+    """Names sort in Swedish order, with å, ä and ö after z."""
+    words = ["Östlund", "Zorn", "Åberg", "adler", "Ärlig", "Öberg", "Andersson", "Émile", "Yngve", "Über"]
+    assert sorted(words, key=collation_key) == [
+        "adler", "Andersson", "Émile", "Über", "Yngve", "Zorn", "Åberg", "Ärlig", "Öberg", "Östlund",
+    ]
+
+
+def test_collation_key_of_nothing():
+    """None and empty text sort first."""
+    assert collation_key(None) == ""
+    assert collation_key("") == ""
+
+
+def test_tokenize():
+    """Text is split into folded words."""
+    assert tokenize("Selma Lagerlöf: Gösta Berlings saga") == ["selma", "lagerlöf", "gösta", "berlings", "saga"]
+    assert not tokenize(None)
+
+
+@pytest.fixture(name="index")
+def fixture_index():
+    """An index of four books."""
+    index = SearchIndex()
+    index.add("9789113000015", "9789113000015", "Astrid Lindgren", "Bröderna Lejonhjärta")
+    index.add("9789113000022", "9789113000022", "Selma Lagerlöf", "Gösta Berlings saga")
+    index.add("9789113000039", "9789113000039", "Tove Jansson", "Sommarboken")
+    index.add("9789113000046", "9789113000046", "Per Wahlöö", "Brandbilen som försvann")
+    return index
+
+
+@pytest.mark.parametrize(
+    "query, isbns",
+    [
+        ("lindgren", {"9789113000015"}),
+        ("LINDGREN", {"9789113000015"}),
+        ("ind", {"9789113000015"}),
+        ("br", {"9789113000015", "9789113000046"}),
+        ("b", {"9789113000015", "9789113000022", "9789113000039", "9789113000046"}),
+        ("som", {"9789113000039", "9789113000046"}),
+        ("sommar jansson", {"9789113000039"}),
+        ("lagerlof", set()),
+        ("lagerlöf", {"9789113000022"}),
+        ("97891130000", {"9789113000015", "9789113000022", "9789113000039", "9789113000046"}),
+        ("0022", {"9789113000022"}),
+        ("978-91-1300003", {"9789113000039"}),
+        ("lindgren jansson", set()),
+        ("xyz", set()),
+    ],
+)
+def test_search(index, query, isbns):
+    """Queries match word and ISBN substrings, and every word of a query must match."""
+    assert index.search(query) == isbns
+
+
+def test_empty_query_matches_everything(index):
+    """A query without words returns None, meaning no filter."""
+    assert index.search("") is None
+    assert index.search(" - ") is None
+
+
+def test_remove(index):
+    """A removed book no longer matches any of its words."""
+    index.remove("9789113000039", "9789113000039", "Tove Jansson", "Sommarboken")
+    assert index.search("som") == {"9789113000046"}
+    assert index.search("jansson") == set()
+    assert index.search("0039") == set()
+
+
+def test_remove_leaves_the_same_index_as_never_adding():
+    """Removing a book leaves no trace of it in the index."""
+    books = [
+        ("9789113000015", "Astrid Lindgren", "Bröderna Lejonhjärta"),
+        ("9789113000022", "Selma Lagerlöf", "Gösta Berlings saga"),
+        ("9789113000039", "Tove Jansson", "Sommarboken"),
+    ]
+    index = SearchIndex()
+    for isbn, *fields in books:
+        index.add(isbn, isbn, *fields)
+    index.remove(books[0][0], *books[0])
+    expected = SearchIndex()
+    for isbn, *fields in books[1:]:
+        expected.add(isbn, isbn, *fields)
+    assert index.postings == expected.postings
+    assert index.grams == expected.grams
+    assert index.short_words == expected.short_words
+    assert index.numbers == expected.numbers
+
+
+def test_clear(index):
+    """Clearing empties the index."""
+    index.clear()
+    assert index.search("lindgren") == set()
+    assert not index.grams
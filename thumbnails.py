@@ -0,0 +1,115 @@
+"""Cover thumbnails for the inventory table, decoded on worker threads for the rows the view asks for."""
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QPixmap
+
+from core import NO_COVER, InventoryRepository
+
+
+TABLE_SIZE = QtCore.QSize(32, 48)
+MAX_PIXMAPS = 2000
+BATCH_SIZE = 48
+MAX_TASKS = 2
+DISPATCH_DELAY_MS = 40
+
+
+def scale_to_table(image):
+    """Scale a cover thumbnail down to table size, keeping its aspect ratio."""
+    return image.scaled(TABLE_SIZE, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    """Runnable that reads the cover URLs of a batch of books and fetches, decodes and scales their covers."""
+
+    def __init__(self, loader, isbns):
+        """Initialize the task to report to loader."""
+        super().__init__()
+        self.loader = loader
+        self.isbns = isbns
+
+    def run(self):
+        """Load the batch, leaving out books without a cover or whose cover can't be fetched."""
+        images = {}
+        try:
+            urls = InventoryRepository(self.loader.database).covers(self.isbns)
+            for isbn in self.isbns:
+                image = self.loader.covers.image(urls[isbn]) if urls.get(isbn) else None
+                if image is not None:
+                    images[isbn] = scale_to_table(image)
+        except Exception as error:  # pylint: disable=broad-except
+            self.loader.task_done.emit(self.isbns, images, str(error))
+            return
+        self.loader.task_done.emit(self.isbns, images, "")
+
+
+class ThumbnailLoader(QtCore.QObject):
+    """Loads table-sized covers in the background, most recently asked for first, and keeps a bounded number of them."""
+
+    thumbnail_ready = QtCore.pyqtSignal(str)
+    task_done = QtCore.pyqtSignal(object, object, str)
+
+    def __init__(self, database, covers, capacity=MAX_PIXMAPS, parent=None):
+        """Initialize the loader to read cover URLs from database and fetch covers through the cover cache."""
+        super().__init__(parent)
+        self.database = database
+        self.covers = covers
+        self.capacity = capacity
+        self.pixmaps = OrderedDict()
+        self.wanted = OrderedDict()
+        self.loading = set()
+        self.running = 0
+        self.error = ""
+        self.placeholder = QPixmap(NO_COVER).scaled(TABLE_SIZE, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DISPATCH_DELAY_MS)
+        self.timer.timeout.connect(self.__dispatch__)
+        self.task_done.connect(self.__finish__)
+
+    def pixmap(self, isbn):
+        """Return the thumbnail of a book, or the placeholder while it loads or if it has no cover."""
+        pixmap = self.pixmaps.get(isbn)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(isbn)
+            return pixmap
+        if isbn not in self.loading:
+            self.wanted[isbn] = None
+            self.wanted.move_to_end(isbn)
+            if not self.timer.isActive():
+                self.timer.start()
+        return self.placeholder
+
+    def forget(self, isbns):
+        """Drop the thumbnails of books whose cover may have changed."""
+        for isbn in isbns:
+            self.pixmaps.pop(isbn, None)
+
+    def __dispatch__(self):
+        """Start loading the books asked for most recently; the ones scrolled past are asked for again if they come back."""
+        if self.running >= MAX_TASKS or not self.wanted:
+            return
+        batch = list(self.wanted)[-BATCH_SIZE:]
+        self.wanted.clear()
+        self.loading.update(batch)
+        self.running += 1
+        self.pool.start(ThumbnailTask(self, batch))
+
+    def __finish__(self, isbns, images, error):
+        """Turn the decoded thumbnails of a finished task into pixmaps and tell the model."""
+        self.running -= 1
+        self.loading.difference_update(isbns)
+        if error and error != self.error:
+            print(f"Loading cover thumbnails failed: {error}")
+        self.error = error
+        if not error:
+            for isbn in isbns:
+                image = images.get(isbn)
+                self.pixmaps[isbn] = self.placeholder if image is None else QPixmap.fromImage(image)
+                self.pixmaps.move_to_end(isbn)
+                self.thumbnail_ready.emit(isbn)
+            while len(self.pixmaps) > self.capacity:
+                self.pixmaps.popitem(last=False)
+        if self.wanted and not self.timer.isActive():
+            self.timer.start()